@@ -0,0 +1,123 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from vllm import LLM
+from vllm.lora.request import LoRARequest
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownAdapterError(KeyError):
+    """
+    Raised when a request selects an adapter that is not registered on the server.
+    """
+
+
+class AdapterRegistry:
+    """
+    Registry of the LoRA adapters served on top of the base model.
+
+    Adapters are loaded into the engine lazily on first use. At most `max_loaded` adapters are kept
+    loaded at a time, matching the number of LoRA slots the engine reserved on the GPU; when a new adapter
+    is needed and all slots are taken, the least recently used adapter that is not needed by the current
+    batch is evicted.
+
+    Attributes:
+        llm (LLM): The engine the adapters are loaded into.
+        paths (Dict[str, str]): Local path or hub name of every registered adapter, by adapter name.
+        max_loaded (int): Maximum number of adapters loaded at the same time.
+        loaded (OrderedDict[str, LoRARequest]): Loaded adapters, from least to most recently used.
+    """
+
+    def __init__(self, llm: LLM, paths: Dict[str, str], max_loaded: int):
+        """
+        Initializes the registry and assigns every adapter a stable integer id.
+
+        Args:
+            llm (LLM): The engine the adapters are loaded into.
+            paths (Dict[str, str]): Local path or hub name of every registered adapter, by adapter name.
+            max_loaded (int): Maximum number of adapters loaded at the same time.
+        """
+        self.llm = llm
+        self.paths = paths
+        self.max_loaded = max_loaded
+        self.loaded: "OrderedDict[str, LoRARequest]" = OrderedDict()
+        self._requests = {
+            name: LoRARequest(lora_name=name, lora_int_id=lora_int_id, lora_path=path)
+            for lora_int_id, (name, path) in enumerate(sorted(paths.items()), start=1)
+        }
+
+    def resolve(self, name: Optional[str]) -> Optional[LoRARequest]:
+        """
+        Resolves an adapter name from a request into the engine LoRA request.
+
+        Args:
+            name (Optional[str]): The adapter name, or None for the base model.
+
+        Returns:
+            Optional[LoRARequest]: The LoRA request, or None for the base model.
+
+        Raises:
+            UnknownAdapterError: If the adapter is not registered.
+        """
+        if name is None:
+            return None
+        if name not in self._requests:
+            raise UnknownAdapterError(name)
+        return self._requests[name]
+
+    def activate(self, lora_requests: Iterable[Optional[LoRARequest]]) -> None:
+        """
+        Makes sure all the adapters needed by a batch are loaded, evicting the least recently
+        used ones that the batch does not need.
+
+        Args:
+            lora_requests (Iterable[Optional[LoRARequest]]): LoRA requests of the batch items.
+
+        Raises:
+            ValueError: If the batch needs more distinct adapters than there are slots.
+        """
+        needed = {lora_request.lora_name: lora_request for lora_request in lora_requests if lora_request is not None}
+        if len(needed) > self.max_loaded:
+            raise ValueError(f"Batch needs {len(needed)} adapters, but only {self.max_loaded} slots are available")
+
+        for name, lora_request in needed.items():
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                continue
+
+            while len(self.loaded) >= self.max_loaded:
+                victim = next(loaded_name for loaded_name in self.loaded if loaded_name not in needed)
+                self.llm.llm_engine.remove_lora(self.loaded.pop(victim).lora_int_id)
+                logger.info(f"Evicted adapter {victim}")
+
+            self.llm.llm_engine.add_lora(lora_request)
+            self.loaded[name] = lora_request
+            logger.info(f"Loaded adapter {name} from {lora_request.lora_path}")
+
+    def waves(self, lora_requests: Sequence[Optional[LoRARequest]]) -> List[List[int]]:
+        """
+        Splits batch items into waves that each fit into the available adapter slots, so every
+        wave can be generated in a single call with mixed adapters.
+
+        Args:
+            lora_requests (Sequence[Optional[LoRARequest]]): LoRA requests of the batch items.
+
+        Returns:
+            List[List[int]]: Indices of the batch items in every wave.
+        """
+        waves: List[List[int]] = []
+        wave_adapters: List[set] = []
+        for index, lora_request in enumerate(lora_requests):
+            name = lora_request.lora_name if lora_request is not None else None
+            for wave, adapters in zip(waves, wave_adapters):
+                if name is None or name in adapters or len(adapters) < self.max_loaded:
+                    wave.append(index)
+                    if name is not None:
+                        adapters.add(name)
+                    break
+            else:
+                waves.append([index])
+                wave_adapters.append({name} if name is not None else set())
+        return waves
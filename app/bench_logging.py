@@ -0,0 +1,91 @@
+import argparse
+import logging
+import logging.handlers
+import queue
+import tempfile
+import time
+
+import logger as logging_setup
+
+
+class SlowFileHandler(logging.FileHandler):
+    """
+    File handler emulating a slow sink, such as a busy disk or a stderr pipe nobody drains.
+
+    Attributes:
+        latency (float): Seconds every write takes on top of the actual write.
+    """
+
+    def __init__(self, path: str, latency: float):
+        super().__init__(path, encoding="utf-8")
+        self.latency = latency
+        self.setFormatter(logging_setup.JsonFormatter())
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+def measure(log: logging.Logger, calls: int, **extra) -> float:
+    """
+    Measures the time a log call blocks the calling thread.
+
+    Args:
+        log (logging.Logger): The logger to call.
+        calls (int): Number of calls.
+        **extra: Fields logged with every record.
+
+    Returns:
+        float: Mean microseconds per call.
+    """
+    started_at = time.perf_counter()
+    for index in range(calls):
+        log.info("Generated answer %d", index, extra={"request_id": "bench", "tokens": index, **extra})
+    return (time.perf_counter() - started_at) / calls * 1e6
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the per-call overhead of the app logging.")
+    parser.add_argument("--calls", type=int, default=20_000, help="Number of log calls per configuration.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Extra seconds every write to the sink takes.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Compares how long a log call blocks the caller with a synchronous JSON file handler and with the
+    same handler behind the queue used by `logger.setup`, and the cost of a sampled record that is dropped.
+    """
+    args = parse_arguments()
+    log = logging.getLogger("bench")
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        sink = SlowFileHandler(f"{log_dir}/bench.log", args.latency)
+
+        root.handlers = [sink]
+        print(f"sync handler: {measure(log, args.calls):.2f} us/call")
+
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(records)
+        queue_handler.addFilter(logging_setup.SamplingFilter(0.0))
+        queue_handler.addFilter(logging_setup.RequestIdFilter())
+        root.handlers = [queue_handler]
+
+        listener = logging.handlers.QueueListener(records, sink)
+        listener.start()
+        print(f"queued handler: {measure(log, args.calls):.2f} us/call")
+        listener.stop()
+
+        listener.start()
+        print(f"dropped sampled record: {measure(log, args.calls, sampled=True):.2f} us/call")
+        listener.stop()
+        sink.close()
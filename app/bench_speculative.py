@@ -0,0 +1,161 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from chat import build_prompt
+from config import Settings
+from speculative import AcceptanceStats, NgramProposer, simulate, speculative_kwargs
+
+
+def load_samples(path: str) -> List[Tuple[str, str]]:
+    """
+    Loads the evaluation dialogues as pairs of the first user query and the reference answer.
+
+    Args:
+        path (str): Path to a JSON list of dialogues in the format of `prompts/evaluate.json`.
+
+    Returns:
+        List[Tuple[str, str]]: The queries with their reference answers.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        dialogues = json.load(f)
+    return [(dialogue["messages"][0]["content"], dialogue["messages"][1]["content"]) for dialogue in dialogues]
+
+
+def measure_acceptance(settings: Settings, samples: List[Tuple[str, str]]) -> AcceptanceStats:
+    """
+    Replays prompt-lookup speculative decoding of the reference answers, assuming the model generates
+    exactly the reference.
+
+    Args:
+        settings (Settings): Settings with the tokenizer and the n-gram lookup parameters.
+        samples (List[Tuple[str, str]]): The queries with their reference answers.
+
+    Returns:
+        AcceptanceStats: The draft acceptance statistics.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(settings.WEIGHTS_DIR or settings.MODEL_NAME)
+    proposer = NgramProposer(
+        settings.NUM_SPECULATIVE_TOKENS, settings.NGRAM_PROMPT_LOOKUP_MAX, settings.NGRAM_PROMPT_LOOKUP_MIN
+    )
+    stats = AcceptanceStats()
+    for query, answer in samples:
+        prompt = tokenizer.encode(build_prompt(tokenizer, query))
+        simulate(proposer, prompt, tokenizer.encode(answer, add_special_tokens=False), stats)
+    return stats
+
+
+def measure_latency(settings: Settings, samples: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    Generates every query one at a time and measures the end-to-end latency.
+
+    Args:
+        settings (Settings): The inference server settings of the engine to measure.
+        samples (List[Tuple[str, str]]): The queries with their reference answers.
+
+    Returns:
+        Dict[str, Any]: Latency percentiles in seconds and the mean number of generated tokens.
+    """
+    from engine import generate
+    from vllm import LLM, SamplingParams
+
+    llm = LLM(
+        model=settings.WEIGHTS_DIR or settings.MODEL_NAME,
+        dtype="half",
+        tensor_parallel_size=settings.TENSOR_PARALLEL_SIZE,
+        **speculative_kwargs(settings),
+    )
+    tokenizer = llm.get_tokenizer()
+    sampling_params = SamplingParams(temperature=0, max_tokens=settings.MAX_NEW_TOKENS, stop=["<|eot_id|>"])
+
+    generate(llm, [build_prompt(tokenizer, samples[0][0])], sampling_params)
+    latencies, tokens = [], []
+    for query, _ in samples:
+        started_at = time.perf_counter()
+        generation = generate(llm, [build_prompt(tokenizer, query)], sampling_params, stop_at_json_end=True)[0]
+        latencies.append(time.perf_counter() - started_at)
+        tokens.append(generation.num_tokens)
+
+    latencies.sort()
+    return {
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "tokens": statistics.mean(tokens),
+    }
+
+
+def run_engine(engine: str, data: str) -> Dict[str, Any]:
+    """
+    Measures the latency of one engine configuration in a separate process, so that both engines
+    get the whole GPU memory.
+
+    Args:
+        engine (str): `baseline` or `speculative`.
+        data (str): Path to the evaluation dialogues.
+
+    Returns:
+        Dict[str, Any]: The latency measurement of the engine.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        subprocess.run(  # noqa: S603
+            [sys.executable, __file__, "--data", data, "--engine", engine, "--output", output.name],
+            check=True,
+        )
+        with open(output.name, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark prompt-lookup speculative decoding.")
+    parser.add_argument("--data", type=str, default="prompts/evaluate.json", help="Path to the evaluation dialogues.")
+    parser.add_argument("--latency", action="store_true", help="Also compare end-to-end latency on the GPU.")
+    parser.add_argument("--engine", choices=["baseline", "speculative"], help=argparse.SUPPRESS)
+    parser.add_argument("--output", type=str, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Reports the draft acceptance rate of prompt-lookup speculative decoding on the evaluation dialogues and,
+    with `--latency`, the end-to-end latency of the engine with and without it.
+    """
+    args = parse_arguments()
+    settings = Settings.from_env()
+    samples = load_samples(args.data)
+
+    if args.engine:
+        settings = settings.model_copy(update={"SPECULATIVE": args.engine == "speculative", "ADAPTERS": {}})
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(measure_latency(settings, samples), f)
+        sys.exit(0)
+
+    stats = measure_acceptance(settings, samples)
+    print(
+        f"Acceptance: samples={len(samples)}, answer_tokens={stats.generated}, proposed={stats.proposed}, "
+        f"accepted={stats.accepted}, acceptance_rate={stats.acceptance_rate:.2%}, "
+        f"tokens_per_step={stats.tokens_per_step:.2f}"
+    )
+
+    if args.latency:
+        baseline = run_engine("baseline", args.data)
+        speculative = run_engine("speculative", args.data)
+        for name, result in (("baseline", baseline), ("speculative", speculative)):
+            print(
+                f"Latency {name}: mean={result['mean']:.3f}s, p50={result['p50']:.3f}s, "
+                f"p95={result['p95']:.3f}s, tokens={result['tokens']:.1f}"
+            )
+        print(f"Mean latency change: {speculative['mean'] / baseline['mean'] - 1:+.1%}")
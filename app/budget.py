@@ -0,0 +1,243 @@
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIELD_TOKENS: Dict[str, Tuple[float, float]] = {
+    "thoughts.text": (21.0, 13.0),
+    "thoughts.reasoning": (37.0, 22.0),
+    "thoughts.plan": (34.0, 20.0),
+    "thoughts.criticism": (25.0, 15.0),
+    "thoughts.speak": (31.0, 19.0),
+    "command.name": (4.0, 2.0),
+    "command.args": (6.0, 10.0),
+}
+
+# DEFAULT_FIELD_TOKENS: Initial (mean, standard deviation) of the token length of every answer field, estimated
+# from the answers in `prompts/train_results.jsonl`. Replaced by the observed lengths as the server answers.
+
+
+class JsonObjectEnd:
+    """
+    Incrementally finds the end of the first top-level JSON object in a growing text, so the
+    generation can stop as soon as the answer object is balanced.
+
+    Attributes:
+        end (Optional[int]): Position right after the closing brace of the object, once it is generated.
+    """
+
+    def __init__(self):
+        self.end: Optional[int] = None
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> Optional[int]:
+        """
+        Scans the part of the text not seen yet.
+
+        Args:
+            text (str): The whole text generated so far.
+
+        Returns:
+            Optional[int]: Position right after the end of the object, or None if it is not balanced yet.
+        """
+        if self.end is not None:
+            return self.end
+
+        for index in range(self._position, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._depth > 0:
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = index + 1
+                    return self.end
+
+        self._position = len(text)
+        return None
+
+
+class TokenBudgeter:
+    """
+    Estimates how many tokens an answer needs from the answer schema and the lengths of
+    the fields in previous answers.
+
+    The budget is the token length of the answer skeleton, plus the expected length of every field, plus
+    a safety margin of `z` standard deviations of the total, capped by the context left after the prompt.
+
+    Attributes:
+        tokenizer (Any): The tokenizer of the served model.
+        fields (List[str]): Dotted paths of the answer fields whose lengths are tracked.
+        skeleton_tokens (int): Token length of the answer with all the fields empty.
+        max_model_len (int): Context length of the model.
+        min_tokens (int): Lower bound of the budget.
+        max_tokens (int): Upper bound of the budget.
+        z (float): Number of standard deviations added to the expected length.
+        decay (float): Weight of a new observation in the moving averages.
+        path (Optional[str]): File the field statistics are persisted to.
+        stats (Dict[str, List[float]]): Moving mean and variance of the token length of every field.
+        observed (int): Number of answers observed.
+        budgeted_tokens (int): Total budget of the observed answers.
+        generated_tokens (int): Total generated tokens of the observed answers.
+        truncated (int): Number of answers that ran out of budget before the JSON object was complete.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        json_schema: Dict[str, Any],
+        max_model_len: int,
+        *,
+        min_tokens: int = 64,
+        max_tokens: int = 768,
+        z: float = 2.0,
+        decay: float = 0.05,
+        path: Optional[str] = None,
+        log_every: int = 100,
+    ):
+        self.tokenizer = tokenizer
+        self.max_model_len = max_model_len
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.z = z
+        self.decay = decay
+        self.path = path
+        self.log_every = log_every
+
+        skeleton = self._skeleton(json_schema)
+        self.fields = list(self._leaves(skeleton))
+        self.skeleton_tokens = self._count(json.dumps(skeleton, ensure_ascii=False))
+        self.stats: Dict[str, List[float]] = {
+            field: [mean, std**2] for field, (mean, std) in DEFAULT_FIELD_TOKENS.items() if field in self.fields
+        }
+        for field in self.fields:
+            self.stats.setdefault(field, [32.0, 400.0])
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.stats.update({field: stat for field, stat in json.load(f).items() if field in self.stats})
+
+        self.observed = 0
+        self.budgeted_tokens = 0
+        self.generated_tokens = 0
+        self.truncated = 0
+
+    def budget(self, prompt_tokens: int) -> int:
+        """
+        Computes the generation limit for a prompt.
+
+        Args:
+            prompt_tokens (int): Token length of the prompt.
+
+        Returns:
+            int: The maximum number of tokens to generate.
+        """
+        mean = sum(stat[0] for stat in self.stats.values())
+        std = math.sqrt(sum(stat[1] for stat in self.stats.values()))
+        estimate = math.ceil(self.skeleton_tokens + mean + self.z * std)
+        estimate = min(max(estimate, self.min_tokens), self.max_tokens)
+        return max(1, min(estimate, self.max_model_len - prompt_tokens))
+
+    def observe(self, text: str, num_tokens: int, budget: int) -> None:
+        """
+        Records a finished generation and updates the field length statistics with it.
+
+        Args:
+            text (str): The generated text.
+            num_tokens (int): Number of generated tokens.
+            budget (int): The generation limit the text was generated with.
+        """
+        self.observed += 1
+        self.budgeted_tokens += budget
+        self.generated_tokens += num_tokens
+
+        try:
+            answer = json.loads(text)
+        except json.JSONDecodeError:
+            answer = None
+
+        if not isinstance(answer, dict):
+            if num_tokens >= budget:
+                self.truncated += 1
+        else:
+            for field in self.fields:
+                value = self._lookup(answer, field)
+                if value is None:
+                    continue
+                length = self._count(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+                mean, variance = self.stats[field]
+                delta = length - mean
+                mean += self.decay * delta
+                variance = (1 - self.decay) * (variance + self.decay * delta**2)
+                self.stats[field] = [mean, variance]
+
+        if self.observed % self.log_every == 0:
+            self.log()
+            self.save()
+
+    def log(self) -> None:
+        """
+        Logs the actual vs. budgeted token counts of the observed answers.
+        """
+        logger.info(
+            f"Token budget: answers={self.observed}, "
+            f"mean_budget={self.budgeted_tokens / max(self.observed, 1):.1f}, "
+            f"mean_generated={self.generated_tokens / max(self.observed, 1):.1f}, "
+            f"truncated={self.truncated}, next_budget={self.budget(0)}"
+        )
+
+    def save(self) -> None:
+        """
+        Persists the field length statistics, so the estimates survive restarts.
+        """
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.stats, f)
+        os.replace(tmp_path, self.path)
+
+    def _count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    @classmethod
+    def _skeleton(cls, schema: Dict[str, Any], depth: int = 0) -> Any:
+        """
+        Builds the answer with all the fields empty. Objects below the second level, such as the
+        command arguments, have no fixed keys and are treated as a single field.
+        """
+        if schema.get("type") == "object" and depth < 2:
+            return {key: cls._skeleton(value, depth + 1) for key, value in schema.get("properties", {}).items()}
+        return "" if schema.get("type") == "string" else None
+
+    @classmethod
+    def _leaves(cls, skeleton: Any, prefix: str = ""):
+        for key, value in skeleton.items():
+            path = f"{prefix}{key}"
+            if isinstance(value, dict):
+                yield from cls._leaves(value, f"{path}.")
+            else:
+                yield path
+
+    @staticmethod
+    def _lookup(answer: Dict[str, Any], field: str) -> Any:
+        value: Any = answer
+        for key in field.split("."):
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        return value
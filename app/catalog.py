@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import math
+import re
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+HEADER_PATTERN = re.compile(r"^\s*(?P<header>[^\n]*?(?:функциями|Команды)\s*:)(?P<separator>\s*)")
+FUNCTION_PATTERN = re.compile(r"'(?P<name>\w+)',\s*(?:аргументы|args)\s*:")
+ARGUMENT_PATTERN = re.compile(r"\s*,?\s*'(?P<name>[^'\n]+)'\s*:\s*'(?P<description>[^'\n]*)'")
+NGRAM_SIZE = 3
+
+# HEADER_PATTERN: Opening of a prompt with a function catalog, e.g. "Вы -- полезный помощник со следующими функциями:"
+#   or "Команды:", and the whitespace before the first function.
+# FUNCTION_PATTERN: Name of a catalog function followed by its argument list, e.g. "'book_hotel', аргументы:".
+# ARGUMENT_PATTERN: An argument of a catalog function, e.g. "'city': '<Город>'".
+# NGRAM_SIZE: Length of the character n-grams the functions and the requests are matched by. Character n-grams
+#   match different forms of Russian words, e.g. "бронирование" and "забронировать".
+
+
+@dataclass
+class Function:
+    """
+    A function of a catalog.
+
+    Attributes:
+        name (str): The function name the model calls.
+        text (str): The catalog entry of the function as written in the prompt.
+        description (str): The description of the function.
+        arguments (List[str]): The names and descriptions of the arguments.
+    """
+
+    name: str
+    text: str
+    description: str
+    arguments: List[str] = field(default_factory=list)
+
+    @property
+    def document(self) -> str:
+        return " ".join([self.description, self.name.replace("_", " "), *self.arguments])
+
+
+@dataclass
+class Catalog:
+    """
+    A user message starting with a function catalog.
+
+    Attributes:
+        header (str): The opening of the message before the functions.
+        separator (str): The whitespace between the header and the first function.
+        functions (List[Function]): The functions, in the order of the catalog.
+        request (str): The user request following the catalog.
+    """
+
+    header: str
+    separator: str
+    functions: List[Function]
+    request: str
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256("\n".join(function.text for function in self.functions).encode()).hexdigest()
+
+    def render(self, functions: List[Function]) -> str:
+        """
+        Writes the message back with a subset of the functions, in their catalog order.
+
+        Args:
+            functions (List[Function]): The functions to keep.
+
+        Returns:
+            str: The message.
+        """
+        entries = "\n".join(function.text for function in functions)
+        return f"{self.header}{self.separator or ' '}{entries}\n{self.request}"
+
+
+def parse_catalog(content: str) -> Optional[Catalog]:
+    """
+    Splits a user message into the function catalog and the request in one pass over the anchors of the
+    function names. A function entry runs from the end of the previous one to the end of its arguments,
+    the request is whatever follows the last entry.
+
+    Args:
+        content (str): The user message.
+
+    Returns:
+        Optional[Catalog]: The catalog, or None if the message does not start with one.
+    """
+    header = HEADER_PATTERN.match(content)
+    if header is None:
+        return None
+
+    functions = []
+    position = header.end()
+    for anchor in FUNCTION_PATTERN.finditer(content, position):
+        if anchor.start() < position:
+            continue
+        description = content[position : anchor.start()].strip().rstrip(":").strip()
+        arguments = []
+        end = anchor.end()
+        argument = ARGUMENT_PATTERN.match(content, end)
+        while argument is not None:
+            arguments.append(f"{argument['name']} {argument['description'].strip('<>')}")
+            end = argument.end()
+            argument = ARGUMENT_PATTERN.match(content, end)
+        if content.startswith(".", end):
+            end += 1
+        text = content[position:end].strip()
+        functions.append(Function(anchor["name"], text, description, arguments))
+        position = end
+
+    if not functions:
+        return None
+    return Catalog(header["header"], header["separator"], functions, content[position:].strip())
+
+
+def ngrams(text: str, size: int = NGRAM_SIZE) -> List[str]:
+    """
+    Splits a text into the character n-grams of its words, padded with spaces.
+
+    Args:
+        text (str): The text.
+        size (int, optional): Length of the n-grams.
+
+    Returns:
+        List[str]: The n-grams, with repetitions.
+    """
+    grams: List[str] = []
+    for word in re.findall(r"\w+", text.lower()):
+        word = f" {word} "
+        grams.extend(word[index : index + size] for index in range(max(1, len(word) - size + 1)))
+    return grams
+
+
+class BM25Index:
+    """
+    Okapi BM25 index of a few documents over character n-grams.
+
+    Attributes:
+        k1 (float): Term frequency saturation.
+        b (float): Document length normalization.
+    """
+
+    def __init__(self, documents: List[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._frequencies = [Counter(ngrams(document)) for document in documents]
+        self._lengths = [sum(frequencies.values()) for frequencies in self._frequencies]
+        self._mean_length = sum(self._lengths) / max(len(self._lengths), 1)
+        document_frequencies = Counter(gram for frequencies in self._frequencies for gram in frequencies)
+        self._idf = {
+            gram: math.log(1 + (len(documents) - count + 0.5) / (count + 0.5))
+            for gram, count in document_frequencies.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """
+        Scores every document against a query.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            List[float]: The score of every document, in the order of the documents.
+        """
+        grams = set(ngrams(query)) & self._idf.keys()
+        scores = []
+        for frequencies, length in zip(self._frequencies, self._lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / max(self._mean_length, 1))
+            scores.append(
+                sum(
+                    self._idf[gram] * frequencies[gram] * (self.k1 + 1) / (frequencies[gram] + norm)
+                    for gram in grams
+                    if gram in frequencies
+                )
+            )
+        return scores
+
+
+@dataclass
+class Selection:
+    """
+    Result of shrinking the catalog of a user message.
+
+    Attributes:
+        content (str): The message to prompt with.
+        total (int): Number of functions in the catalog, 0 if the message has no catalog.
+        kept (int): Number of functions left in the message.
+        fallback (bool): Whether the full catalog was kept because the ranking was not confident.
+        tokens_saved (int): Number of prompt tokens removed, or characters without a tokenizer.
+    """
+
+    content: str
+    total: int = 0
+    kept: int = 0
+    fallback: bool = False
+    tokens_saved: int = 0
+
+
+class FunctionRetriever:
+    """
+    Shrinks long function catalogs to the functions relevant to the request, since the prefill cost of
+    a prompt grows with the catalog size.
+
+    The functions are ranked against the request of the same message with BM25 over character n-grams.
+    The index of a catalog is built once and cached by the catalog hash. The top `top_k` functions are
+    kept in their catalog order. As a safety fallback, the full catalog is kept when no function matches
+    the request at all, or when a dropped function scores almost as high as the best one.
+
+    A message is always rewritten the same way, so the conversations keep their prompt prefixes. The
+    selections of recent messages are cached too, since the first message of a conversation, the one with
+    the catalog, is sent again with every turn.
+
+    Attributes:
+        top_k (int): Number of functions kept, 0 disables the retrieval.
+        fallback_ratio (float): The full catalog is kept if the best dropped function scores at least this
+            fraction of the best function.
+        tokenizer (Optional[Any]): The tokenizer of the served model, used to count the saved tokens.
+        max_indexes (int): Maximum number of cached catalog indexes and message selections.
+        log_every (int): Number of messages with a catalog between two statistics log records.
+        catalogs (int): Number of messages with a catalog seen.
+        shrunk (int): Number of catalogs shrunk.
+        fallbacks (int): Number of catalogs kept in full by the safety fallback.
+        tokens_saved (int): Total number of prompt tokens removed.
+    """
+
+    def __init__(
+        self,
+        top_k: int = 3,
+        fallback_ratio: float = 0.9,
+        tokenizer: Optional[Any] = None,
+        max_indexes: int = 256,
+        log_every: int = 100,
+    ):
+        self.top_k = top_k
+        self.fallback_ratio = fallback_ratio
+        self.tokenizer = tokenizer
+        self.max_indexes = max_indexes
+        self.log_every = log_every
+        self.catalogs = 0
+        self.shrunk = 0
+        self.fallbacks = 0
+        self.tokens_saved = 0
+        self._indexes: OrderedDict[str, BM25Index] = OrderedDict()
+        self._selections: OrderedDict[str, Selection] = OrderedDict()
+
+    def select(self, content: str) -> Selection:
+        """
+        Shrinks the function catalog of a user message.
+
+        Args:
+            content (str): The user message.
+
+        Returns:
+            Selection: The message to prompt with and what was removed from it.
+        """
+        selection = self._selections.get(content)
+        if selection is not None:
+            self._selections.move_to_end(content)
+            return selection
+
+        catalog = parse_catalog(content) if self.top_k > 0 else None
+        if catalog is None:
+            return Selection(content)
+
+        self.catalogs += 1
+        total = len(catalog.functions)
+        selection = Selection(content, total=total, kept=total)
+        if total > self.top_k:
+            scores = self._index(catalog).scores(catalog.request)
+            ranking = sorted(range(total), key=lambda index: -scores[index])
+            best, best_dropped = scores[ranking[0]], scores[ranking[self.top_k]]
+            if best <= 0 or best_dropped >= self.fallback_ratio * best:
+                self.fallbacks += 1
+                selection.fallback = True
+            else:
+                kept = sorted(ranking[: self.top_k])
+                selection.content = catalog.render([catalog.functions[index] for index in kept])
+                selection.kept = len(kept)
+                selection.tokens_saved = self._count(content) - self._count(selection.content)
+                self.shrunk += 1
+                self.tokens_saved += selection.tokens_saved
+
+        self._selections[content] = selection
+        while len(self._selections) > self.max_indexes:
+            self._selections.popitem(last=False)
+        if self.catalogs % self.log_every == 0:
+            self.log()
+        return selection
+
+    def log(self) -> None:
+        """
+        Logs how many catalogs were shrunk and the prompt tokens saved.
+        """
+        logger.info(
+            f"Function retrieval: catalogs={self.catalogs}, shrunk={self.shrunk}, "
+            f"fallbacks={self.fallbacks}, tokens_saved={self.tokens_saved}"
+        )
+
+    def _index(self, catalog: Catalog) -> BM25Index:
+        key = catalog.key
+        index = self._indexes.get(key)
+        if index is None:
+            index = BM25Index([function.document for function in catalog.functions])
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(key)
+        return index
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return len(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
@@ -0,0 +1,182 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+ANSWER_INSTRUCTION = """Отвечай в основном на русском. Выбранные аргументы "args" тоже должны быть на русском языке"""
+ROLE_TAGS = {"user": "user", "bot": "assistant"}
+
+# ANSWER_INSTRUCTION: Instruction appended to every user message, the model was tuned to answer in Russian.
+# ROLE_TAGS: Chat template role of every message role of the API, the same mapping as in the training configs.
+
+Turn = Tuple[str, str]
+
+
+def build_prompt(tokenizer: Any, query: str, messages: Sequence[Turn] = ()) -> str:
+    """
+    Wraps the conversation and the user query into the model chat template.
+
+    The instruction is appended to every user message rather than only to the last one, so a message is
+    rendered the same way on every turn and the prompt of a turn starts with the prompt of the previous one.
+
+    Args:
+        tokenizer (Any): The tokenizer of the served model.
+        query (str): The query text.
+        messages (Sequence[Turn], optional): The previous messages of the conversation, as (role, content)
+            pairs with the `user` and `bot` roles.
+
+    Returns:
+        str: The formatted prompt ready for generation.
+    """
+    return tokenizer.apply_chat_template(
+        [
+            {
+                "role": ROLE_TAGS[role],
+                "content": content + "\n" + ANSWER_INSTRUCTION if role == "user" else content,
+            }
+            for role, content in [*messages, ("user", query)]
+        ],
+        tokenize=False,
+        add_generation_prompt=True,
+    )
+
+
+@dataclass
+class Prompt:
+    """
+    Prompt of one turn of a conversation.
+
+    Attributes:
+        text (str): The formatted prompt.
+        token_ids (List[int]): The tokens of the prompt.
+        sent (List[Turn]): The messages of the turn as the client sent them, the query included.
+        rendered (List[Turn]): The messages the prompt was rendered from.
+        reused_tokens (int): Number of leading tokens taken over from the previous turn instead of
+            being tokenized again.
+    """
+
+    text: str
+    token_ids: List[int]
+    sent: List[Turn]
+    rendered: List[Turn]
+    reused_tokens: int = 0
+
+
+@dataclass
+class Conversation:
+    """
+    A conversation as of its last answered turn.
+
+    Attributes:
+        sent (List[Turn]): The messages as the client knows them, the last answer included.
+        rendered (List[Turn]): The messages as the model saw them: the answers are the generated texts
+            rather than the reformatted texts returned to the client.
+        text (str): The prompt of the last turn followed by the generated answer.
+        token_ids (List[int]): The tokens of `text`.
+        expires_at (float): Monotonic time after which the conversation is forgotten.
+    """
+
+    sent: List[Turn]
+    rendered: List[Turn]
+    text: str
+    token_ids: List[int]
+    expires_at: float
+
+
+class SessionCache:
+    """
+    Builds the prompts of multi-turn conversations incrementally.
+
+    The prompt of every turn extends the prompt and the answer of the previous turn, so only the new
+    messages are tokenized, and, with prefix caching enabled, the engine finds the key-value blocks of the
+    whole conversation so far cached and only prefills the new tokens. For the prefix to match token for
+    token, the answers the client sends back are replaced with the texts the model actually generated.
+
+    The sessions live in the memory of the inference worker, an unknown or expired session is rebuilt
+    from the messages the client sends.
+
+    Attributes:
+        tokenizer (Any): The tokenizer of the served model.
+        max_sessions (int): Maximum number of conversations kept, the least recently used are forgotten.
+        ttl (float): Seconds a conversation is kept after its last turn.
+        turns (int): Number of prompts built.
+        reused_tokens (int): Number of prompt tokens taken over from the previous turns.
+        prompt_tokens (int): Number of prompt tokens in total.
+    """
+
+    def __init__(self, tokenizer: Any, max_sessions: int = 1024, ttl: float = 1800):
+        self.tokenizer = tokenizer
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.turns = 0
+        self.reused_tokens = 0
+        self.prompt_tokens = 0
+        self._conversations: OrderedDict[str, Conversation] = OrderedDict()
+
+    def prompt(self, query: str, messages: Sequence[Turn] = (), session_id: Optional[str] = None) -> Prompt:
+        """
+        Builds the prompt of a turn.
+
+        Args:
+            query (str): The query text.
+            messages (Sequence[Turn], optional): The previous messages of the conversation.
+            session_id (Optional[str], optional): Id of the conversation, the prompt is built from
+                scratch if not set.
+
+        Returns:
+            Prompt: The prompt of the turn.
+        """
+        sent = [*messages, ("user", query)]
+        rendered = list(sent)
+        conversation = self._get(session_id)
+        if conversation is not None:
+            for index, (known, generated) in enumerate(zip(conversation.sent, conversation.rendered)):
+                if index >= len(sent) or sent[index] != known:
+                    break
+                rendered[index] = generated
+
+        text = build_prompt(self.tokenizer, query, rendered[:-1])
+        if conversation is not None and text.startswith(conversation.text):
+            suffix = self.tokenizer.encode(text[len(conversation.text) :], add_special_tokens=False)
+            prompt = Prompt(text, conversation.token_ids + suffix, sent, rendered, len(conversation.token_ids))
+        else:
+            prompt = Prompt(text, self.tokenizer.encode(text), sent, rendered)
+
+        self.turns += 1
+        self.reused_tokens += prompt.reused_tokens
+        self.prompt_tokens += len(prompt.token_ids)
+        return prompt
+
+    def record(self, session_id: Optional[str], prompt: Prompt, answer: str, generated: str) -> None:
+        """
+        Remembers the answered turn of a conversation.
+
+        Args:
+            session_id (Optional[str]): Id of the conversation, nothing is remembered if not set.
+            prompt (Prompt): The prompt of the turn.
+            answer (str): The answer returned to the client.
+            generated (str): The text the model generated for the answer.
+        """
+        if session_id is None or self.max_sessions <= 0:
+            return
+        generated = generated.strip()
+        self._conversations[session_id] = Conversation(
+            sent=[*prompt.sent, ("bot", answer)],
+            rendered=[*prompt.rendered, ("bot", generated)],
+            text=prompt.text + generated,
+            token_ids=prompt.token_ids + self.tokenizer.encode(generated, add_special_tokens=False),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        self._conversations.move_to_end(session_id)
+        while len(self._conversations) > self.max_sessions:
+            self._conversations.popitem(last=False)
+
+    def _get(self, session_id: Optional[str]) -> Optional[Conversation]:
+        if session_id is None:
+            return None
+        conversation = self._conversations.get(session_id)
+        if conversation is None or conversation.expires_at <= time.monotonic():
+            self._conversations.pop(session_id, None)
+            return None
+        self._conversations.move_to_end(session_id)
+        return conversation
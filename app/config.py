@@ -0,0 +1,136 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, field_validator, model_validator
+
+
+class Settings(BaseModel):
+    """
+    Inference server settings loaded from environment variables.
+
+    Every attribute can be overridden by an environment variable with the same name, values are
+    validated and coerced by Pydantic.
+
+    Attributes:
+        MODEL_NAME (str): Hugging Face name of the merged model, used when no local weights are available.
+        WEIGHTS_DIR (Optional[str]): Local directory with pre-converted safetensors weights and the manifest
+            written by `training/export_model.py`. When it is complete, the engine memory-maps the weights from
+            it instead of resolving the model from the hub.
+        TENSOR_PARALLEL_SIZE (int): Number of GPUs the engine shards the model over.
+        READY_FILE (str): Marker file written by the inference worker once warmup is finished.
+        WARMUP_BATCH_SIZE (int): Number of representative prompts generated in one batch during warmup.
+        ADAPTERS (Dict[str, str]): LoRA adapters served on top of the model, as a mapping from adapter
+            name to local path or hub name. Passed as a JSON object in the environment.
+        MAX_LORAS (int): Number of adapter slots reserved on the GPU, i.e. how many adapters can be
+            loaded and mixed in one batch.
+        MAX_LORA_RANK (int): Maximum rank of the served adapters.
+        MAX_BATCH_SIZE (int): Maximum number of requests generated in one batch.
+        BATCH_TIMEOUT (float): Time in seconds the server waits to fill a batch.
+        CANCEL_DIR (str): Directory shared by the API server and the inference worker, where the
+            server marks requests whose clients disconnected.
+        MIN_NEW_TOKENS (int): Lower bound of the per-request generation limit.
+        MAX_NEW_TOKENS (int): Upper bound of the per-request generation limit.
+        BUDGET_FILE (Optional[str]): File the observed answer field lengths are persisted to, so the
+            generation limit estimates survive restarts.
+        SPECULATIVE (bool): Enables prompt-lookup (n-gram) speculative decoding. Not supported together
+            with LoRA adapters.
+        NUM_SPECULATIVE_TOKENS (int): Number of draft tokens verified per forward pass.
+        NGRAM_PROMPT_LOOKUP_MAX (int): Longest n-gram looked up in the context to propose a draft.
+        NGRAM_PROMPT_LOOKUP_MIN (int): Shortest n-gram looked up in the context to propose a draft.
+        PREFIX_CACHING (bool): Keeps the key-value blocks of processed prompts cached in the engine, so the
+            turns of a conversation only prefill the tokens added since the previous turn.
+        SESSION_CACHE_SIZE (int): Maximum number of conversations whose previous turn is remembered by the
+            inference worker, 0 disables the sessions.
+        SESSION_TTL (float): Seconds a conversation is remembered after its last turn.
+        CATALOG_TOP_K (int): Number of functions of a function catalog kept in the prompt, the ones most relevant
+            to the request. 0 keeps the catalogs in full.
+        CATALOG_FALLBACK_RATIO (float): The full catalog is kept if a dropped function scores at least this
+            fraction of the most relevant one.
+        SEMANTIC_CACHE (bool): Answers single-turn queries similar enough to a previous query with its answer.
+        SEMANTIC_CACHE_THRESHOLD (float): Minimum cosine similarity of the query embeddings for a cache hit.
+        SEMANTIC_CACHE_SIZE (int): Maximum number of cached answers, the least recently used are evicted.
+        SEMANTIC_CACHE_TTL (float): Seconds a cached answer stays valid.
+        SEMANTIC_CACHE_FILE (Optional[str]): File the semantic cache is persisted to, so it survives restarts.
+        LOG_LEVEL (str): Minimum level of the logged records.
+        LOG_DIR (Optional[str]): Directory of the JSON log files, one per process. Logs go to stderr only if not set.
+        LOG_MAX_BYTES (int): Size at which a log file is rotated.
+        LOG_BACKUPS (int): Number of rotated, gzipped log files kept per process.
+        LOG_SAMPLE_RATE (float): Fraction of the high-volume per-request debug records kept.
+        STREAM (bool): Streams the answers of `/assist` as newline-delimited JSON events instead of
+            returning them at once.
+    """
+
+    MODEL_NAME: str = "GoshaLetov/T-Lite-sft-no-optimizer"
+    WEIGHTS_DIR: Optional[str] = None
+    TENSOR_PARALLEL_SIZE: int = 4
+    READY_FILE: str = "/tmp/assist.ready"  # noqa: S108
+    WARMUP_BATCH_SIZE: int = 4
+    ADAPTERS: Dict[str, str] = {}
+    MAX_LORAS: int = 2
+    MAX_LORA_RANK: int = 16
+    MAX_BATCH_SIZE: int = 8
+    BATCH_TIMEOUT: float = 0.05
+    CANCEL_DIR: str = "/dev/shm/assist-cancel"  # noqa: S108
+    MIN_NEW_TOKENS: int = 64
+    MAX_NEW_TOKENS: int = 768
+    BUDGET_FILE: Optional[str] = None
+    SPECULATIVE: bool = False
+    NUM_SPECULATIVE_TOKENS: int = 5
+    NGRAM_PROMPT_LOOKUP_MAX: int = 4
+    NGRAM_PROMPT_LOOKUP_MIN: int = 1
+    PREFIX_CACHING: bool = True
+    SESSION_CACHE_SIZE: int = 1024
+    SESSION_TTL: float = 1800
+    CATALOG_TOP_K: int = 3
+    CATALOG_FALLBACK_RATIO: float = 0.9
+    SEMANTIC_CACHE: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.9
+    SEMANTIC_CACHE_SIZE: int = 10000
+    SEMANTIC_CACHE_TTL: float = 86400
+    SEMANTIC_CACHE_FILE: Optional[str] = None
+    LOG_LEVEL: str = "INFO"
+    LOG_DIR: Optional[str] = None
+    LOG_MAX_BYTES: int = 50 * 1024 * 1024
+    LOG_BACKUPS: int = 10
+    LOG_SAMPLE_RATE: float = 0.01
+    STREAM: bool = False
+
+    @field_validator("ADAPTERS", mode="before")
+    @classmethod
+    def parse_json(cls, value: Any) -> Any:
+        """
+        Parses mapping settings passed as JSON strings.
+
+        Args:
+            value (Any): The raw setting value.
+
+        Returns:
+            Any: The parsed mapping, or the value unchanged if it is not a string.
+        """
+        return json.loads(value) if isinstance(value, str) else value
+
+    @model_validator(mode="after")
+    def check_speculative(self) -> "Settings":
+        """
+        Rejects combinations of features the engine does not support.
+
+        Returns:
+            Settings: The validated settings.
+
+        Raises:
+            ValueError: If speculative decoding is enabled together with LoRA adapters.
+        """
+        if self.SPECULATIVE and self.ADAPTERS:
+            raise ValueError("Speculative decoding does not support LoRA adapters")
+        return self
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        Builds settings from the process environment.
+
+        Returns:
+            Settings: Settings with defaults overridden by the matching environment variables.
+        """
+        return cls.model_validate({name: os.environ[name] for name in cls.model_fields if name in os.environ})
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import pathlib
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "x-request-deadline"
+REQUEST_ID_HEADER = "x-request-id"
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# DEADLINE_HEADER: Header with the Unix timestamp after which the client no longer waits for the answer.
+# REQUEST_ID_HEADER: Header with the client-side request id, prefixed to the unique id generated by the server.
+# REQUEST_ID_PATTERN: Accepted client-side request ids; the id names a marker file, so it must be a safe file name.
+
+
+class RequestCancelledError(Exception):
+    """
+    Raised when a request is abandoned by its client while it is being processed.
+
+    Attributes:
+        reason (str): Why the request was cancelled, `deadline` or `disconnected`.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+
+
+class Cancellation:
+    """
+    Tells whether the client of a request still waits for the answer.
+
+    The API server and the inference worker run in different processes, so a client disconnect is
+    signalled through a marker file named after the request id in a shared directory.
+
+    Attributes:
+        deadline (Optional[float]): Unix timestamp after which the answer is no longer needed.
+        marker (Optional[pathlib.Path]): Marker file created by the API server when the client disconnects.
+        request_id (Optional[str]): Id of the request, for logging.
+    """
+
+    def __init__(self, deadline: Optional[float], marker: Optional[pathlib.Path], request_id: Optional[str] = None):
+        self.deadline = deadline
+        self.marker = marker
+        self.request_id = request_id
+
+    @classmethod
+    def for_request(cls, deadline: Optional[float], request_id: Optional[str], cancel_dir: str) -> "Cancellation":
+        """
+        Creates the cancellation for a request.
+
+        Args:
+            deadline (Optional[float]): Unix timestamp of the request deadline.
+            request_id (Optional[str]): The request id assigned by the API server.
+            cancel_dir (str): Directory with the disconnect markers.
+
+        Returns:
+            Cancellation: The cancellation of the request.
+        """
+        marker = pathlib.Path(cancel_dir) / request_id if request_id else None
+        return cls(deadline=deadline, marker=marker, request_id=request_id)
+
+    def reason(self) -> Optional[str]:
+        """
+        Checks whether the request was abandoned.
+
+        Returns:
+            Optional[str]: `deadline` or `disconnected` if the request was abandoned, None otherwise.
+        """
+        if self.deadline is not None and time.time() > self.deadline:
+            return "deadline"
+        if self.marker is not None and self.marker.exists():
+            return "disconnected"
+        return None
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Stops processing of an abandoned request.
+
+        Raises:
+            RequestCancelledError: If the request was abandoned.
+        """
+        reason = self.reason()
+        if reason is not None:
+            raise RequestCancelledError(reason)
+
+    def release(self) -> None:
+        """
+        Removes the disconnect marker of a finished request.
+        """
+        if self.marker is not None:
+            self.marker.unlink(missing_ok=True)
+
+
+@dataclass
+class CancellationStats:
+    """
+    Counts the work the inference worker skipped because the client gave up.
+
+    Attributes:
+        dropped (int): Requests dropped before generation because they were already abandoned.
+        aborted (int): Generations aborted in flight.
+        aborted_fallback (int): Jsonformer fallbacks aborted in flight.
+        tokens_saved (int): Decode tokens not generated thanks to aborted generations, counted against
+            the generation limit.
+    """
+
+    dropped: int = 0
+    aborted: int = 0
+    aborted_fallback: int = 0
+    tokens_saved: int = 0
+
+    def log(self, reason: str, request_id: Optional[str] = None) -> None:
+        """
+        Logs the running totals after a cancellation.
+
+        Args:
+            reason (str): Why the last request was cancelled.
+            request_id (Optional[str], optional): Id of the cancelled request.
+        """
+        logger.info(
+            f"Request cancelled ({reason}): dropped={self.dropped}, aborted={self.aborted}, "
+            f"aborted_fallback={self.aborted_fallback}, tokens_saved={self.tokens_saved}",
+            extra={"request_id": request_id},
+        )
+
+
+class CancellationMiddleware:
+    """
+    ASGI middleware propagating client deadlines and disconnects to the inference worker.
+
+    The deadline and request id headers are copied into the JSON body of the request, where the worker
+    can see them. Until the response is complete, including a streamed one, the middleware watches the
+    connection and creates the disconnect marker of the request as soon as the client goes away.
+
+    Attributes:
+        app (ASGIApp): The wrapped application.
+        path (str): The path of the generation endpoint.
+        cancel_dir (pathlib.Path): Directory with the disconnect markers.
+    """
+
+    def __init__(self, app: ASGIApp, path: str, cancel_dir: str):
+        self.app = app
+        self.path = path
+        self.cancel_dir = pathlib.Path(cancel_dir)
+        self.cancel_dir.mkdir(parents=True, exist_ok=True)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        # The id names the disconnect marker, so it must be unique: the client id is only kept as a prefix,
+        # otherwise a client could cancel the request of another by sending the same id.
+        client_id = headers.get(REQUEST_ID_HEADER, "")
+        request_id = uuid.uuid4().hex
+        if REQUEST_ID_PATTERN.fullmatch(client_id):
+            request_id = f"{client_id}-{request_id}"
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        body = b"".join(chunks)
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            payload = None
+        if isinstance(payload, dict):
+            payload["request_id"] = request_id
+            try:
+                payload["deadline"] = float(headers[DEADLINE_HEADER])
+            except (KeyError, ValueError):
+                pass
+            body = json.dumps(payload).encode()
+
+        scope = dict(scope)
+        scope["headers"] = [(key, value) for key, value in scope["headers"] if key.lower() != b"content-length"] + [
+            (b"content-length", str(len(body)).encode())
+        ]
+
+        response_complete = False
+        body_sent = False
+        disconnected = asyncio.Event()
+
+        async def watch() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            if not response_complete:
+                (self.cancel_dir / request_id).touch()
+            disconnected.set()
+
+        async def app_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def app_send(message: Message) -> None:
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await self.app(scope, app_receive, app_send)
+        finally:
+            watcher.cancel()
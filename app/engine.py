@@ -0,0 +1,139 @@
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+from budget import JsonObjectEnd
+from deadlines import Cancellation
+from vllm import LLM, SamplingParams
+from vllm.lora.request import LoRARequest
+
+CANCELLATION_CHECK_INTERVAL = 0.05
+
+# CANCELLATION_CHECK_INTERVAL: Seconds between checks whether the clients of in-flight requests gave up.
+
+
+@dataclass
+class Generation:
+    """
+    Result of one prompt generated by the engine loop.
+
+    Attributes:
+        text (str): The generated text, partial if the generation was aborted.
+        num_tokens (int): Number of generated tokens.
+        cancelled (Optional[str]): Why the generation was aborted, or None if it finished.
+        stopped_at_json_end (bool): Whether the generation was stopped right after the answer object.
+    """
+
+    text: str = ""
+    num_tokens: int = 0
+    cancelled: Optional[str] = None
+    stopped_at_json_end: bool = False
+
+
+def stream(
+    llm: LLM,
+    prompts: Sequence[Union[str, List[int]]],
+    sampling_params: Union[SamplingParams, Sequence[SamplingParams]],
+    lora_requests: Optional[Sequence[Optional[LoRARequest]]] = None,
+    cancellations: Optional[Sequence[Optional[Cancellation]]] = None,
+    stop_at_json_end: bool = False,
+) -> Iterator[List[Generation]]:
+    """
+    Generates the prompts in one batch by stepping the engine directly instead of calling
+    `LLM.generate`, so that requests abandoned by their clients can be aborted between steps
+    and the partial texts can be streamed.
+
+    Args:
+        llm (LLM): The engine to generate with.
+        prompts (Sequence[Union[str, List[int]]]): The formatted prompts, as text or token ids.
+        sampling_params (Union[SamplingParams, Sequence[SamplingParams]]): Sampling parameters shared by
+            all the prompts, or the parameters of every prompt.
+        lora_requests (Optional[Sequence[Optional[LoRARequest]]], optional): Adapter of every prompt.
+        cancellations (Optional[Sequence[Optional[Cancellation]]], optional): Cancellation of every prompt.
+        stop_at_json_end (bool, optional): Stop every generation as soon as the top-level JSON object
+            it starts with is balanced, instead of waiting for the end-of-turn token.
+
+    Yields:
+        List[Generation]: The generation of every prompt so far, in the order of the prompts, after
+        every engine step. The same objects are updated in place by the following steps. If the generator
+        is closed before the end, the unfinished requests are aborted.
+    """
+    engine = llm.llm_engine
+    request_ids = [f"assist-{uuid.uuid4().hex}" for _ in prompts]
+    generations: Dict[str, Generation] = {request_id: Generation() for request_id in request_ids}
+    watched = {
+        request_id: cancellation
+        for request_id, cancellation in zip(request_ids, cancellations or [None] * len(prompts))
+        if cancellation is not None
+    }
+    json_ends = {request_id: JsonObjectEnd() for request_id in request_ids} if stop_at_json_end else {}
+
+    unfinished = set()
+    try:
+        for index, (request_id, prompt) in enumerate(zip(request_ids, prompts)):
+            engine.add_request(
+                request_id,
+                prompt if isinstance(prompt, str) else {"prompt_token_ids": prompt},
+                sampling_params if isinstance(sampling_params, SamplingParams) else sampling_params[index],
+                lora_request=lora_requests[index] if lora_requests else None,
+            )
+            unfinished.add(request_id)
+
+        checked_at = time.monotonic()
+        while unfinished and engine.has_unfinished_requests():
+            for output in engine.step():
+                generation = generations.get(output.request_id)
+                if generation is None:
+                    # Output of a request of an earlier batch, aborted when that batch stopped.
+                    continue
+                generation.text = output.outputs[0].text
+                generation.num_tokens = len(output.outputs[0].token_ids)
+                if output.finished:
+                    unfinished.discard(output.request_id)
+                    watched.pop(output.request_id, None)
+                    continue
+
+                json_end = json_ends.get(output.request_id)
+                if json_end is not None and json_end.feed(generation.text) is not None:
+                    engine.abort_request(output.request_id)
+                    unfinished.discard(output.request_id)
+                    generation.text = generation.text[: json_end.end]
+                    generation.stopped_at_json_end = True
+                    watched.pop(output.request_id, None)
+
+            if watched and time.monotonic() - checked_at > CANCELLATION_CHECK_INTERVAL:
+                checked_at = time.monotonic()
+                for request_id, cancellation in list(watched.items()):
+                    reason = cancellation.reason()
+                    if reason is not None:
+                        engine.abort_request(request_id)
+                        unfinished.discard(request_id)
+                        generations[request_id].cancelled = reason
+                        del watched[request_id]
+
+            yield [generations[request_id] for request_id in request_ids]
+    finally:
+        # The consumer stopped early or an error occurred: free the engine from the requests of this batch.
+        for request_id in unfinished:
+            engine.abort_request(request_id)
+
+
+def generate(
+    llm: LLM,
+    prompts: Sequence[Union[str, List[int]]],
+    sampling_params: Union[SamplingParams, Sequence[SamplingParams]],
+    lora_requests: Optional[Sequence[Optional[LoRARequest]]] = None,
+    cancellations: Optional[Sequence[Optional[Cancellation]]] = None,
+    stop_at_json_end: bool = False,
+) -> List[Generation]:
+    """
+    Generates the prompts in one batch, see `stream`.
+
+    Returns:
+        List[Generation]: The generation of every prompt, in the order of the prompts.
+    """
+    generations = [Generation() for _ in prompts]
+    for step in stream(llm, prompts, sampling_params, lora_requests, cancellations, stop_at_json_end):
+        generations = step
+    return generations
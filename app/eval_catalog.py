@@ -0,0 +1,202 @@
+import argparse
+import json
+import random
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalog import Catalog, Function, FunctionRetriever, parse_catalog
+from chat import build_prompt
+from config import Settings
+
+COMMAND_PATTERN = re.compile(r'"command"\s*:\s*\{\s*"name"\s*:\s*"(?P<name>\w+)"')
+
+# COMMAND_PATTERN: Name of the function called by an answer, found without parsing it, since some reference
+# answers are not valid JSON.
+
+
+def load_samples(path: str) -> List[Tuple[Catalog, str]]:
+    """
+    Loads the evaluation dialogues whose first query has a function catalog, with the name of the
+    function the reference answer calls.
+
+    Args:
+        path (str): Path to a JSON list of dialogues in the format of `prompts/evaluate.json`.
+
+    Returns:
+        List[Tuple[Catalog, str]]: The parsed first queries with the expected function names.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        dialogues = json.load(f)
+    samples = []
+    for dialogue in dialogues:
+        catalog = parse_catalog(dialogue["messages"][0]["content"])
+        if catalog is not None:
+            expected = COMMAND_PATTERN.search(dialogue["messages"][1]["content"])
+            samples.append((catalog, expected["name"] if expected else "NoFunction"))
+    return samples
+
+
+def load_functions(paths: List[str]) -> List[Function]:
+    """
+    Collects the distinct functions of the catalogs of a dataset, used as distractors.
+
+    Args:
+        paths (List[str]): Paths to JSONL dialogues in the format of `prompts/train_results.jsonl`.
+
+    Returns:
+        List[Function]: The functions, one per name.
+    """
+    functions: Dict[str, Function] = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                catalog = parse_catalog(json.loads(line)["messages"][0]["content"])
+                for function in catalog.functions if catalog else []:
+                    functions.setdefault(function.name, function)
+    return list(functions.values())
+
+
+def grow(catalog: Catalog, pool: List[Function], size: int, rng: random.Random) -> str:
+    """
+    Pads the catalog of a query with random distractor functions, in random order.
+
+    Args:
+        catalog (Catalog): The query.
+        pool (List[Function]): The distractor functions.
+        size (int): Number of functions of the padded catalog.
+        rng (random.Random): The random generator.
+
+    Returns:
+        str: The query with the padded catalog.
+    """
+    names = {function.name for function in catalog.functions}
+    distractors = [function for function in pool if function.name not in names]
+    functions = catalog.functions + rng.sample(distractors, max(0, size - len(catalog.functions)))
+    rng.shuffle(functions)
+    return catalog.render(functions)
+
+
+def evaluate(
+    samples: List[Tuple[Catalog, str]], pool: List[Function], size: int, settings: Settings, tokenizer: Optional[Any]
+) -> Dict[str, Any]:
+    """
+    Measures the retrieval on the queries padded to a catalog size: how often the expected function is
+    kept, how often the fallback kept the full catalog, and the prompt tokens saved.
+
+    Args:
+        samples (List[Tuple[Catalog, str]]): The queries with the expected function names.
+        pool (List[Function]): The distractor functions.
+        size (int): Number of functions of the padded catalogs.
+        settings (Settings): Settings with the retrieval parameters.
+        tokenizer (Optional[Any]): Tokenizer counting the saved tokens, characters are counted if not set.
+
+    Returns:
+        Dict[str, Any]: The metrics and the original and shrunk queries.
+    """
+    rng = random.Random(size)
+    retriever = FunctionRetriever(settings.CATALOG_TOP_K, settings.CATALOG_FALLBACK_RATIO, tokenizer=tokenizer)
+    recalled, fallbacks, saved, total = 0, 0, 0, 0
+    queries = []
+    for catalog, expected in samples:
+        query = grow(catalog, pool, size, rng)
+        selection = retriever.select(query)
+        kept = parse_catalog(selection.content)
+        recalled += kept is not None and expected in {function.name for function in kept.functions}
+        fallbacks += selection.fallback
+        saved += selection.tokens_saved
+        total += len(tokenizer.encode(query, add_special_tokens=False)) if tokenizer else len(query)
+        queries.append((query, selection.content, expected))
+    return {
+        "size": size,
+        "recall": recalled / len(samples),
+        "fallback_rate": fallbacks / len(samples),
+        "saved": saved / max(total, 1),
+        "queries": queries,
+    }
+
+
+def measure_accuracy(settings: Settings, queries: List[Tuple[str, str, str]]) -> Tuple[float, float]:
+    """
+    Generates the answers to the full and the shrunk queries and compares the called functions with
+    the reference answers.
+
+    Args:
+        settings (Settings): The inference server settings of the engine.
+        queries (List[Tuple[str, str, str]]): The full query, the shrunk query and the expected function name.
+
+    Returns:
+        Tuple[float, float]: The function accuracy with the full and with the shrunk catalogs.
+    """
+    from vllm import LLM, SamplingParams
+
+    llm = LLM(
+        model=settings.WEIGHTS_DIR or settings.MODEL_NAME,
+        dtype="half",
+        tensor_parallel_size=settings.TENSOR_PARALLEL_SIZE,
+    )
+    tokenizer = llm.get_tokenizer()
+    sampling_params = SamplingParams(temperature=0, max_tokens=settings.MAX_NEW_TOKENS, stop=["<|eot_id|>"])
+
+    accuracies = []
+    for position in (0, 1):
+        outputs = llm.generate([build_prompt(tokenizer, query[position]) for query in queries], sampling_params)
+        correct = 0
+        for output, (*_, expected) in zip(outputs, queries):
+            try:
+                correct += json.loads(output.outputs[0].text)["command"]["name"] == expected
+            except (json.JSONDecodeError, KeyError, TypeError):
+                pass
+        accuracies.append(correct / len(queries))
+    return accuracies[0], accuracies[1]
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Evaluate the function catalog retrieval.")
+    parser.add_argument("--data", type=str, default="prompts/evaluate.json", help="Path to the evaluation dialogues.")
+    parser.add_argument(
+        "--pool",
+        type=str,
+        nargs="+",
+        default=["prompts/train_results.jsonl", "prompts/test_results.jsonl"],
+        help="Datasets whose functions pad the catalogs.",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 10, 20, 40], help="Catalog sizes to evaluate.")
+    parser.add_argument("--tokenizer", action="store_true", help="Count the saved tokens with the model tokenizer.")
+    parser.add_argument("--generate", action="store_true", help="Also compare the answer accuracy on the GPU.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Pads the function catalogs of the evaluation dialogues with distractor functions from the datasets and
+    reports, for every catalog size, how often the retrieval keeps the function of the reference answer, how
+    often it falls back to the full catalog and the share of the query tokens it saves. With `--generate`,
+    also compares the function the model calls with the full and with the shrunk catalogs.
+    """
+    args = parse_arguments()
+    settings = Settings.from_env()
+    samples = load_samples(args.data)
+    pool = load_functions(args.pool)
+
+    tokenizer = None
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(settings.WEIGHTS_DIR or settings.MODEL_NAME)
+
+    print(f"{len(samples)} queries, {len(pool)} distractor functions, top_k={settings.CATALOG_TOP_K}")
+    print(f"{'size':>5} {'recall':>7} {'fallback':>9} {'saved':>6}")
+    results = [evaluate(samples, pool, size, settings, tokenizer) for size in args.sizes]
+    for result in results:
+        print(f"{result['size']:>5} {result['recall']:>7.0%} {result['fallback_rate']:>9.0%} {result['saved']:>6.0%}")
+
+    if args.generate:
+        for result in results:
+            full, shrunk = measure_accuracy(settings, result["queries"])
+            print(f"size {result['size']}: function accuracy {full:.0%} with the full catalog, {shrunk:.0%} shrunk")
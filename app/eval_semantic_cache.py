@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from semantic_cache import SemanticCache, split_query
+
+COMMAND_PATTERN = re.compile(r'"command"\s*:\s*\{\s*"name"\s*:\s*"(?P<name>\w+)"')
+REWRITES = [
+    (r"\bМожете\b", "Можешь"),
+    (r"\bМожешь\b", "Можете"),
+    (r"\bвы\b", "ты"),
+    (r"\bвам\b", "тебе"),
+    (r"^Привет[,!]?\s*", ""),
+    (r"^", "Привет! "),
+    (r"[?.!]+$", ""),
+    (r"$", " Спасибо!"),
+]
+
+# COMMAND_PATTERN: Name of the function called by an answer, found without parsing it, since some reference
+#   answers are not valid JSON.
+# REWRITES: Surface rewrites turning a request into a paraphrase with the same meaning, as (pattern, replacement).
+
+Command = Tuple[Optional[str], Optional[str]]
+
+
+def command_of(answer: str) -> Command:
+    """
+    Extracts the function call of an answer.
+
+    Args:
+        answer (str): The answer.
+
+    Returns:
+        Command: The function name and its arguments as canonical JSON, None for what cannot be parsed.
+    """
+    try:
+        command = json.loads(answer)["command"]
+        return command["name"], json.dumps(command.get("args"), ensure_ascii=False, sort_keys=True)
+    except (json.JSONDecodeError, KeyError, TypeError):
+        match = COMMAND_PATTERN.search(answer)
+        return (match["name"] if match else None), None
+
+
+def load_samples(path: str) -> List[Tuple[str, str]]:
+    """
+    Loads the first query and the reference answer of every dialogue.
+
+    Args:
+        path (str): Path to JSONL dialogues in the format of `prompts/test_results.jsonl`.
+
+    Returns:
+        List[Tuple[str, str]]: The queries with their reference answers.
+    """
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            messages = json.loads(line)["messages"]
+            samples.append((messages[0]["content"], messages[1]["content"]))
+    return samples
+
+
+def paraphrase(query: str, rng: random.Random, rewrites: int = 2) -> str:
+    """
+    Paraphrases the request of a query with random surface rewrites, keeping its catalog or preamble.
+
+    Args:
+        query (str): The query.
+        rng (random.Random): The random generator.
+        rewrites (int, optional): Number of rewrites tried.
+
+    Returns:
+        str: The paraphrased query.
+    """
+    _, request = split_query(query)
+    prefix = query[: query.rindex(request)] if request else query
+    for pattern, replacement in rng.sample(REWRITES, rewrites):
+        request = re.sub(pattern, replacement, request, count=1)
+    return prefix + request
+
+
+def is_correct(answer: str, reference: str, original: str, cached_query: str) -> bool:
+    """
+    Decides whether a cached answer is a correct answer to a query: it is if it was cached for the same
+    original query, or if it calls the same function with the same arguments. Answers without a function
+    call talk about their own request, so they are only correct for the query they were given to.
+
+    Args:
+        answer (str): The cached answer.
+        reference (str): The reference answer of the query.
+        original (str): The query before it was paraphrased.
+        cached_query (str): The query the cached answer was given to.
+
+    Returns:
+        bool: Whether the hit is correct.
+    """
+    if cached_query == original:
+        return True
+    command = command_of(answer)
+    return command == command_of(reference) and command[0] not in (None, "NoFunction")
+
+
+def replay(
+    cache: SemanticCache,
+    samples: List[Tuple[str, str]],
+    queries: List[str],
+    origins: Dict[str, str],
+    fill: bool,
+) -> Dict[str, float]:
+    """
+    Looks the queries up in the cache, caching the reference answer of every miss if `fill` is set.
+
+    Args:
+        cache (SemanticCache): The cache.
+        samples (List[Tuple[str, str]]): The original queries with their reference answers.
+        queries (List[str]): The queries to look up, one per sample.
+        origins (Dict[str, str]): The query every cached answer was cached for, updated by the misses.
+        fill (bool): Cache the reference answers of the missed queries.
+
+    Returns:
+        Dict[str, float]: The hit rate, the false-hit rate and the mean lookup time in milliseconds.
+    """
+    hits, false_hits, elapsed = 0, 0, 0.0
+    for (original, reference), query in zip(samples, queries):
+        started_at = time.perf_counter()
+        answer = cache.get(query)
+        elapsed += time.perf_counter() - started_at
+        if answer is None:
+            if fill:
+                cache.put(query, reference)
+                origins[reference] = query
+            continue
+        hits += 1
+        false_hits += not is_correct(answer, reference, original, origins[answer])
+    return {"hit": hits / len(samples), "false_hit": false_hits / len(samples), "ms": elapsed / len(samples) * 1e3}
+
+
+def evaluate(samples: List[Tuple[str, str]], threshold: float, seed: int) -> Dict[str, Any]:
+    """
+    Measures the cache at a similarity threshold: first on the distinct queries of the dataset, where every
+    hit is a near-duplicate found among the previous queries, then on paraphrases of the same queries.
+
+    Args:
+        samples (List[Tuple[str, str]]): The queries with their reference answers.
+        threshold (float): The similarity threshold.
+        seed (int): Seed of the paraphrases.
+
+    Returns:
+        Dict[str, Any]: The metrics of both passes.
+    """
+    rng = random.Random(seed)
+    cache = SemanticCache(threshold=threshold)
+    origins: Dict[str, str] = {}
+    distinct = replay(cache, samples, [query for query, _ in samples], origins, fill=True)
+    paraphrased = replay(cache, samples, [paraphrase(query, rng) for query, _ in samples], origins, fill=False)
+    return {"threshold": threshold, "distinct": distinct, "paraphrased": paraphrased, "cache": cache}
+
+
+def check_persistence(cache: SemanticCache, samples: List[Tuple[str, str]]) -> bool:
+    """
+    Saves the cache, loads it into a new one and compares their answers.
+
+    Args:
+        cache (SemanticCache): The filled cache.
+        samples (List[Tuple[str, str]]): The queries to compare the answers on.
+
+    Returns:
+        bool: Whether the restored cache answers the same.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        cache.path = os.path.join(directory, "semantic_cache.npz")
+        cache.save()
+        restored = SemanticCache(threshold=cache.threshold, path=cache.path)
+    cache.path = None
+    return restored.size == cache.size and all(cache.get(query) == restored.get(query) for query, _ in samples)
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Evaluate the semantic cache offline.")
+    parser.add_argument("--data", type=str, default="prompts/test_results.jsonl", help="Path to the dialogues.")
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.85, 0.9, 0.95], help="Thresholds to try."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the paraphrases.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Replays the first queries of the dialogues through the semantic cache at several similarity thresholds
+    and reports the hit and false-hit rates, first on the queries as they are, then on paraphrases of them.
+    """
+    args = parse_arguments()
+    samples = load_samples(args.data)
+    print(f"{len(samples)} queries")
+    print(f"{'threshold':>9} {'hit':>6} {'false':>6} {'para hit':>9} {'para false':>11} {'lookup ms':>10}")
+    for threshold in args.thresholds:
+        result = evaluate(samples, threshold, args.seed)
+        distinct, paraphrased = result["distinct"], result["paraphrased"]
+        print(
+            f"{threshold:>9.2f} {distinct['hit']:>6.1%} {distinct['false_hit']:>6.1%} "
+            f"{paraphrased['hit']:>9.1%} {paraphrased['false_hit']:>11.1%} {paraphrased['ms']:>10.3f}"
+        )
+    print(f"persistence round trip: {'ok' if check_persistence(result['cache'], samples) else 'MISMATCH'}")
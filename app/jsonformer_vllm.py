@@ -1,10 +1,12 @@
 import json
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 import numpy as np
+from deadlines import Cancellation
 from jsonformer.logits_processors import OutputNumbersTokens
 from termcolor import cprint
 from vllm import LLM, SamplingParams
+from vllm.lora.request import LoRARequest
 
 GENERATION_MARKER = "|GENERATION|"
 
@@ -49,6 +51,8 @@ class JsonformerVLLM:
         temperature (float): The temperature parameter for controlling randomness in generation.
         max_string_token_length (int): Maximum token length for generating strings.
         generation_marker (str): Marker used to indicate in-progress generation within the prompt.
+        lora_request (Optional[LoRARequest]): LoRA adapter used for every generation call.
+        cancellation (Optional[Cancellation]): Cancellation of the request, checked before every generated value.
     """
 
     value: Dict[str, Any] = {}
@@ -65,6 +69,8 @@ class JsonformerVLLM:
         max_number_tokens: int = 6,
         temperature: float = 1.0,
         max_string_token_length: int = 10,
+        lora_request: Optional[LoRARequest] = None,
+        cancellation: Optional[Cancellation] = None,
     ):
         """
         Initializes the JsonformerVLLM class with required model, tokenizer, schema,
@@ -81,6 +87,8 @@ class JsonformerVLLM:
             max_number_tokens (int, optional): Max tokens for numbers. Defaults to 6.
             temperature (float, optional): Randomness control for generation. Defaults to 1.0.
             max_string_token_length (int, optional): Max tokens for strings. Defaults to 10.
+            lora_request (Optional[LoRARequest], optional): LoRA adapter to generate with. Defaults to None.
+            cancellation (Optional[Cancellation], optional): Cancellation of the request. Defaults to None.
         """
         self.llm = llm
         self.tokenizer = tokenizer
@@ -92,6 +100,8 @@ class JsonformerVLLM:
         self.temperature = temperature
         self.max_string_token_length = max_string_token_length
         self.generation_marker = "|GENERATION|"
+        self.lora_request = lora_request
+        self.cancellation = cancellation
         self.number_logit_processor = OutputNumbersTokens(self.tokenizer, self.prompt)
 
     def debug(self, caller: str, value: str, is_prompt: bool = False):
@@ -129,7 +139,9 @@ class JsonformerVLLM:
         self.debug("[generate_number]", prompt, is_prompt=True)
 
         response = self.llm.generate(
-            prompt, SamplingParams(max_tokens=self.max_number_tokens, temperature=temperature or self.temperature)
+            prompt,
+            SamplingParams(max_tokens=self.max_number_tokens, temperature=temperature or self.temperature),
+            lora_request=self.lora_request,
         )
 
         response_text = response[0].outputs[0].text.strip().rstrip(".")
@@ -152,7 +164,7 @@ class JsonformerVLLM:
         prompt = self.get_prompt()
         self.debug("[generate_boolean]", prompt, is_prompt=True)
 
-        response = self.llm.generate(prompt)
+        response = self.llm.generate(prompt, lora_request=self.lora_request)
         logits = np.array(response[0].outputs[0].token_ids).ravel()
 
         true_token_id = self.tokenizer.convert_tokens_to_ids("true")
@@ -180,7 +192,9 @@ class JsonformerVLLM:
         self.debug("[generate_string]", prompt, is_prompt=True)
 
         response = self.llm.generate(
-            prompt, SamplingParams(max_tokens=self.max_string_token_length, temperature=temperature or self.temperature)
+            prompt,
+            SamplingParams(max_tokens=self.max_string_token_length, temperature=temperature or self.temperature),
+            lora_request=self.lora_request,
         )
 
         response_text = response[0].outputs[0].text
@@ -223,7 +237,13 @@ class JsonformerVLLM:
 
         Returns:
             Any: The generated value.
+
+        Raises:
+            RequestCancelledError: If the client abandoned the request.
         """
+        if self.cancellation is not None:
+            self.cancellation.raise_if_cancelled()
+
         schema_type = schema["type"]
 
         if schema_type == "number":
@@ -266,7 +286,7 @@ class JsonformerVLLM:
             obj.append(self.generation_marker)
             obj.pop()
 
-            response = self.llm.generate(prompt)
+            response = self.llm.generate(prompt, lora_request=self.lora_request)
             logits = response[0].outputs[0].token_ids
             top_indices = logits[:30]
 
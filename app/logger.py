@@ -0,0 +1,163 @@
+import atexit
+import contextvars
+import copy
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import pathlib
+import queue
+import random
+import shutil
+import sys
+from typing import Any, Dict, List, Optional
+
+REQUEST_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "sampled"}
+
+# REQUEST_ID: Id of the request being processed, added to the records logged while it is set.
+# RECORD_ATTRIBUTES: Attributes every log record has; any other attribute was passed with `extra`.
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects with the time, level, logger, process, message,
+    request id and the fields passed with `extra`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and key not in payload:
+                payload[key] = value
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler keeping the message and the traceback of a record apart. The stock handler formats the
+    traceback into the message before queueing the record, so the JSON records lost their `exception` field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merges the arguments into the message and renders the traceback, which holds the frames, as text."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps records with the id of the request being processed, in the thread that logs them, before
+    they are handed over to the writer thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            request_id = REQUEST_ID.get()
+            if request_id is not None:
+                record.request_id = request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records logged with `extra={"sampled": True}`, meant for high-volume
+    debug records such as per-request or per-step details. Other records always pass.
+
+    Attributes:
+        rate (float): Fraction of the sampled records kept.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, "sampled", False) or random.random() < self.rate
+
+
+def compress(source: str, destination: str) -> None:
+    """
+    Rotates a log file into a gzip archive.
+
+    Args:
+        source (str): The full log file.
+        destination (str): The archive path.
+    """
+    with open(source, "rb") as f_in, gzip.open(destination, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def setup(
+    name: str,
+    level: str = "INFO",
+    log_dir: Optional[str] = None,
+    max_bytes: int = 50 * 1024 * 1024,
+    backups: int = 10,
+    sample_rate: float = 0.01,
+    stderr: bool = True,
+) -> logging.handlers.QueueListener:
+    """
+    Configures logging of the current process. Log calls only put the record into an in-memory queue;
+    a background thread formats the records as JSON and writes them to stderr and, if `log_dir` is set,
+    to a size-rotated file whose old parts are gzipped and pruned. Neither the event loop of the API
+    server nor the inference loop of the worker ever waits for the disk.
+
+    Every process logs to its own file, since rotating a file shared by several processes loses records.
+
+    Args:
+        name (str): Name of the process, used as the log file name.
+        level (str, optional): Minimum level of the logged records.
+        log_dir (Optional[str], optional): Directory of the log files, stderr only if not set.
+        max_bytes (int, optional): Size at which the log file is rotated.
+        backups (int, optional): Number of rotated files kept.
+        sample_rate (float, optional): Fraction of the sampled records kept.
+        stderr (bool, optional): Also write the records to stderr.
+
+    Returns:
+        logging.handlers.QueueListener: The started listener writing the records, stopped at exit.
+    """
+    formatter = JsonFormatter()
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stderr)] if stderr else []
+    if log_dir:
+        pathlib.Path(log_dir).mkdir(parents=True, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            pathlib.Path(log_dir) / f"{name}.log", maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+        )
+        file_handler.namer = lambda path: f"{path}.gz"
+        file_handler.rotator = compress
+        handlers.append(file_handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = RecordQueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
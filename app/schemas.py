@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel
 
@@ -18,15 +18,41 @@ class ValidationError(BaseModel):
     type: str
 
 
+class MessageModel(BaseModel):
+    """
+    Represents a previous message of a conversation.
+
+    Attributes:
+        role (Literal["user", "bot"]): Who wrote the message: the user, including the function results
+            passed back to the model, or the model.
+        content (str): The text of the message, for the model the answer it was given.
+    """
+
+    role: Literal["user", "bot"]
+    content: str
+
+
 class RequestModel(BaseModel):
     """
     Represents a request model containing a user's query.
 
     Attributes:
         query (str): The input query provided by the user.
+        messages (List[MessageModel]): The previous messages of the conversation, oldest first.
+        session_id (Optional[str]): Id of the conversation. Turns of the same session reuse the prompt of
+            the previous turn, so only the new messages are processed.
+        adapter (Optional[str]): Name of the LoRA adapter to answer with. The base model is used if not set.
+        deadline (Optional[float]): Unix timestamp after which the client no longer waits for the answer.
+            Set by the server from the `X-Request-Deadline` header.
+        request_id (Optional[str]): Id of the request. Set by the server, prefixed with the `X-Request-Id` header.
     """
 
     query: str
+    messages: List[MessageModel] = []
+    session_id: Optional[str] = None
+    adapter: Optional[str] = None
+    deadline: Optional[float] = None
+    request_id: Optional[str] = None
 
 
 class ResponseModel(BaseModel):
@@ -38,3 +64,14 @@ class ResponseModel(BaseModel):
     """
 
     text: str
+
+
+class DeltaModel(BaseModel):
+    """
+    Represents a chunk of a streamed response.
+
+    Attributes:
+        delta (str): The text generated since the previous chunk.
+    """
+
+    delta: str
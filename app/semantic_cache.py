@@ -0,0 +1,315 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from catalog import parse_catalog
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 1024
+NGRAM_SIZES = (3, 4)
+PREAMBLE_PATTERN = re.compile(r"^\s*(?:Ты|Вы)\s*[-—]+\s*полезный помощник[^\n]*\n+")
+
+# EMBEDDING_DIM: Size of the hashed query embeddings. 4 KiB per cached query.
+# NGRAM_SIZES: Lengths of the character n-grams embedded besides the words.
+# PREAMBLE_PATTERN: The "Ты -- полезный помощник ..." line opening the prompts without a function catalog, which
+#   is shared by many queries and would make them look alike.
+
+
+def split_query(query: str) -> Tuple[str, str]:
+    """
+    Splits a query into its context, the function catalog or the preamble it starts with, and the
+    user request. Queries are only matched against queries with the same context.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        Tuple[str, str]: The hash of the context and the request.
+    """
+    catalog = parse_catalog(query)
+    if catalog is not None:
+        return catalog.key, catalog.request
+    preamble = PREAMBLE_PATTERN.match(query)
+    context = preamble.group(0).strip() if preamble else ""
+    return hashlib.sha256(context.encode()).hexdigest(), query[preamble.end() if preamble else 0 :].strip()
+
+
+def embed(text: str) -> np.ndarray:
+    """
+    Computes a lightweight sentence embedding of a text on the CPU: the words and the character
+    n-grams of the words, with sublinear counts, signed-hashed into a fixed-size unit vector. Different
+    forms of a word and reordered words keep most of the features in common.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        np.ndarray: The float32 embedding of unit length, or zeros for a text without words.
+    """
+    features: Counter = Counter()
+    for word in re.findall(r"\w+", text.lower()):
+        features[word] += 1
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            features.update(padded[index : index + size] for index in range(max(1, len(padded) - size + 1)))
+
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature, count in features.items():
+        digest = zlib.crc32(feature.encode())
+        vector[digest % EMBEDDING_DIM] += (1 + math.log(count)) * (1 if digest & 0x80000000 else -1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class Partition:
+    """
+    Flat index of the cached queries sharing a context, searched by a matrix-vector product.
+
+    Attributes:
+        vectors (np.ndarray): The embeddings of the queries, in the first `size` rows.
+        queries (List[str]): The requests of the queries.
+        answers (List[str]): The cached answers.
+        created_at (np.ndarray): Unix time every entry was cached at.
+        used_at (np.ndarray): Unix time every entry was last cached or returned at.
+    """
+
+    def __init__(self, capacity: int = 16):
+        self.vectors = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+        self.queries: List[str] = []
+        self.answers: List[str] = []
+        self.created_at = np.zeros(capacity)
+        self.used_at = np.zeros(capacity)
+
+    @property
+    def size(self) -> int:
+        return len(self.answers)
+
+    def search(self, vector: np.ndarray) -> Tuple[int, float]:
+        """
+        Finds the most similar cached query.
+
+        Args:
+            vector (np.ndarray): The embedding of the query.
+
+        Returns:
+            Tuple[int, float]: The index of the entry and its cosine similarity, (-1, 0.0) if empty.
+        """
+        if self.size == 0:
+            return -1, 0.0
+        similarities = self.vectors[: self.size] @ vector
+        index = int(np.argmax(similarities))
+        return index, float(similarities[index])
+
+    def add(self, vector: np.ndarray, query: str, answer: str, created_at: float, used_at: float) -> None:
+        if self.size == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.created_at = np.concatenate([self.created_at, np.zeros_like(self.created_at)])
+            self.used_at = np.concatenate([self.used_at, np.zeros_like(self.used_at)])
+        self.vectors[self.size] = vector
+        self.created_at[self.size] = created_at
+        self.used_at[self.size] = used_at
+        self.queries.append(query)
+        self.answers.append(answer)
+
+    def keep(self, mask: np.ndarray) -> None:
+        """
+        Drops the entries not selected by the mask.
+
+        Args:
+            mask (np.ndarray): Whether to keep every entry.
+        """
+        size = int(mask.sum())
+        self.vectors[:size] = self.vectors[: self.size][mask]
+        self.created_at[:size] = self.created_at[: self.size][mask]
+        self.used_at[:size] = self.used_at[: self.size][mask]
+        self.queries = [query for query, kept in zip(self.queries, mask) if kept]
+        self.answers = [answer for answer, kept in zip(self.answers, mask) if kept]
+
+
+class SemanticCache:
+    """
+    Cache of answers returned for queries similar to previous ones, which the exact-match caches miss
+    when a query is paraphrased.
+
+    The queries are embedded on the CPU and partitioned by the adapter and by the hash of the function
+    catalog they come with, since the same request against another catalog may call another function.
+    Within a partition, the cached answer of the most similar query is returned if the cosine similarity
+    reaches the threshold. Entries expire after `ttl` seconds, and the least recently used entries are
+    evicted when the cache is full. The cache is persisted every `save_every` new entries.
+
+    Attributes:
+        threshold (float): Minimum cosine similarity of a query to a cached one to return its answer.
+        max_size (int): Maximum number of cached entries.
+        ttl (float): Seconds an entry stays valid.
+        path (Optional[str]): File the cache is persisted to.
+        save_every (int): Number of new entries between two saves and statistics log records.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not answered from the cache.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        max_size: int = 10000,
+        ttl: float = 86400,
+        path: Optional[str] = None,
+        save_every: int = 100,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._partitions: Dict[str, Partition] = {}
+        self._added = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    @property
+    def size(self) -> int:
+        return sum(partition.size for partition in self._partitions.values())
+
+    def get(self, query: str, adapter: Optional[str] = None) -> Optional[str]:
+        """
+        Looks up the answer of a query similar to the given one.
+
+        Args:
+            query (str): The user query.
+            adapter (Optional[str], optional): The adapter the query is answered with.
+
+        Returns:
+            Optional[str]: The cached answer, or None on a miss.
+        """
+        context, request = split_query(query)
+        partition = self._partitions.get(f"{adapter}:{context}")
+        if partition is None:
+            self.misses += 1
+            return None
+        index, similarity = partition.search(embed(request))
+        now = time.time()
+        if index < 0 or similarity < self.threshold or partition.created_at[index] + self.ttl <= now:
+            self.misses += 1
+            return None
+        self.hits += 1
+        partition.used_at[index] = now
+        logger.debug(
+            "Semantic cache hit",
+            extra={"sampled": True, "similarity": similarity, "cached_query": partition.queries[index]},
+        )
+        return partition.answers[index]
+
+    def put(self, query: str, answer: str, adapter: Optional[str] = None) -> None:
+        """
+        Caches the answer of a query.
+
+        Args:
+            query (str): The user query.
+            answer (str): The answer.
+            adapter (Optional[str], optional): The adapter the query was answered with.
+        """
+        if self.max_size <= 0:
+            return
+        context, request = split_query(query)
+        vector = embed(request)
+        partition = self._partitions.setdefault(f"{adapter}:{context}", Partition())
+        now = time.time()
+        index, similarity = partition.search(vector)
+        if index >= 0 and similarity >= 1 - 1e-6:
+            partition.answers[index], partition.created_at[index], partition.used_at[index] = answer, now, now
+        else:
+            partition.add(vector, request, answer, now, now)
+        self._added += 1
+
+        if self.size > self.max_size:
+            self.evict()
+        if self._added % self.save_every == 0:
+            self.log()
+            self.save()
+
+    def evict(self) -> None:
+        """
+        Drops the expired entries and, if the cache is still over 90% full, the least recently used ones.
+        """
+        if not self._partitions:
+            return
+        now = time.time()
+        used_at = np.concatenate([partition.used_at[: partition.size] for partition in self._partitions.values()])
+        excess = len(used_at) - int(self.max_size * 0.9)
+        cutoff = np.partition(used_at, excess - 1)[excess - 1] if excess > 0 else -math.inf
+        for key, partition in list(self._partitions.items()):
+            partition.keep(
+                (partition.created_at[: partition.size] + self.ttl > now)
+                & (partition.used_at[: partition.size] > cutoff)
+            )
+            if partition.size == 0:
+                del self._partitions[key]
+
+    def log(self) -> None:
+        """
+        Logs the size and the hit rate of the cache.
+        """
+        logger.info(
+            f"Semantic cache: entries={self.size}, partitions={len(self._partitions)}, "
+            f"hits={self.hits}, misses={self.misses}, hit_rate={self.hits / max(self.hits + self.misses, 1):.2f}"
+        )
+
+    def save(self) -> None:
+        """
+        Persists the cache, so it survives restarts.
+        """
+        if not self.path:
+            return
+        keys = list(self._partitions)
+        partitions = [self._partitions[key] for key in keys]
+        meta = {
+            "keys": keys,
+            "sizes": [partition.size for partition in partitions],
+            "queries": [query for partition in partitions for query in partition.queries],
+            "answers": [answer for partition in partitions for answer in partition.answers],
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                vectors=np.concatenate(
+                    [p.vectors[: p.size] for p in partitions] or [np.zeros((0, EMBEDDING_DIM), dtype=np.float32)]
+                ),
+                created_at=np.concatenate([p.created_at[: p.size] for p in partitions] or [np.zeros(0)]),
+                used_at=np.concatenate([p.used_at[: p.size] for p in partitions] or [np.zeros(0)]),
+                meta=np.array(json.dumps(meta, ensure_ascii=False)),
+            )
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        """
+        Restores the persisted cache. A file written with another embedding size is ignored.
+        """
+        if not self.path:
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            vectors, created_at, used_at = data["vectors"], data["created_at"], data["used_at"]
+            meta = json.loads(str(data["meta"]))
+        if vectors.shape[1] != EMBEDDING_DIM:
+            logger.warning(f"Ignoring the semantic cache {self.path} with embeddings of size {vectors.shape[1]}")
+            return
+
+        position = 0
+        for key, size in zip(meta["keys"], meta["sizes"]):
+            partition = self._partitions.setdefault(key, Partition())
+            for index in range(position, position + size):
+                partition.add(
+                    vectors[index], meta["queries"][index], meta["answers"][index], created_at[index], used_at[index]
+                )
+            position += size
+        self.evict()
@@ -1,110 +1,408 @@
 # server.py
 
 import json
-from typing import Optional
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 import litserve as ls
+import logger as logging_setup
+from adapters import AdapterRegistry, UnknownAdapterError
+from budget import TokenBudgeter
+from catalog import FunctionRetriever
+from chat import Prompt, SessionCache
+from config import Settings
+from deadlines import Cancellation, CancellationMiddleware, CancellationStats, RequestCancelledError
+from engine import Generation, generate, stream
 from fastapi import HTTPException
+from fastapi.responses import JSONResponse
 from jsonformer_vllm import JsonformerVLLM, json_schema
-from schemas import RequestModel, ResponseModel, ValidationError
-from transformers import AutoTokenizer
+from logger import REQUEST_ID
+from schemas import DeltaModel, RequestModel, ResponseModel, ValidationError
+from semantic_cache import SemanticCache
+from speculative import speculative_kwargs
+from startup import WARMUP_QUERIES, StartupTimer, clear_ready, mark_ready, read_ready, resolve_weights
 from vllm import LLM, SamplingParams
 from vllm.lora.request import LoRARequest
 
+logger = logging.getLogger(__name__)
+
+StreamEvent = Union[DeltaModel, ResponseModel, HTTPException, None]
+
+# StreamEvent: What happened to a request during an engine step: new text, the final answer, an error, or nothing.
+
 
 class SimpleLitAPI(ls.LitAPI):
     """
-    A FastAPI-based server class for serving a T-Lite language model using
-    LoRA (Low-Rank Adaptation) with a specified tokenizer and inference pipeline.
+    A FastAPI-based server class for serving a T-Lite language model with optional
+    per-request LoRA (Low-Rank Adaptation) adapters and a specified inference pipeline.
 
     Attributes:
-        sampling_params (SamplingParams): Parameters for controlling text generation,
-            such as temperature and maximum token count.
-        lora (LoRARequest): Configuration for the LoRA adaptation, including path
-            and unique identifier.
+        settings (Settings): The inference server settings.
+        budgeter (TokenBudgeter): Estimates the generation limit of every request from
+            the answer schema and the lengths of previous answers.
+        adapters (AdapterRegistry): The LoRA adapters requests can select, loaded
+            into the engine on demand.
+        sessions (SessionCache): Builds the prompts of multi-turn conversations from the previous turns.
+        retriever (FunctionRetriever): Shrinks the function catalogs of the prompts to the relevant functions.
+        semantic_cache (Optional[SemanticCache]): Answers of previous queries returned for similar queries,
+            if enabled.
+        cancellation_stats (CancellationStats): Work skipped because clients abandoned their requests.
         llm (LLM): A pre-trained language model for handling text generation.
-        tokenizer (AutoTokenizer): A tokenizer for handling text input and output
-            formatting for the model.
+        tokenizer (Any): The tokenizer loaded by the engine, used for chat template
+            formatting of the model input.
     """
 
-    sampling_params: SamplingParams
-    lora: Optional[LoRARequest]
+    budgeter: TokenBudgeter
+    adapters: AdapterRegistry
+    sessions: SessionCache
+    retriever: FunctionRetriever
+    semantic_cache: Optional[SemanticCache]
     llm: LLM
-    tokenizer: AutoTokenizer
+    tokenizer: Any
+
+    def __init__(self, settings: Settings):
+        """
+        Initializes the API with the server settings.
+
+        Args:
+            settings (Settings): The inference server settings.
+        """
+        self.settings = settings
 
     def setup(self, device):
         """
-        Initializes the tokenizer, LoRA settings, sampling parameters, and the LLM.
+        Initializes the LLM, its tokenizer, LoRA adapters and the generation limit estimator, then
+        warms the engine up and marks the worker as ready.
 
         Args:
             device (str): The device to run the model on, e.g., "cpu" or "cuda".
         """
-        self.tokenizer = AutoTokenizer.from_pretrained("GoshaLetov/T-Lite-sft-no-optimizer")
-        self.sampling_params = SamplingParams(
+        self.setup_logging(f"worker-{device.replace(':', '')}")
+        timer = StartupTimer()
+        with timer.stage("weights"):
+            model, load_format = resolve_weights(self.settings)
+        with timer.stage("engine"):
+            self.llm = LLM(
+                model=model,
+                load_format=load_format,
+                enable_lora=bool(self.settings.ADAPTERS),
+                max_loras=self.settings.MAX_LORAS,
+                max_cpu_loras=self.settings.MAX_LORAS,
+                max_lora_rank=self.settings.MAX_LORA_RANK,
+                dtype="half",
+                enable_prefix_caching=self.settings.PREFIX_CACHING,
+                tensor_parallel_size=self.settings.TENSOR_PARALLEL_SIZE,
+                **speculative_kwargs(self.settings),
+            )
+        with timer.stage("tokenizer"):
+            self.tokenizer = self.llm.get_tokenizer()
+        self.adapters = AdapterRegistry(self.llm, self.settings.ADAPTERS, max_loaded=self.settings.MAX_LORAS)
+        self.sessions = SessionCache(
+            self.tokenizer, max_sessions=self.settings.SESSION_CACHE_SIZE, ttl=self.settings.SESSION_TTL
+        )
+        self.retriever = FunctionRetriever(
+            top_k=self.settings.CATALOG_TOP_K,
+            fallback_ratio=self.settings.CATALOG_FALLBACK_RATIO,
+            tokenizer=self.tokenizer,
+        )
+        self.semantic_cache = (
+            SemanticCache(
+                threshold=self.settings.SEMANTIC_CACHE_THRESHOLD,
+                max_size=self.settings.SEMANTIC_CACHE_SIZE,
+                ttl=self.settings.SEMANTIC_CACHE_TTL,
+                path=self.settings.SEMANTIC_CACHE_FILE,
+            )
+            if self.settings.SEMANTIC_CACHE
+            else None
+        )
+        self.cancellation_stats = CancellationStats()
+        self.budgeter = TokenBudgeter(
+            self.tokenizer,
+            json_schema,
+            max_model_len=self.llm.llm_engine.model_config.max_model_len,
+            min_tokens=self.settings.MIN_NEW_TOKENS,
+            max_tokens=self.settings.MAX_NEW_TOKENS,
+            path=self.settings.BUDGET_FILE,
+        )
+        with timer.stage("warmup"):
+            self.warmup()
+
+        timer.log()
+        mark_ready(self.settings.READY_FILE, timer.report())
+
+    def setup_logging(self, name: str) -> None:
+        """
+        Configures the non-blocking JSON logging of the current process.
+
+        Args:
+            name (str): Name of the process, used as the log file name.
+        """
+        logging_setup.setup(
+            name,
+            level=self.settings.LOG_LEVEL,
+            log_dir=self.settings.LOG_DIR,
+            max_bytes=self.settings.LOG_MAX_BYTES,
+            backups=self.settings.LOG_BACKUPS,
+            sample_rate=self.settings.LOG_SAMPLE_RATE,
+        )
+
+    def warmup(self) -> None:
+        """
+        Runs one batch of representative prompts through the engine so that the first real
+        request does not pay for cold caches. The engine is called directly: the warmup answers
+        must not be observed by the token budgeter nor remembered by the session and semantic caches.
+        """
+        prompts = [
+            self.build_prompt(RequestModel(query=query)) for query in WARMUP_QUERIES[: self.settings.WARMUP_BATCH_SIZE]
+        ]
+        generate(
+            self.llm,
+            prompts=[prompt.token_ids for prompt in prompts],
+            sampling_params=[self.sampling_params(self.budgeter.budget(len(prompt.token_ids))) for prompt in prompts],
+            stop_at_json_end=True,
+        )
+
+    @staticmethod
+    def sampling_params(max_tokens: int) -> SamplingParams:
+        """
+        Creates the sampling parameters of a request.
+
+        Args:
+            max_tokens (int): The generation limit of the request.
+
+        Returns:
+            SamplingParams: Greedy sampling parameters stopping at the end of the turn.
+        """
+        return SamplingParams(
             temperature=0,
-            max_tokens=256,
+            max_tokens=max_tokens,
             stop=["<|eot_id|>"],
         )
-        self.llm = LLM(
-            model="GoshaLetov/T-Lite-sft-no-optimizer",
-            enable_lora=False,
-            dtype="half",
-            tensor_parallel_size=4,
-        )
 
-    def decode_request(self, request: RequestModel, **kwargs) -> str:
+    def decode_request(self, request: RequestModel, **kwargs) -> RequestModel:
         """
-        Decodes an incoming request by extracting the query string.
+        Decodes an incoming request. The request is passed through as is, since both the query
+        and the selected adapter are needed for generation.
 
         Args:
             request (RequestModel): The request object containing the query text.
             **kwargs: Additional arguments (not used).
 
         Returns:
-            str: The query text extracted from the request.
+            RequestModel: The request.
         """
-        return request.query
+        return request
 
-    def predict(self, prompt: str, **kwargs) -> str:
+    def build_prompt(self, request: RequestModel) -> Prompt:
         """
-        Generates a response from the language model based on the provided prompt.
-        Applies LoRA adjustments and handles JSON output parsing.
+        Wraps the conversation and the user query into the model chat template, with the function
+        catalogs of the user messages shrunk to the functions relevant to their requests.
 
         Args:
-            prompt (str): The input prompt to generate a response from.
-            **kwargs: Additional arguments (not used).
+            request (RequestModel): The request with the query and the previous messages.
 
         Returns:
-            str: A JSON-formatted string with the model's response or an error message.
-
-        Raises:
-            HTTPException: If the output cannot be parsed as JSON or if an uncaught
-            exception occurs during response generation.
+            Prompt: The formatted and tokenized prompt ready for generation.
         """
-        prompt = self.tokenizer.apply_chat_template(
+        return self.sessions.prompt(
+            self.retriever.select(request.query).content,
             [
-                {
-                    "role": "user",
-                    "content": prompt
-                    + "\n"
-                    + """Отвечай в основном на русском. Выбранные аргументы "args" тоже должны быть на русском языке""",
-                },
+                (
+                    message.role,
+                    self.retriever.select(message.content).content if message.role == "user" else message.content,
+                )
+                for message in request.messages
             ],
-            tokenize=False,
-            add_generation_prompt=True,
-        )
-        response = self.llm.generate(
-            prompts=[prompt],
-            sampling_params=self.sampling_params,
+            session_id=request.session_id,
         )
 
-        output = response[0].outputs[0].text
+    def predict(
+        self, requests: Union[RequestModel, List[RequestModel]], **kwargs
+    ) -> Union[str, HTTPException, List[Union[str, HTTPException]]]:
+        """
+        Generates responses from the language model for a single request or a batch of requests.
+
+        Args:
+            requests (Union[RequestModel, List[RequestModel]]): The request, or the batch of
+                requests when the server batches them.
+            **kwargs: Additional arguments (not used).
+
+        Returns:
+            Union[str, HTTPException, List[Union[str, HTTPException]]]: A JSON-formatted string or an
+            error per request, in the shape of the input.
+        """
+        if isinstance(requests, RequestModel):
+            return self.generate([requests])[0]
+        return self.generate(requests)
+
+    def generate(self, requests: List[RequestModel]) -> List[Union[str, HTTPException]]:
+        """
+        Generates responses for a batch of requests, see `stream_generate`.
 
+        Args:
+            requests (List[RequestModel]): The batch of requests.
+
+        Returns:
+            List[Union[str, HTTPException]]: A JSON-formatted string or an error for every request.
+        """
+        outputs: List[Union[str, HTTPException]] = [""] * len(requests)
+        for events in self.stream_generate(requests, deltas=False):
+            for index, event in enumerate(events):
+                if isinstance(event, ResponseModel):
+                    outputs[index] = event.text
+                elif isinstance(event, HTTPException):
+                    outputs[index] = event
+        return outputs
+
+    def stream_generate(self, requests: List[RequestModel], deltas: bool = True) -> Iterator[List[StreamEvent]]:
+        """
+        Generates responses for a batch of requests. Requests selecting different adapters are
+        mixed in one generation call, as long as the adapters fit into the engine slots. Requests
+        whose clients already gave up are dropped, and generations are aborted as soon as their
+        clients give up. Every request gets its own generation limit, and generation stops as soon
+        as the answer object is complete. Conversations leaving no room for the shortest answer in the
+        model context are rejected.
+
+        Args:
+            requests (List[RequestModel]): The batch of requests.
+            deltas (bool, optional): Yield the text generated by every engine step, not only the results.
+
+        Yields:
+            List[StreamEvent]: An event or None for every request: the newly generated text, then
+            the final JSON-formatted answer or the error of the request.
+        """
+        events: List[StreamEvent] = [None] * len(requests)
+        cancellations = [
+            Cancellation.for_request(request.deadline, request.request_id, self.settings.CANCEL_DIR)
+            for request in requests
+        ]
+        lora_requests: List[Optional[LoRARequest]] = []
+        prompts: Dict[int, Prompt] = {}
+        max_prompt_tokens = self.budgeter.max_model_len - self.settings.MIN_NEW_TOKENS
+
+        for index, request in enumerate(requests):
+            try:
+                lora_requests.append(self.adapters.resolve(request.adapter))
+            except UnknownAdapterError:
+                lora_requests.append(None)
+                events[index] = HTTPException(404, detail=f"Unknown adapter: {request.adapter}")
+                continue
+
+            reason = cancellations[index].reason()
+            if reason is not None:
+                self.cancellation_stats.dropped += 1
+                self.cancellation_stats.log(reason, request.request_id)
+                events[index] = HTTPException(504, detail=f"Request cancelled: {reason}")
+                continue
+
+            if self.semantic_cache is not None and not request.messages:
+                answer = self.semantic_cache.get(request.query, request.adapter)
+                if answer is not None:
+                    events[index] = ResponseModel(text=answer)
+                    continue
+
+            prompts[index] = self.build_prompt(request)
+            if len(prompts[index].token_ids) > max_prompt_tokens:
+                events[index] = HTTPException(
+                    413, detail=f"Conversation too long: {len(prompts[index].token_ids)} tokens of {max_prompt_tokens}"
+                )
+
+        try:
+            pending = [index for index, event in enumerate(events) if event is None]
+            if len(pending) < len(requests):
+                yield events
+
+            budgets = {index: self.budgeter.budget(len(prompts[index].token_ids)) for index in pending}
+            for wave in self.adapters.waves([lora_requests[index] for index in pending]):
+                indices = [pending[position] for position in wave]
+                self.adapters.activate(lora_requests[index] for index in indices)
+                sent = dict.fromkeys(indices, 0)
+                generations: List[Generation] = []
+                for step in stream(
+                    self.llm,
+                    prompts=[prompts[index].token_ids for index in indices],
+                    sampling_params=[self.sampling_params(budgets[index]) for index in indices],
+                    lora_requests=[lora_requests[index] for index in indices],
+                    cancellations=[cancellations[index] for index in indices],
+                    stop_at_json_end=True,
+                ):
+                    generations = step
+                    if not deltas:
+                        continue
+                    events = [None] * len(requests)
+                    for index, generation in zip(indices, generations):
+                        if len(generation.text) > sent[index]:
+                            events[index] = DeltaModel(delta=generation.text[sent[index] :])
+                            sent[index] = len(generation.text)
+                    yield events
+
+                events = [None] * len(requests)
+                for index, generation in zip(indices, generations):
+                    if generation.cancelled is not None:
+                        self.cancellation_stats.aborted += 1
+                        self.cancellation_stats.tokens_saved += budgets[index] - generation.num_tokens
+                        self.cancellation_stats.log(generation.cancelled, requests[index].request_id)
+                        events[index] = HTTPException(504, detail=f"Request cancelled: {generation.cancelled}")
+                        continue
+                    self.budgeter.observe(generation.text, generation.num_tokens, budgets[index])
+                    logger.debug(
+                        "Generated answer",
+                        extra={
+                            "sampled": True,
+                            "request_id": requests[index].request_id,
+                            "prompt_tokens": len(prompts[index].token_ids),
+                            "reused_tokens": prompts[index].reused_tokens,
+                            "tokens": generation.num_tokens,
+                            "budget": budgets[index],
+                            "stopped_at_json_end": generation.stopped_at_json_end,
+                        },
+                    )
+                    token = REQUEST_ID.set(requests[index].request_id)
+                    try:
+                        answer = self.postprocess(
+                            prompts[index].text, generation.text, lora_requests[index], cancellations[index]
+                        )
+                    except HTTPException as error:
+                        events[index] = error
+                    else:
+                        events[index] = ResponseModel(text=answer)
+                        # The answer regenerated by the Jsonformer fallback is remembered instead of the invalid one.
+                        generated = generation.text if is_json(generation.text) else answer
+                        self.sessions.record(requests[index].session_id, prompts[index], answer, generated)
+                        if self.semantic_cache is not None and not requests[index].messages:
+                            self.semantic_cache.put(requests[index].query, answer, requests[index].adapter)
+                    finally:
+                        REQUEST_ID.reset(token)
+                yield events
+        finally:
+            for cancellation in cancellations:
+                cancellation.release()
+
+    def postprocess(
+        self, prompt: str, output: str, lora_request: Optional[LoRARequest], cancellation: Cancellation
+    ) -> str:
+        """
+        Validates the generated output as JSON, falling back to schema-guided generation
+        with Jsonformer when the model produced invalid JSON.
+
+        Args:
+            prompt (str): The formatted prompt the output was generated for.
+            output (str): The generated text.
+            lora_request (Optional[LoRARequest]): The adapter the output was generated with.
+            cancellation (Cancellation): The cancellation of the request, checked by the fallback.
+
+        Returns:
+            str: A JSON-formatted string with the model's response.
+
+        Raises:
+            HTTPException: If the output cannot be parsed as JSON or if an uncaught
+            exception occurs during response generation.
+        """
         try:
             return json.dumps(json.loads(output), ensure_ascii=False, indent=2)
 
         except json.decoder.JSONDecodeError as error:
-            print(error, "forcing JsonFormer")
+            logger.warning(f"Invalid JSON answer ({error}), forcing JsonFormer")
             try:
                 jsonformer = JsonformerVLLM(
                     llm=self.llm,
@@ -112,10 +410,17 @@ class SimpleLitAPI(ls.LitAPI):
                     json_schema=json_schema,
                     prompt=prompt,
                     debug=False,  # Enable debug mode to see detailed output
+                    lora_request=lora_request,
+                    cancellation=cancellation,
                 )
                 generated_data = jsonformer()
                 return json.dumps(generated_data, ensure_ascii=False, indent=2)
 
+            except RequestCancelledError as error:
+                self.cancellation_stats.aborted_fallback += 1
+                self.cancellation_stats.log(error.reason, cancellation.request_id)
+                raise HTTPException(504, detail=str(error)) from None
+
             except json.decoder.JSONDecodeError as error:
                 raise HTTPException(
                     422,
@@ -134,30 +439,151 @@ class SimpleLitAPI(ls.LitAPI):
                 detail=f"Uncaught exception: {error}. Got: {output}",
             ) from None
 
-    def encode_response(self, output: str, **kwargs) -> ResponseModel:
+    def encode_response(self, output: Union[str, HTTPException], **kwargs) -> ResponseModel:
         """
         Encodes the model's output into a `ResponseModel` for returning to the client.
 
+        Errors are encoded as error responses here instead of being raised, so that a failed
+        request does not fail the other requests of its batch.
+
         Args:
-            output (str): The generated output from the model.
+            output (Union[str, HTTPException]): The generated output from the model or the request error.
             **kwargs: Additional arguments (not used).
 
         Returns:
             ResponseModel: The response model containing the generated text.
         """
+        if isinstance(output, HTTPException):
+            return JSONResponse({"detail": output.detail}, status_code=output.status_code)  # type: ignore[return-value]
         return ResponseModel(text=output)
 
 
+class StreamingLitAPI(SimpleLitAPI):
+    """
+    The API streaming the answers as newline-delimited JSON: a `{"delta": ...}` line with the text
+    generated by every engine step, then a `{"text": ...}` line with the final answer, or a
+    `{"detail": ..., "status": ...}` line if the request failed. The final line replaces the
+    streamed text, since the answer may be regenerated by the Jsonformer fallback.
+    """
+
+    def predict(self, requests: Union[RequestModel, List[RequestModel]], **kwargs) -> Iterator[Any]:  # type: ignore[override]
+        """
+        Streams the events of a single request or of every request of a batch.
+
+        Args:
+            requests (Union[RequestModel, List[RequestModel]]): The request, or the batch of
+                requests when the server batches them.
+            **kwargs: Additional arguments (not used).
+
+        Yields:
+            Union[StreamEvent, List[StreamEvent]]: The events of every engine step, in the shape of the input.
+        """
+        if isinstance(requests, RequestModel):
+            for events in self.stream_generate([requests]):
+                yield events[0]
+        else:
+            yield from self.stream_generate(requests)
+
+    def encode_response(self, outputs: Iterator[Any], **kwargs) -> Iterator[Any]:  # type: ignore[override]
+        """
+        Encodes the events into the lines of the stream. Steps without news for a request produce no line.
+
+        Args:
+            outputs (Iterator[Any]): The events of a request, or of every request of a batch, per step.
+            **kwargs: Additional arguments (not used).
+
+        Yields:
+            Any: The encoded event, or the encoded events of every request of a batch, per step.
+        """
+        for events in outputs:
+            if isinstance(events, list):
+                yield [self.encode_event(event) for event in events]
+            else:
+                yield self.encode_event(events)
+
+    @staticmethod
+    def encode_event(event: StreamEvent) -> Union[DeltaModel, ResponseModel, Dict[str, Any], str]:
+        """
+        Encodes the event of a request into a line of the stream.
+
+        Args:
+            event (StreamEvent): The event of the request at an engine step.
+
+        Returns:
+            Union[DeltaModel, ResponseModel, Dict[str, Any], str]: The delta or the final answer as is, the
+            detail and status of an error, or an empty string, which produces no line, if there is no event.
+        """
+        if event is None:
+            return ""
+        if isinstance(event, HTTPException):
+            return {"detail": event.detail, "status": event.status_code}
+        return event
+
+
+def is_json(text: str) -> bool:
+    """
+    Checks whether a text is valid JSON.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        bool: Whether the text parses as JSON.
+    """
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def ready_endpoint(settings: Settings):
+    """
+    Creates the `/ready` endpoint, which only reports success after the inference worker
+    finished its warmup.
+
+    Args:
+        settings (Settings): The inference server settings.
+
+    Returns:
+        Callable: The FastAPI endpoint function.
+    """
+
+    async def ready() -> JSONResponse:
+        """
+        Reports the readiness of the inference worker.
+
+        Returns:
+            JSONResponse: The startup timing breakdown with status 200, or status 503 while warming up.
+        """
+        report = read_ready(settings.READY_FILE)
+        if report is None:
+            return JSONResponse({"status": "warming up"}, status_code=503)
+        return JSONResponse({"status": "ready", "startup": report})
+
+    return ready
+
+
 if __name__ == "__main__":
     """
-    Starts the FastAPI server with the SimpleLitAPI for handling requests.
-    The server runs on port 8000 with specified batch size and timeout settings.
+    Starts the FastAPI server with the SimpleLitAPI for handling requests, or the StreamingLitAPI
+    if `STREAM` is set. The server runs on port 8000 with specified batch size and timeout settings.
     """
-    ls.LitServer(
-        lit_api=SimpleLitAPI(),
+    settings = Settings.from_env()
+    clear_ready(settings.READY_FILE)
+
+    api_class = StreamingLitAPI if settings.STREAM else SimpleLitAPI
+    lit_api = api_class(settings=settings)
+    lit_api.setup_logging("server")
+    server = ls.LitServer(
+        lit_api=lit_api,
         accelerator="auto",
-        max_batch_size=1,
+        max_batch_size=settings.MAX_BATCH_SIZE,
+        batch_timeout=settings.BATCH_TIMEOUT,
         api_path="/assist",
-        stream=False,
+        stream=settings.STREAM,
         timeout=300,
-    ).run(port=8000)
+    )
+    server.app.add_api_route("/ready", ready_endpoint(settings), methods=["GET"])
+    server.app.add_middleware(CancellationMiddleware, path="/assist", cancel_dir=settings.CANCEL_DIR)
+    server.run(port=8000)
@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+
+from config import Settings
+
+
+def speculative_kwargs(settings: Settings) -> Dict[str, Any]:
+    """
+    Builds the engine arguments enabling prompt-lookup speculative decoding.
+
+    With `[ngram]` as the draft model, vLLM proposes the tokens that followed the latest n-gram of the
+    context at its earlier occurrence in the prompt or the output, and verifies all of them in a single
+    forward pass of the model. Answers mostly copy function names and argument values from the prompt,
+    so such drafts are accepted often.
+
+    Args:
+        settings (Settings): The inference server settings.
+
+    Returns:
+        Dict[str, Any]: Keyword arguments for `vllm.LLM`, empty if speculative decoding is disabled.
+    """
+    if not settings.SPECULATIVE:
+        return {}
+    return {
+        "speculative_model": "[ngram]",
+        "num_speculative_tokens": settings.NUM_SPECULATIVE_TOKENS,
+        "ngram_prompt_lookup_max": settings.NGRAM_PROMPT_LOOKUP_MAX,
+        "ngram_prompt_lookup_min": settings.NGRAM_PROMPT_LOOKUP_MIN,
+        "use_v2_block_manager": True,
+    }
+
+
+class NgramProposer:
+    """
+    Prompt-lookup draft proposer, mirroring the `[ngram]` proposer of vLLM. Used to measure offline how
+    many draft tokens the model would accept.
+
+    Attributes:
+        num_tokens (int): Maximum number of draft tokens proposed per step.
+        lookup_max (int): Longest n-gram searched for in the context.
+        lookup_min (int): Shortest n-gram searched for in the context.
+    """
+
+    def __init__(self, num_tokens: int, lookup_max: int, lookup_min: int):
+        self.num_tokens = num_tokens
+        self.lookup_max = lookup_max
+        self.lookup_min = lookup_min
+
+    def propose(self, context: Sequence[int]) -> List[int]:
+        """
+        Proposes draft tokens continuing the context.
+
+        Args:
+            context (Sequence[int]): Token ids of the prompt and the tokens generated so far.
+
+        Returns:
+            List[int]: The draft tokens, empty if no n-gram of the context end occurred earlier.
+        """
+        for size in range(min(self.lookup_max, len(context) - 1), self.lookup_min - 1, -1):
+            ngram = list(context[-size:])
+            for start in range(len(context) - size):
+                if list(context[start : start + size]) == ngram:
+                    follow = start + size
+                    return list(context[follow : follow + self.num_tokens])
+        return []
+
+
+@dataclass
+class AcceptanceStats:
+    """
+    Outcome of speculative decoding of reference answers with a draft proposer.
+
+    Attributes:
+        generated (int): Number of answer tokens.
+        proposed (int): Number of draft tokens proposed.
+        accepted (int): Number of draft tokens matching the answer.
+        steps (int): Number of model forward passes needed to generate the answers.
+    """
+
+    generated: int = 0
+    proposed: int = 0
+    accepted: int = 0
+    steps: int = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / max(self.proposed, 1)
+
+    @property
+    def tokens_per_step(self) -> float:
+        return self.generated / max(self.steps, 1)
+
+
+def simulate(proposer: NgramProposer, prompt: Sequence[int], answer: Sequence[int], stats: AcceptanceStats) -> None:
+    """
+    Replays greedy speculative decoding of a known answer: at every step the draft is verified
+    against the answer, the matching prefix is accepted and the model adds one token of its own.
+
+    Args:
+        proposer (NgramProposer): The draft proposer.
+        prompt (Sequence[int]): Token ids of the prompt.
+        answer (Sequence[int]): Token ids of the answer the model generates.
+        stats (AcceptanceStats): Statistics updated in place.
+    """
+    context = list(prompt)
+    position = 0
+    while position < len(answer):
+        draft = proposer.propose(context)
+        accepted = 0
+        for token, expected in zip(draft, answer[position:]):
+            if token != expected:
+                break
+            accepted += 1
+
+        produced = min(accepted + 1, len(answer) - position)
+        context.extend(answer[position : position + produced])
+        position += produced
+        stats.proposed += len(draft)
+        stats.accepted += accepted
+        stats.steps += 1
+    stats.generated += len(answer)
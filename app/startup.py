@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import pathlib
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+WARMUP_QUERIES: Tuple[str, ...] = (
+    "Вы -- полезный помощник со следующими функциями:\n"
+    "Поиск и бронирование отелей: 'book_hotel', аргументы: 'city': '<Город>', 'check_in': '<Дата заезда>', "
+    "'check_out': '<Дата выезда>', 'guests': '<Количество гостей>'\n"
+    "Привет! Можешь найти и забронировать отель в Париже на следующую неделю для двоих?",
+    "Вы -- полезный помощник со следующими функциями:\n"
+    "Конвертация валюты: 'convert_currency', аргументы: 'amount': '<Сумма>', 'from_currency': '<Исходная валюта>', "
+    "'to_currency': '<Целевая валюта>'\n"
+    "Сколько будет 500 долларов в евро?",
+    "Вы -- полезный помощник со следующими функциями:\n"
+    "Получение прогноза погоды: 'get_weather', аргументы: 'city': '<Город>', 'date': '<Дата>'\n"
+    "Какая погода будет завтра в Москве?",
+    "Ты -- полезный помощник без дополнительных функций \nРасскажи короткий анекдот про программистов.",
+)
+
+# WARMUP_QUERIES: Representative queries in the format of `prompts/evaluate.json`, generated once at startup so
+# that the first real request does not pay for cold allocator pools and kernel autotuning.
+
+
+class StartupTimer:
+    """
+    Collects wall-clock durations of the named server startup stages.
+
+    Attributes:
+        stages (Dict[str, float]): Duration in seconds of every finished stage, in execution order.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._started_at = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measures the duration of the wrapped block and records it under `name`.
+
+        Args:
+            name (str): The name of the startup stage.
+
+        Yields:
+            None
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - started_at
+
+    def report(self) -> Dict[str, float]:
+        """
+        Returns the startup breakdown including the total time since the timer was created.
+
+        Returns:
+            Dict[str, float]: Stage durations in seconds with an additional `total` entry.
+        """
+        return {**self.stages, "total": time.perf_counter() - self._started_at}
+
+    def log(self) -> None:
+        """
+        Logs the startup timing breakdown.
+        """
+        breakdown = ", ".join(f"{name}={duration:.2f}s" for name, duration in self.report().items())
+        logger.info(f"Startup finished: {breakdown}", extra={"startup": self.report()})
+
+
+def check_manifest(weights_dir: pathlib.Path) -> Optional[str]:
+    """
+    Checks a weights directory against the manifest written by `training/export_model.py`, so that a
+    partially copied export is not loaded. The manifest is required: uploads and copies write it last, so
+    a directory without it may be incomplete. Only the sizes are compared, hashing the shards would cost as
+    much as reading them.
+
+    Args:
+        weights_dir (pathlib.Path): The weights directory.
+
+    Returns:
+        Optional[str]: The first problem found, or None if the files match the manifest.
+    """
+    manifest_path = weights_dir / "manifest.json"
+    if not manifest_path.is_file():
+        return "Missing manifest.json"
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    for file in manifest["files"]:
+        path = weights_dir / file["path"]
+        if not path.is_file():
+            return f"Missing {file['path']}"
+        if path.stat().st_size != file["size"]:
+            return f"Truncated {file['path']}"
+    return None
+
+
+def resolve_weights(settings: Settings) -> Tuple[str, str]:
+    """
+    Chooses where the engine loads the model weights from.
+
+    A local directory with pre-converted safetensors shards, complete according to its manifest, is preferred:
+    vLLM opens them with `safe_open`, which memory-maps the files, so the weights are paged in straight from
+    the local disk without a hub lookup or a pickle deserialization pass.
+
+    Args:
+        settings (Settings): The inference server settings.
+
+    Returns:
+        Tuple[str, str]: The model path or name, and the vLLM `load_format` to use for it.
+    """
+    if settings.WEIGHTS_DIR:
+        weights_dir = pathlib.Path(settings.WEIGHTS_DIR)
+        problem = check_manifest(weights_dir)
+        if problem:
+            logger.warning(f"{problem} in {weights_dir}, falling back to {settings.MODEL_NAME}")
+        elif (weights_dir / "config.json").is_file() and any(weights_dir.glob("*.safetensors")):
+            return str(weights_dir), "safetensors"
+        else:
+            logger.warning(f"No safetensors weights found in {weights_dir}, falling back to {settings.MODEL_NAME}")
+    return settings.MODEL_NAME, "auto"
+
+
+def clear_ready(path: str) -> None:
+    """
+    Removes a readiness marker left over from a previous run.
+
+    Args:
+        path (str): The path of the readiness marker file.
+    """
+    pathlib.Path(path).unlink(missing_ok=True)
+
+
+def mark_ready(path: str, report: Dict[str, float]) -> None:
+    """
+    Atomically writes the readiness marker with the startup timing breakdown.
+
+    Args:
+        path (str): The path of the readiness marker file.
+        report (Dict[str, float]): The startup timing breakdown to store in the marker.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+    os.replace(tmp_path, path)
+
+
+def read_ready(path: str) -> Optional[Dict[str, float]]:
+    """
+    Reads the readiness marker written by the inference worker.
+
+    Args:
+        path (str): The path of the readiness marker file.
+
+    Returns:
+        Optional[Dict[str, float]]: The startup timing breakdown, or None if the worker is not ready yet.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
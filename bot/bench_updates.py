@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+SERVER = pathlib.Path(__file__).parent / "server.py"
+TOKEN = "42:bench-token"  # noqa: S105
+SECRET = "bench-secret"  # noqa: S105
+
+# SERVER: Path to the bot entry point started by the benchmark.
+# TOKEN: Fake bot token, accepted by the fake Bot API server.
+# SECRET: Webhook secret the generator authenticates the updates with.
+
+
+def fake_update(update_id: int, chat_id: int) -> Dict[str, Any]:
+    """
+    Builds a `/start` message update. The bot answers it without calling the app, so the benchmark
+    measures the update handling of the bot alone.
+
+    Args:
+        update_id (int): Identifier of the update.
+        chat_id (int): Identifier of the private chat the message comes from.
+
+    Returns:
+        Dict[str, Any]: The update in the Bot API format.
+    """
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+class FakeTelegram:
+    """
+    Minimal Bot API server: serves the queued updates to `getUpdates` and counts the answers
+    the bot sends back.
+
+    Attributes:
+        updates (List[Dict[str, Any]]): The updates published so far.
+        answered (int): Number of `sendMessage` calls received.
+        polling (asyncio.Event): Set on the first `getUpdates` call.
+    """
+
+    def __init__(self):
+        self.updates: List[Dict[str, Any]] = []
+        self.answered = 0
+        self.polling = asyncio.Event()
+        self._published = asyncio.Condition()
+        self._answered = asyncio.Condition()
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def publish(self, updates: List[Dict[str, Any]]) -> None:
+        async with self._published:
+            self.updates.extend(updates)
+            self._published.notify_all()
+
+    async def wait_answered(self, count: int) -> None:
+        async with self._answered:
+            await self._answered.wait_for(lambda: self.answered >= count)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await request.post()
+
+        if method == "getupdates":
+            self.polling.set()
+            result: Any = await self._get_updates(
+                int(str(params.get("offset") or 0)),
+                int(str(params.get("limit") or 100)),
+                float(str(params.get("timeout") or 0)),
+            )
+        elif method == "sendmessage":
+            async with self._answered:
+                self.answered += 1
+                self._answered.notify_all()
+            result = {
+                "message_id": self.answered,
+                "date": int(time.time()),
+                "chat": {"id": int(str(params["chat_id"])), "type": "private"},
+                "text": params.get("text"),
+            }
+        elif method == "getme":
+            result = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, offset: int, limit: int, timeout: float) -> List[Dict[str, Any]]:
+        async with self._published:
+            pending = [update for update in self.updates if update["update_id"] >= offset]
+            if not pending and timeout:
+                try:
+                    await asyncio.wait_for(
+                        self._published.wait_for(lambda: self.updates and self.updates[-1]["update_id"] >= offset),
+                        timeout=timeout,
+                    )
+                except asyncio.TimeoutError:
+                    return []
+                pending = [update for update in self.updates if update["update_id"] >= offset]
+        return pending[:limit]
+
+
+async def post_updates(url: str, updates: List[Dict[str, Any]], concurrency: int) -> None:
+    """
+    Delivers the updates to the webhook the way Telegram does, with a bounded number of parallel connections.
+
+    Args:
+        url (str): The webhook URL.
+        updates (List[Dict[str, Any]]): The updates to deliver.
+        concurrency (int): Number of parallel connections.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def deliver(session: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            update = queue.get_nowait()
+            while True:
+                try:
+                    async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}):
+                        break
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.1)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*(deliver(session) for _ in range(concurrency)))
+
+
+async def benchmark(args: argparse.Namespace) -> float:
+    """
+    Starts the fake Bot API server and the bot in the requested mode, and measures how fast the bot
+    answers a burst of updates after a warmup.
+
+    Args:
+        args (argparse.Namespace): The benchmark arguments.
+
+    Returns:
+        float: The handled updates per second.
+    """
+    telegram = FakeTelegram()
+    runner = web.AppRunner(telegram.application(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_API_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}",
+        "BOT_MODE": args.mode,
+        "WEBHOOK_URL": f"http://127.0.0.1:{args.webhook_port}",
+        "WEBHOOK_SECRET": SECRET,
+        "WEBHOOK_HOST": "127.0.0.1",
+        "WEBHOOK_PORT": str(args.webhook_port),
+        "WEBHOOK_WORKERS": str(args.workers),
+    }
+    bot = await asyncio.create_subprocess_exec(sys.executable, str(SERVER), env=env)
+
+    async def send(updates: List[Dict[str, Any]]) -> None:
+        if args.mode == "polling":
+            await telegram.publish(updates)
+        else:
+            await post_updates(f"http://127.0.0.1:{args.webhook_port}/webhook", updates, args.concurrency)
+
+    try:
+        if args.mode == "polling":
+            await asyncio.wait_for(telegram.polling.wait(), timeout=60)
+
+        warmup = [fake_update(index + 1, 1000 + index % args.chats) for index in range(args.warmup)]
+        await send(warmup)
+        await asyncio.wait_for(telegram.wait_answered(len(warmup)), timeout=60)
+
+        updates = [fake_update(len(warmup) + index + 1, 1000 + index % args.chats) for index in range(args.updates)]
+        started_at = time.perf_counter()
+        await send(updates)
+        await asyncio.wait_for(telegram.wait_answered(len(warmup) + len(updates)), timeout=600)
+        return len(updates) / (time.perf_counter() - started_at)
+
+    finally:
+        bot.terminate()
+        await bot.wait()
+        await runner.cleanup()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the update throughput of the bot.")
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both", help="Modes to benchmark.")
+    parser.add_argument("--updates", type=int, default=5000, help="Number of measured updates.")
+    parser.add_argument("--warmup", type=int, default=200, help="Number of warmup updates.")
+    parser.add_argument("--chats", type=int, default=500, help="Number of distinct chats sending the updates.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of webhook worker processes.")
+    parser.add_argument("--concurrency", type=int, default=40, help="Parallel webhook connections, as Telegram.")
+    parser.add_argument("--api-port", type=int, default=8081, help="Port of the fake Bot API server.")
+    parser.add_argument("--webhook-port", type=int, default=8080, help="Port of the webhook server.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Runs the bot against a local fake Telegram and reports the updates handled per second in
+    long polling mode, webhook mode, or both.
+    """
+    args = parse_arguments()
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        args.mode = mode
+        rate = asyncio.run(benchmark(args))
+        workers = f", workers={args.workers}" if mode == "webhook" else ""
+        print(f"{mode}: {rate:.0f} updates/s ({args.updates} updates, {args.chats} chats{workers})")
@@ -1,3 +1,6 @@
+from typing import List, Literal, Optional
+
+from constants import DATA_DIR
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings
 
@@ -11,6 +14,48 @@ class Settings(BaseSettings):
 
     Attributes:
         TELEGRAM_BOT_API_TOKEN (SecretStr): The API token for the Telegram bot, which is stored as a secret.
+        TELEGRAM_API_URL (Optional[str]): Base URL of a custom Bot API server, the official one if not set.
+        BOT_MODE (Literal["polling", "webhook"]): How the bot receives updates: long polling in a single
+            process, or a webhook served by several worker processes.
+        WEBHOOK_URL (Optional[str]): Public base URL Telegram sends the updates to, required in webhook mode.
+        WEBHOOK_PATH (str): Path of the webhook endpoint.
+        WEBHOOK_SECRET (Optional[SecretStr]): Token Telegram sends with every update to authenticate itself.
+        WEBHOOK_HOST (str): Interface the webhook server listens on.
+        WEBHOOK_PORT (int): Port the webhook server listens on, shared by all the workers.
+        WEBHOOK_WORKERS (int): Number of worker processes serving the webhook. Every chat is handled by the same
+            worker, the one of its id modulo the number of workers.
+        FSM_STORAGE (Literal["memory", "sqlite", "redis"]): Where the chat states are kept: in the process,
+            in a SQLite database shared by the processes of the host, or in a Redis-compatible server.
+        FSM_SQLITE_PATH (str): Path to the SQLite database of the chat states.
+        FSM_SQLITE_POOL_SIZE (int): Number of connections to the SQLite database per process.
+        FSM_REDIS_URL (Optional[str]): URL of the Redis-compatible server of the chat states.
+        FSM_BUSY_TTL (float): Seconds after which a chat waiting for an answer is considered free again.
+        APP_URL (str): Base URL of the app service answering the queries.
+        APP_CONNECTION_LIMIT (int): Maximum number of simultaneous keep-alive connections to the app.
+        APP_KEEPALIVE_TIMEOUT (float): Seconds an idle connection to the app is kept open for reuse.
+        APP_RETRIES (int): Maximum number of retries of a request to the app after a connection error.
+        APP_RETRY_BACKOFF (float): Base delay in seconds of the jittered exponential backoff between retries.
+        APP_MAX_CONCURRENCY (int): Maximum number of requests in flight to the app, its admission capacity. Like
+            the other limits of the app requests, it holds for the whole bot and is split evenly between the
+            webhook workers, each enforcing its share in its own process.
+        APP_RATE_LIMIT (float): Requests per second sent to the app on average.
+        APP_RATE_BURST (int): Maximum number of requests sent to the app at once after an idle period.
+        ANSWER_CACHE_SIZE (int): Maximum number of recent answers cached, 0 disables the cache.
+        ANSWER_CACHE_TTL (float): Seconds an answer stays in the cache, 0 disables the cache.
+        STREAMING (bool): Shows the answers while they are generated, editing one message. Requires the app
+            to run with `STREAM=true`.
+        STREAM_EDIT_INTERVAL (float): Minimum seconds between edits of one streamed message.
+        STREAM_EDITS_PER_SECOND (float): Maximum edits of streamed messages per second across all chats, split
+            evenly between the webhook workers.
+        CHAT_QUEUE_DEPTH (int): Maximum number of messages of one chat waiting for their turn.
+        HISTORY_TURNS (int): Maximum number of previous exchanges of a chat sent with a query, 0 answers every
+            message on its own.
+        HISTORY_MAX_CHARS (int): Maximum total length of the previous messages sent with a query.
+        ADMIN_CHAT_IDS (List[int]): Chats allowed to use the /stats command, as a JSON list, e.g. `[123, 456]`.
+        LOG_LEVEL (str): Minimum level of the logged records.
+        LOG_ROTATION (str): Size at which a log file is rotated.
+        LOG_RETENTION (int): Number of rotated, gzipped log files kept per process.
+        LOG_SAMPLE_RATE (float): Fraction of the high-volume per-request debug records kept.
 
     Configuration:
         - Loads environment variables from a file named `.env`.
@@ -18,6 +63,40 @@ class Settings(BaseSettings):
     """
 
     TELEGRAM_BOT_API_TOKEN: SecretStr
+    TELEGRAM_API_URL: Optional[str] = None
+    BOT_MODE: Literal["polling", "webhook"] = "polling"
+    WEBHOOK_URL: Optional[str] = None
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: Optional[SecretStr] = None
+    WEBHOOK_HOST: str = "0.0.0.0"  # noqa: S104
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_WORKERS: int = 4
+    FSM_STORAGE: Literal["memory", "sqlite", "redis"] = "sqlite"
+    FSM_SQLITE_PATH: str = str(DATA_DIR / "fsm.sqlite3")
+    FSM_SQLITE_POOL_SIZE: int = 4
+    FSM_REDIS_URL: Optional[str] = None
+    FSM_BUSY_TTL: float = 120
+    APP_URL: str = "http://app:8000"
+    APP_CONNECTION_LIMIT: int = 100
+    APP_KEEPALIVE_TIMEOUT: float = 30
+    APP_RETRIES: int = 3
+    APP_RETRY_BACKOFF: float = 0.5
+    APP_MAX_CONCURRENCY: int = 8
+    APP_RATE_LIMIT: float = 4
+    APP_RATE_BURST: int = 8
+    ANSWER_CACHE_SIZE: int = 1024
+    ANSWER_CACHE_TTL: float = 300
+    STREAMING: bool = False
+    STREAM_EDIT_INTERVAL: float = 1.5
+    STREAM_EDITS_PER_SECOND: float = 20
+    CHAT_QUEUE_DEPTH: int = 3
+    HISTORY_TURNS: int = 4
+    HISTORY_MAX_CHARS: int = 8000
+    ADMIN_CHAT_IDS: List[int] = []
+    LOG_LEVEL: str = "INFO"
+    LOG_ROTATION: str = "50 MB"
+    LOG_RETENTION: int = 10
+    LOG_SAMPLE_RATE: float = 0.01
 
     class Config:
         """
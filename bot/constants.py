@@ -2,6 +2,10 @@ import pathlib
 
 BOT_DIR = pathlib.Path(__file__).parent.absolute()
 LOG_DIR = BOT_DIR / "logs"
+DATA_DIR = BOT_DIR / "data"
+APP_REQUEST_TIMEOUT = 60
 
 # BOT_DIR: Absolute path to the directory containing the current script file.
 # LOG_DIR: Path to the "logs" directory within the bot's directory.
+# DATA_DIR: Path to the "data" directory within the bot's directory, holding the persistent bot state.
+# APP_REQUEST_TIMEOUT: Seconds the bot waits for an answer of the app, sent to it as the request deadline.
@@ -1,10 +1,16 @@
+import contextvars
 import logging
+import random
 import sys
 from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Optional
 
 from constants import LOG_DIR
 from loguru import logger
 
+if TYPE_CHECKING:
+    from loguru import Record
+
 LEVELS_MAP: MappingProxyType[int, str] = MappingProxyType(
     {
         logging.CRITICAL: "CRITICAL",
@@ -15,6 +21,10 @@ LEVELS_MAP: MappingProxyType[int, str] = MappingProxyType(
     }
 )
 
+REQUEST_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# REQUEST_ID: Id of the request being processed, added to the records logged while it is set and sent to the app.
+
 
 class InterceptHandler(logging.Handler):
     """
@@ -53,22 +63,82 @@ class InterceptHandler(logging.Handler):
         return LEVELS_MAP.get(record.levelno, record.levelno)
 
 
-def setup():
+def add_request_id(record: "Record") -> None:
+    """
+    Stamps a record with the id of the request being processed. Patchers run in the thread that logs,
+    before the record is queued, so the context variable is read in the right context.
+
+    Args:
+        record (Record): The loguru record.
+    """
+    record["extra"].setdefault("request_id", REQUEST_ID.get())
+
+
+def sample(rate: float) -> Callable[["Record"], bool]:
+    """
+    Creates a filter keeping only a fraction of the records bound with `sampled=True`, meant for
+    high-volume debug records such as per-request details. Other records always pass.
+
+    Args:
+        rate (float): Fraction of the sampled records kept.
+
+    Returns:
+        Callable[[Record], bool]: The loguru filter.
+    """
+
+    def keep(record: "Record") -> bool:
+        return not record["extra"].get("sampled", False) or random.random() < rate
+
+    return keep
+
+
+def setup(
+    name: str = "bot",
+    level: str = "INFO",
+    rotation: str = "50 MB",
+    retention: int = 10,
+    sample_rate: float = 0.01,
+):
     """
     Configures logging for the application. It sets up the Loguru logger to log to both
     standard error (`sys.stderr`) and a rotating log file in the specified `LOG_DIR`.
 
+    Both sinks are queued (`enqueue=True`): a log call only puts the record into a queue and a
+    background thread writes it, so the event loop never waits for the terminal or the disk.
+
     It also integrates the standard Python `logging` module with Loguru by using
     `InterceptHandler` to redirect log messages from `logging` to Loguru.
 
     Loggers:
-        - Logs to `sys.stderr` with a specified format and logs only messages with the
-          "INFO" level or higher.
-        - Logs to a rotating log file in the `LOG_DIR` directory.
+        - Logs to `sys.stderr` in a readable format with the request id, messages with the
+          `level` or higher.
+        - Logs JSON records to `LOG_DIR/<name>.log`, rotated by size, gzipped and pruned to
+          the `retention` latest files.
 
-    The function also initializes basic configuration for Python's `logging` module to use
-    the `InterceptHandler` and set the default level to `INFO`.
+    Args:
+        name (str, optional): Name of the process, used as the log file name. Processes must not share it.
+        level (str, optional): Minimum level of the logged records.
+        rotation (str, optional): Size at which the log file is rotated.
+        retention (int, optional): Number of rotated log files kept.
+        sample_rate (float, optional): Fraction of the sampled debug records kept.
     """
-    logger.add(sys.stderr, format="{time} {level} {message}", filter="my_module", level="INFO")
-    logger.add(LOG_DIR / "file_{time}.log")
-    logging.basicConfig(handlers=[InterceptHandler()], level=logging.INFO)
+    logger.remove()
+    logger.configure(patcher=add_request_id)
+    logger.add(
+        sys.stderr,
+        format="{time} {level} [{extra[request_id]}] {message}",
+        level=level,
+        filter=sample(sample_rate),
+        enqueue=True,
+    )
+    logger.add(
+        LOG_DIR / f"{name}.log",
+        level=level,
+        filter=sample(sample_rate),
+        rotation=rotation,
+        retention=retention,
+        compression="gz",
+        serialize=True,
+        enqueue=True,
+    )
+    logging.basicConfig(handlers=[InterceptHandler()], level=level, force=True)
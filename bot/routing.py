@@ -0,0 +1,126 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+from constants import DATA_DIR
+from loguru import logger
+
+FORWARD_TIMEOUT = 10
+FORWARD_RETRY_DELAY = 0.1
+
+# FORWARD_TIMEOUT: Seconds a worker waits for the owner of a chat to accept a forwarded update.
+# FORWARD_RETRY_DELAY: Seconds between the attempts to reach an owner that is not listening yet.
+
+
+def worker_socket(index: int) -> str:
+    """
+    Path of the Unix socket a webhook worker receives the updates of its chats on.
+
+    Args:
+        index (int): Number of the worker.
+
+    Returns:
+        str: The socket path.
+    """
+    return str(DATA_DIR / f"webhook-{index}.sock")
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Finds the chat an update belongs to: the chat of its event, of the message of a callback query, or the
+    user of an event without a chat.
+
+    Args:
+        update (Dict[str, Any]): The update in the Bot API format.
+
+    Returns:
+        Optional[int]: The chat id, None if the update has none.
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat") or event.get("from")
+        if chat and "id" in chat:
+            return chat["id"]
+    return None
+
+
+class ChatRoutingRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler of one of several worker processes, making every chat handled by the same worker.
+
+    The workers share the public port, so an update reaches any of them. The update of a chat owned by
+    another worker is forwarded to it over its Unix socket before Telegram is answered, so the per-chat queue,
+    history and streaming limits of a chat live in a single process and its updates keep their order.
+    Updates without a chat are handled where they arrive.
+
+    Attributes:
+        index (int): Number of this worker.
+        workers (int): Number of worker processes.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, *, index: int, workers: int, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, **kwargs)
+        self.index = index
+        self.workers = workers
+        self._sessions: Dict[int, aiohttp.ClientSession] = {}
+
+    def owner(self, update: Dict[str, Any]) -> int:
+        """
+        Picks the worker owning the chat of an update.
+
+        Args:
+            update (Dict[str, Any]): The update in the Bot API format.
+
+        Returns:
+            int: Number of the worker.
+        """
+        chat_id = update_chat_id(update)
+        return self.index if chat_id is None else chat_id % self.workers
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Handles the update of a chat owned by this worker, forwards it to its owner otherwise."""
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if self.workers > 1 and self.verify_secret(token, self.bot):
+            owner = self.owner(await request.json(loads=self.bot.session.json_loads))
+            if owner != self.index:
+                return await self._forward(owner, request, token)
+        return await super().handle(request)
+
+    async def close(self) -> None:
+        """Closes the bot session and the connections to the other workers."""
+        for session in self._sessions.values():
+            await session.close()
+        await super().close()
+
+    async def _forward(self, owner: int, request: web.Request, token: str) -> web.Response:
+        """
+        Sends the update to its owner, waiting for it while it is starting, and answers Telegram with an error
+        if the owner stays down, so that Telegram delivers the update again.
+        """
+        if owner not in self._sessions:
+            self._sessions[owner] = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=worker_socket(owner)))
+        deadline = time.monotonic() + FORWARD_TIMEOUT
+        while True:
+            try:
+                async with self._sessions[owner].post(
+                    f"http://worker-{owner}{request.path}",
+                    data=await request.read(),
+                    headers={"Content-Type": request.content_type, "X-Telegram-Bot-Api-Secret-Token": token},
+                    timeout=aiohttp.ClientTimeout(total=max(deadline - time.monotonic(), 0)),
+                ) as response:
+                    return web.Response(
+                        status=response.status, body=await response.read(), content_type=response.content_type
+                    )
+            except aiohttp.ClientConnectorError as error:
+                if time.monotonic() + FORWARD_RETRY_DELAY >= deadline:
+                    logger.warning(f"Cannot forward an update to worker {owner}: {error!r}")
+                    return web.Response(status=503)
+                await asyncio.sleep(FORWARD_RETRY_DELAY)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                logger.warning(f"Cannot forward an update to worker {owner}: {error!r}")
+                return web.Response(status=503)
@@ -1,52 +1,248 @@
 import asyncio
+import multiprocessing
+import signal
 
 import logger
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
 from config import Settings
+from constants import APP_REQUEST_TIMEOUT, DATA_DIR
+from routing import ChatRoutingRequestHandler, worker_socket
 from services import routers
+from services.assist.client import AppClient
+from services.assist.history import ChatHistory
+from services.assist.queues import ChatQueues
+from services.assist.states import AssistUserStates
+from services.assist.streaming import AnswerStreamer
+from storage import create_storage
 
 
-async def main():
+def setup_logging(settings: Settings, name: str) -> None:
+    """
+    Sets up the queued logging of the current process.
+
+    Args:
+        settings (Settings): The bot settings.
+        name (str): Name of the process, used as the log file name.
+    """
+    logger.setup(
+        name,
+        level=settings.LOG_LEVEL,
+        rotation=settings.LOG_ROTATION,
+        retention=settings.LOG_RETENTION,
+        sample_rate=settings.LOG_SAMPLE_RATE,
+    )
+
+
+def create_bot(settings: Settings) -> Bot:
+    """
+    Creates the bot instance, talking to a custom Bot API server if one is configured.
+
+    Args:
+        settings (Settings): The bot settings.
+
+    Returns:
+        Bot: The bot instance.
+    """
+    session = None
+    if settings.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
+    return Bot(token=settings.TELEGRAM_BOT_API_TOKEN.get_secret_value(), session=session)
+
+
+def create_dispatcher(settings: Settings) -> Dispatcher:
+    """
+    Creates the dispatcher with the FSM storage and the routers. A chat stuck `busy` after a crash
+    becomes `free` again after `FSM_BUSY_TTL` seconds. The pooled HTTP client of the app
+    service is injected into the handlers, opened on startup and closed on shutdown, together with the
+    per-chat request queues, the admin chats and, if streaming is enabled, the answer streamer.
+
+    The limits of the app requests and of the streamed edits hold for the whole bot: in webhook mode, every
+    worker process gets an equal share of them.
+
+    Args:
+        settings (Settings): The bot settings.
+
+    Returns:
+        Dispatcher: The dispatcher.
+    """
+    processes = settings.WEBHOOK_WORKERS if settings.BOT_MODE == "webhook" else 1
+    app_client = AppClient(
+        settings.APP_URL,
+        connection_limit=settings.APP_CONNECTION_LIMIT,
+        keepalive_timeout=settings.APP_KEEPALIVE_TIMEOUT,
+        retries=settings.APP_RETRIES,
+        backoff=settings.APP_RETRY_BACKOFF,
+        request_timeout=APP_REQUEST_TIMEOUT,
+        max_concurrency=max(1, settings.APP_MAX_CONCURRENCY // processes),
+        rate=settings.APP_RATE_LIMIT / processes,
+        burst=max(1, settings.APP_RATE_BURST // processes),
+        cache_size=settings.ANSWER_CACHE_SIZE,
+        cache_ttl=settings.ANSWER_CACHE_TTL,
+    )
+    chat_queues = ChatQueues(depth=settings.CHAT_QUEUE_DEPTH)
+    chat_history = ChatHistory(max_turns=settings.HISTORY_TURNS, max_chars=settings.HISTORY_MAX_CHARS)
+    answer_streamer = (
+        AnswerStreamer(settings.STREAM_EDIT_INTERVAL, settings.STREAM_EDITS_PER_SECOND / processes)
+        if settings.STREAMING
+        else None
+    )
+
+    storage = create_storage(
+        settings,
+        state_ttl={AssistUserStates.busy.state: settings.FSM_BUSY_TTL},
+        expired_state=AssistUserStates.free,
+    )
+    dispatcher = Dispatcher(
+        storage=storage,
+        app_client=app_client,
+        chat_queues=chat_queues,
+        chat_history=chat_history,
+        answer_streamer=answer_streamer,
+        admin_chat_ids=frozenset(settings.ADMIN_CHAT_IDS),
+    )
+    dispatcher.include_routers(*routers)
+    dispatcher.startup.register(app_client.start)
+    dispatcher.shutdown.register(app_client.close)
+    return dispatcher
+
+
+async def run_polling(settings: Settings) -> None:
+    """
+    Receives the updates with long polling in the current process.
+
+    Args:
+        settings (Settings): The bot settings.
+    """
+    bot = create_bot(settings)
+    dispatcher = create_dispatcher(settings)
+
+    await bot.delete_webhook()
+    await dispatcher.start_polling(bot)
+
+
+async def register_webhook(settings: Settings) -> None:
+    """
+    Points Telegram to the webhook. Done once by the parent process, so the workers do not race to set it.
+
+    Args:
+        settings (Settings): The bot settings.
+
+    Raises:
+        ValueError: If `WEBHOOK_URL` is not set.
+    """
+    if not settings.WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL is required in webhook mode")
+
+    bot = create_bot(settings)
+    async with bot.session:
+        await bot.set_webhook(
+            url=settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH,
+            secret_token=settings.WEBHOOK_SECRET.get_secret_value() if settings.WEBHOOK_SECRET else None,
+            max_connections=100,
+        )
+
+
+def serve_webhook(settings: Settings, index: int) -> None:
+    """
+    Runs one webhook worker process. Every worker binds the same port with `SO_REUSEPORT`, so the kernel spreads
+    the incoming connections between them. The updates of the chats of other workers are forwarded to them over
+    their Unix sockets, the others are acknowledged right away and handled in background.
+
+    Args:
+        settings (Settings): The bot settings.
+        index (int): Number of the worker.
+    """
+    setup_logging(settings, f"bot-webhook-{index}")
+
+    bot = create_bot(settings)
+    dispatcher = create_dispatcher(settings)
+
+    app = web.Application()
+    ChatRoutingRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        index=index,
+        workers=settings.WEBHOOK_WORKERS,
+        secret_token=settings.WEBHOOK_SECRET.get_secret_value() if settings.WEBHOOK_SECRET else None,
+    ).register(app, path=settings.WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    web.run_app(
+        app,
+        host=settings.WEBHOOK_HOST,
+        port=settings.WEBHOOK_PORT,
+        path=worker_socket(index),
+        reuse_port=True,
+        access_log=None,
+        print=None,
+    )
+
+
+def run_webhook(settings: Settings) -> None:
+    """
+    Registers the webhook and serves it with `WEBHOOK_WORKERS` worker processes. A termination signal
+    is forwarded to the workers, so they finish the updates in flight before the bot exits.
+
+    Args:
+        settings (Settings): The bot settings.
+    """
+    asyncio.run(register_webhook(settings))
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=serve_webhook, args=(settings, index), name=f"webhook-{index}")
+        for index in range(settings.WEBHOOK_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in workers:
+        worker.join()
+
+
+def main():
     """
     The main entry point for the Telegram bot application. This function initializes the
-    logger, configuration settings, and sets up the bot, dispatcher, and FSM (Finite State Machine) storage.
-    It includes routers for handling bot commands and starts polling for incoming updates.
+    logger and configuration settings, and starts receiving updates in the configured mode.
 
     Steps:
-    1. Set up logging using the custom logger.
-    2. Load settings from the configuration file (including the Telegram bot token).
-    3. Initialize the bot instance using the Telegram bot token.
-    4. Set up an in-memory storage for FSM.
-    5. Initialize the dispatcher and attach routers for command handling.
-    6. Start the bot's long polling to process incoming messages.
+    1. Load settings from the configuration file (including the Telegram bot token).
+    2. Set up logging using the custom logger.
+    3. In `polling` mode, initialize the bot and the dispatcher, and start the bot's long polling
+       to process incoming messages.
+    4. In `webhook` mode, register the webhook and start the worker processes serving it.
 
     Raises:
         Any exceptions related to bot initialization, dispatcher setup, or polling are
         propagated from the aiogram library.
 
     Example usage:
-        This function is called when the script is executed, and the bot begins polling for updates.
+        This function is called when the script is executed, and the bot begins receiving updates.
     """
-    logger.setup()
-
     settings = Settings()
 
-    bot = Bot(token=settings.TELEGRAM_BOT_API_TOKEN.get_secret_value())
+    setup_logging(settings, "bot")
 
-    storage = MemoryStorage()
-    dispatcher = Dispatcher(storage=storage)
-    dispatcher.include_routers(*routers)
-
-    await dispatcher.start_polling(bot)
+    if settings.BOT_MODE == "webhook":
+        run_webhook(settings)
+    else:
+        asyncio.run(run_polling(settings))
 
 
 if __name__ == "__main__":
     """
-    Entry point for the script. When executed directly, this block runs the main asynchronous
-    function using `asyncio.run`, which handles the lifecycle of the bot and dispatcher.
-
-    The `asyncio.run(main())` function ensures that the event loop is started and that the
-    bot begins polling for incoming messages.
+    Entry point for the script. When executed directly, this block runs the bot in the mode
+    selected by the `BOT_MODE` setting.
     """
-    asyncio.run(main=main())
+    main()
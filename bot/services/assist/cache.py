@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+WHITESPACE = re.compile(r"\s+")
+
+# WHITESPACE: Runs of whitespace collapsed when queries are normalized.
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query for deduplication: the same query pasted with different indentation or line
+    breaks gets the same answer, while the case and the punctuation, which may change it, are kept.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        str: The normalized query.
+    """
+    return WHITESPACE.sub(" ", query).strip()
+
+
+def cache_key(query: str, messages: List[Dict[str, str]]) -> str:
+    """
+    Builds the deduplication key of a query: the normalized query, prefixed with a digest of the
+    conversation it continues, since the same query may get a different answer in another context.
+
+    Args:
+        query (str): The user query.
+        messages (List[Dict[str, str]]): The previous messages of the conversation.
+
+    Returns:
+        str: The key.
+    """
+    key = normalize_query(query)
+    if not messages:
+        return key
+    digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode()).hexdigest()
+    return f"{digest}:{key}"
+
+
+class AnswerCache:
+    """
+    LRU cache of recent answers whose entries expire after a fixed time.
+
+    Attributes:
+        max_size (int): Maximum number of cached answers.
+        ttl (float): Seconds an answer stays in the cache.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not found in the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, answer: str) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, answer)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one: the callers arriving while a call is in
+    flight wait for its result instead of starting their own. A caller giving up does not cancel the
+    call for the others.
+
+    Attributes:
+        coalesced (int): Number of calls that joined a call already in flight.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs the call, or joins the call with the same key in flight.
+
+        Args:
+            key (str): The key identifying identical calls.
+            call (Callable[[], Awaitable[T]]): The coroutine function to run.
+
+        Returns:
+            T: The result of the call.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(call())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(flight)
@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import json
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+from logger import REQUEST_ID
+from loguru import logger
+
+from .cache import AnswerCache, SingleFlight, cache_key
+from .queues import TokenBucket, WaitStats
+
+RETRIABLE_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError)
+
+# RETRIABLE_ERRORS: Connection errors after which the request surely did not reach the app, or hit a keep-alive
+# connection the app had already closed, so it is safe to send it again.
+
+
+class AppError(Exception):
+    """
+    The app answered a query with an error.
+
+    Attributes:
+        status (int): The HTTP status of the error.
+        detail (str): The error description of the app.
+    """
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class AppClient:
+    """
+    Bot-wide HTTP client of the app service.
+
+    The client keeps one `aiohttp.ClientSession` with a pool of keep-alive connections for the whole bot
+    lifetime, so the queries do not pay for DNS resolution, TCP setup and connector construction each time.
+    Outbound queries are admitted by a token bucket and a semaphore, so bursts reach the app at a steady
+    rate and never above the number of requests it can batch at once. The limits hold in this process only,
+    each webhook worker is given its share of the limits of the bot. Identical queries, up to whitespace,
+    share one request while it is in flight, and recent successful answers are served from a cache. Queries
+    continuing a conversation carry its previous messages and session id.
+
+    Attributes:
+        base_url (str): Base URL of the app service.
+        connection_limit (int): Maximum number of simultaneous connections to the app.
+        keepalive_timeout (float): Seconds an idle connection is kept open for reuse.
+        retries (int): Maximum number of retries after a connection error.
+        backoff (float): Base delay in seconds of the exponential backoff between retries.
+        request_timeout (float): Seconds the bot waits for an answer, sent to the app as the request deadline.
+        max_concurrency (int): Maximum number of queries in flight.
+        rate (float): Queries sent per second on average.
+        burst (int): Maximum number of queries sent at once after an idle period.
+        in_flight (int): Number of queries currently sent to the app.
+        admission_waits (WaitStats): Time the queries waited for the limiter.
+        cache (AnswerCache): Recent successful answers by conversation and normalized query.
+        flights (SingleFlight): The requests in flight by conversation and normalized query.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        connection_limit: int = 100,
+        keepalive_timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 0.5,
+        request_timeout: float = 60,
+        max_concurrency: int = 8,
+        rate: float = 4,
+        burst: int = 8,
+        cache_size: int = 1024,
+        cache_ttl: float = 300,
+    ):
+        self.base_url = base_url
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.request_timeout = request_timeout
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.in_flight = 0
+        self.admission_waits = WaitStats()
+        self.cache = AnswerCache(cache_size, cache_ttl)
+        self.flights = SingleFlight()
+        self._bucket = TokenBucket(rate, burst)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        """
+        Opens the connection pool. Must be called from within the running event loop.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=10,
+            sock_connect=10,
+            sock_read=self.request_timeout,
+        )
+        self._session = aiohttp.ClientSession(base_url=self.base_url, connector=connector, timeout=timeout)
+
+    async def close(self) -> None:
+        """
+        Closes the connection pool.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("AppClient is not started")
+        return self._session
+
+    async def assist(
+        self, query: str, messages: Sequence[Dict[str, str]] = (), session_id: Optional[str] = None
+    ) -> str:
+        """
+        Sends the query to the `/assist` endpoint of the app. The request carries the moment the bot
+        stops waiting for it, so the app can abandon the generation instead of finishing an answer
+        nobody reads. The time spent waiting for admission counts towards the deadline. Connection
+        errors are retried with jittered exponential backoff while the deadline allows.
+
+        A cached answer of the same query in the same context is returned right away, and a query identical
+        to one in flight waits for its answer instead of being sent again.
+
+        Args:
+            query (str): The user query.
+            messages (Sequence[Dict[str, str]], optional): The previous messages of the conversation.
+            session_id (Optional[str], optional): Id of the conversation.
+
+        Returns:
+            str: The response text of the app.
+
+        Raises:
+            AppError: If the app answered with an error.
+            aiohttp.ClientError: If the request failed and cannot be retried.
+        """
+        payload = self._payload(query, messages, session_id)
+        key = cache_key(query, payload["messages"])
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer
+        return await self.flights.run(key, lambda: self._assist(payload, key))
+
+    async def assist_stream(
+        self, query: str, messages: Sequence[Dict[str, str]] = (), session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Sends the query to the `/assist` endpoint of an app running with `STREAM=true` and yields the
+        events of the answer as they arrive: `{"delta": ...}` chunks of the generated text, then the
+        final `{"text": ...}` answer, or `{"detail": ..., "status": ...}` if the request failed.
+
+        A cached answer of the same query in the same context is yielded right away as the final event.
+        Streamed queries are not coalesced, since every caller needs the events from the beginning.
+
+        Args:
+            query (str): The user query.
+            messages (Sequence[Dict[str, str]], optional): The previous messages of the conversation.
+            session_id (Optional[str], optional): Id of the conversation.
+
+        Yields:
+            Dict[str, Any]: The events of the answer.
+
+        Raises:
+            aiohttp.ClientError: If the request failed and cannot be retried.
+        """
+        payload = self._payload(query, messages, session_id)
+        key = cache_key(query, payload["messages"])
+        answer = self.cache.get(key)
+        if answer is not None:
+            yield {"text": answer}
+            return
+
+        deadline, headers = self._deadline_headers()
+        async with self._admission():
+            async with await self._send(payload, headers, deadline) as response:
+                if response.status != 200:
+                    yield {"detail": await response.text(), "status": response.status}
+                    return
+
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if "text" in event:
+                        self.cache.put(key, event["text"])
+                    yield event
+
+    async def _assist(self, payload: Dict[str, Any], key: str) -> str:
+        deadline, headers = self._deadline_headers()
+        started_at = time.monotonic()
+        async with self._admission():
+            async with await self._send(payload, headers, deadline) as response:
+                status, answer = response.status, await response.text()
+
+        logger.bind(sampled=True).debug(f"App answered with status {status} in {time.monotonic() - started_at:.2f}s")
+        if status != 200:
+            raise AppError(status, answer)
+        self.cache.put(key, answer)
+        return answer
+
+    @staticmethod
+    def _payload(query: str, messages: Sequence[Dict[str, str]], session_id: Optional[str]) -> Dict[str, Any]:
+        history: List[Dict[str, str]] = [
+            {"role": message["role"], "content": message["content"]} for message in messages
+        ]
+        return {"query": query, "messages": history, "session_id": session_id}
+
+    def _deadline_headers(self) -> Tuple[float, Dict[str, str]]:
+        deadline = time.time() + self.request_timeout
+        headers = {
+            "X-Request-Deadline": str(deadline),
+            "X-Request-Id": REQUEST_ID.get() or uuid.uuid4().hex,
+        }
+        return deadline, headers
+
+    @contextlib.asynccontextmanager
+    async def _admission(self) -> AsyncIterator[None]:
+        """
+        Waits for the rate limiter and a free slot, and holds the slot while the request is in flight.
+        """
+        queued_at = time.monotonic()
+        await self._bucket.acquire()
+        async with self._semaphore:
+            self.admission_waits.observe(time.monotonic() - queued_at)
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    async def _send(self, payload: Dict[str, Any], headers: Dict[str, str], deadline: float) -> aiohttp.ClientResponse:
+        """
+        Sends the request and waits for the response headers, retrying connection errors.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self.session.post("/assist", json=payload, headers=headers)
+
+            except RETRIABLE_ERRORS as error:
+                delay = random.uniform(0, self.backoff * 2**attempt)
+                if attempt >= self.retries or time.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                logger.warning(f"App request failed ({error!r}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
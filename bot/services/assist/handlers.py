@@ -1,79 +1,154 @@
 import asyncio
+import functools
+import uuid
+from typing import AbstractSet, Optional
 
-import aiohttp
 from aiogram import Router
-from aiogram.filters.command import CommandStart
+from aiogram.filters import StateFilter
+from aiogram.filters.command import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
+from constants import APP_REQUEST_TIMEOUT
+from logger import REQUEST_ID
 
-from .phrases import BUSY_MSG, WELCOME_MSG
+from .client import AppClient
+from .history import ChatHistory
+from .phrases import BUSY_MSG, STATS_MSG, WELCOME_MSG
+from .queues import ChatQueues
 from .states import AssistUserStates
+from .streaming import AnswerStreamer
 
 router = Router(name="assist")
 
 
 @router.message(CommandStart())
-async def welcome(message: Message, state: FSMContext) -> None:
+async def welcome(message: Message, state: FSMContext, chat_history: ChatHistory) -> None:
     """
-    Handles the /start command from the user. Sets the user's state to `free` and sends
-    a welcome message.
+    Handles the /start command from the user. Sets the user's state to `free`, starts a new
+    conversation and sends a welcome message.
 
     Args:
         message (Message): The incoming message object containing the /start command.
         state (FSMContext): The finite state machine context for managing user states.
+        chat_history (ChatHistory): The conversations of the chats.
 
     Returns:
         None
     """
     await state.set_state(state=AssistUserStates.free)
+    await chat_history.reset(state)
     await message.answer(text=WELCOME_MSG)
 
 
-@router.message(AssistUserStates.free)
-async def handler_free(message: Message, state: FSMContext) -> None:
+@router.message(Command("stats"))
+async def handler_stats(
+    message: Message, app_client: AppClient, chat_queues: ChatQueues, admin_chat_ids: AbstractSet[int]
+) -> None:
     """
-    Handles messages from users in the `free` state. Processes the message by making
-    an asynchronous request to an external service and sends back the response.
+    Handles the /stats command of an admin chat, and ignores it in the other chats. Sends the lengths of the
+    request queues and the time the requests wait in them and for admission to the app, and how many queries
+    were deduplicated, as seen by the process handling the chat.
 
     Args:
-        message (Message): The incoming message object containing the user's query.
-        state (FSMContext): The finite state machine context for managing user states.
+        message (Message): The incoming message object containing the /stats command.
+        app_client (AppClient): The bot-wide client of the app service.
+        chat_queues (ChatQueues): The per-chat request queues.
+        admin_chat_ids (AbstractSet[int]): The chats allowed to see the stats.
 
     Returns:
         None
     """
-
-    async def app_service_request(query: str) -> str:
-        """
-        Makes an asynchronous HTTP POST request to an external service with the provided query.
-
-        Args:
-            query (str): The query string to send in the POST request.
-
-        Returns:
-            str: The response text from the external service.
-        """
-        timeout = aiohttp.ClientTimeout(
-            total=None,
-            connect=10,
-            sock_connect=10,
-            sock_read=60,
+    if message.chat.id not in admin_chat_ids:
+        return
+
+    await message.answer(
+        text=STATS_MSG.format(
+            active_chats=chat_queues.active_chats,
+            waiting=chat_queues.waiting,
+            rejected=chat_queues.rejected,
+            queue_mean=chat_queues.waits.mean,
+            queue_p95=chat_queues.waits.p95,
+            in_flight=app_client.in_flight,
+            max_concurrency=app_client.max_concurrency,
+            admission_mean=app_client.admission_waits.mean,
+            admission_p95=app_client.admission_waits.p95,
+            cache_size=app_client.cache.size,
+            cache_hits=app_client.cache.hits,
+            cache_hit_rate=app_client.cache.hit_rate,
+            coalesced=app_client.flights.coalesced,
         )
+    )
+
+
+@router.message(StateFilter(AssistUserStates.free, AssistUserStates.busy))
+async def handler_query(
+    message: Message,
+    state: FSMContext,
+    app_client: AppClient,
+    chat_queues: ChatQueues,
+    chat_history: ChatHistory,
+    answer_streamer: Optional[AnswerStreamer],
+) -> None:
+    """
+    Handles queries from users in the `free` or `busy` state. The query is put in the queue of the chat,
+    so follow-up messages are answered in order once the previous ones are done. If the queue of the
+    chat is full, sends a message asking to wait for the queued answers.
+
+    Args:
+        message (Message): The incoming message object containing the user's query.
+        state (FSMContext): The finite state machine context for managing user states.
+        app_client (AppClient): The bot-wide client of the app service.
+        chat_queues (ChatQueues): The per-chat request queues.
+        chat_history (ChatHistory): The conversations of the chats.
+        answer_streamer (Optional[AnswerStreamer]): Shows streamed answers, if streaming is enabled.
 
-        url = "http://app:8000/assist"
-        json = {"query": query}
+    Returns:
+        None
+    """
+    job = functools.partial(answer_query, message, state, app_client, chat_history, answer_streamer)
+    if not chat_queues.submit(message.chat.id, job):
+        await message.answer(text=BUSY_MSG)
+
+
+async def answer_query(
+    message: Message,
+    state: FSMContext,
+    app_client: AppClient,
+    chat_history: ChatHistory,
+    answer_streamer: Optional[AnswerStreamer],
+) -> None:
+    """
+    Answers a queued query by making an asynchronous request to an external service and sends
+    back the response. The query is sent with the previous messages of the chat conversation,
+    and is added to it once answered. The chat is `busy` while the request is in flight. With an
+    answer streamer, the answer is shown as it is generated and replaced with the final response
+    at the end.
 
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url=url, json=json) as response:
-                return await response.text()
+    Args:
+        message (Message): The incoming message object containing the user's query.
+        state (FSMContext): The finite state machine context for managing user states.
+        app_client (AppClient): The bot-wide client of the app service.
+        chat_history (ChatHistory): The conversations of the chats.
+        answer_streamer (Optional[AnswerStreamer]): Shows streamed answers, if streaming is enabled.
 
+    Returns:
+        None
+    """
+    REQUEST_ID.set(uuid.uuid4().hex)
     await state.set_state(state=AssistUserStates.busy)
 
-    response_event = asyncio.Event()
+    query = (message.text or "").strip()
+    session_id, history = await chat_history.load(state)
+    streamed = answer_streamer.open(message) if answer_streamer else None
 
     try:
-        response = await asyncio.wait_for(app_service_request(query=(message.text or "").strip()), timeout=60)
-        response_event.set()
+        if streamed is not None:
+            events = app_client.assist_stream(query=query, messages=history, session_id=session_id)
+            response = await asyncio.wait_for(AnswerStreamer.consume(events, streamed), timeout=APP_REQUEST_TIMEOUT)
+        else:
+            response = await asyncio.wait_for(
+                app_client.assist(query=query, messages=history, session_id=session_id), timeout=APP_REQUEST_TIMEOUT
+            )
 
     except asyncio.TimeoutError:
         response = "Request timed out. Try to send new one."
@@ -81,22 +156,13 @@ async def handler_free(message: Message, state: FSMContext) -> None:
     except Exception as e:
         response = f"Error while processing request: {str(e)}"
 
+    else:
+        await chat_history.append(state, query, response)
+
     finally:
         await state.set_state(state=AssistUserStates.free)
 
-    await message.answer(text=response)
-
-
-@router.message(AssistUserStates.busy)
-async def handler_busy(message: Message) -> None:
-    """
-    Handles messages from users in the `busy` state. Sends a message indicating that
-    the system is currently busy and cannot process additional requests.
-
-    Args:
-        message (Message): The incoming message object.
-
-    Returns:
-        None
-    """
-    await message.answer(text=BUSY_MSG)
+    if streamed is not None:
+        await streamed.finish(response)
+    else:
+        await message.answer(text=response)
@@ -0,0 +1,88 @@
+import uuid
+from typing import Dict, List, Tuple
+
+from aiogram.fsm.context import FSMContext
+
+Message = Dict[str, str]
+
+# Message: A message of a conversation as sent to the app, `{"role": "user" | "bot", "content": ...}`.
+
+
+class ChatHistory:
+    """
+    Bounded history of the conversation of every chat, kept in the chat data of the FSM storage so that it
+    survives restarts and is shared by the webhook workers.
+
+    When the history grows over its bounds, the oldest exchanges are dropped until it is at most half as
+    long. The history then stays a prefix of the following turns for a while, which the app answers
+    without processing it again, instead of shifting on every turn.
+
+    Attributes:
+        max_turns (int): Maximum number of exchanges, a user message and its answer, kept.
+        max_chars (int): Maximum total length of the kept messages.
+    """
+
+    def __init__(self, max_turns: int, max_chars: int):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+
+    async def load(self, state: FSMContext) -> Tuple[str, List[Message]]:
+        """
+        Reads the conversation of a chat, starting one if the chat has none.
+
+        Args:
+            state (FSMContext): The FSM context of the chat.
+
+        Returns:
+            Tuple[str, List[Message]]: The session id of the conversation and its messages, oldest first.
+        """
+        data = await state.get_data()
+        session_id = data.get("session_id")
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+            await state.update_data(session_id=session_id, history=[])
+        return session_id, list(data.get("history", []))
+
+    async def append(self, state: FSMContext, query: str, answer: str) -> None:
+        """
+        Adds an answered query to the conversation of a chat.
+
+        Args:
+            state (FSMContext): The FSM context of the chat.
+            query (str): The user query.
+            answer (str): The answer of the app.
+        """
+        if self.max_turns <= 0:
+            return
+        _, history = await self.load(state)
+        history += [{"role": "user", "content": query}, {"role": "bot", "content": answer}]
+        await state.update_data(history=self.trim(history))
+
+    async def reset(self, state: FSMContext) -> None:
+        """
+        Starts a new conversation in a chat.
+
+        Args:
+            state (FSMContext): The FSM context of the chat.
+        """
+        await state.update_data(session_id=uuid.uuid4().hex, history=[])
+
+    def trim(self, history: List[Message]) -> List[Message]:
+        """
+        Drops the oldest exchanges of an overgrown history.
+
+        Args:
+            history (List[Message]): The messages, oldest first.
+
+        Returns:
+            List[Message]: The history within its bounds.
+        """
+        if len(history) <= 2 * self.max_turns and self._length(history) <= self.max_chars:
+            return history
+        while history and (len(history) > self.max_turns or self._length(history) > self.max_chars // 2):
+            history = history[2:]
+        return history
+
+    @staticmethod
+    def _length(history: List[Message]) -> int:
+        return sum(len(message["content"]) for message in history)
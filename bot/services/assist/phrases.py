@@ -5,4 +5,11 @@ WELCOME_MSG: Final[str] = """Привет!
 Это наше решение по кейсу https://hacks-ai.ru/events/1077378"
 """
 
-BUSY_MSG: Final[str] = """Вы уже отправили запрос, подождите пока мы ответим на него."""
+BUSY_MSG: Final[str] = """У вас уже много запросов в очереди, подождите пока мы ответим на них."""
+
+STATS_MSG: Final[str] = """Очереди: чатов с запросами {active_chats}, ожидают {waiting}, отклонено {rejected}.
+Ожидание в очереди: среднее {queue_mean:.2f} с, p95 {queue_p95:.2f} с.
+Запросов к модели: в работе {in_flight} из {max_concurrency}, ожидание допуска: среднее {admission_mean:.2f} с, \
+p95 {admission_p95:.2f} с.
+Кэш ответов: {cache_size} ответов, попаданий {cache_hits} ({cache_hit_rate:.0%}), объединено одинаковых запросов \
+{coalesced}."""
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Tuple
+
+from loguru import logger
+
+Job = Callable[[], Awaitable[None]]
+
+
+class WaitStats:
+    """
+    Counts waits and keeps the latest of them to report their mean and tail.
+
+    Attributes:
+        count (int): Number of waits observed.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self._waits: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self._waits.append(seconds)
+
+    @property
+    def mean(self) -> float:
+        return sum(self._waits) / len(self._waits) if self._waits else 0.0
+
+    @property
+    def p95(self) -> float:
+        if not self._waits:
+            return 0.0
+        waits = sorted(self._waits)
+        return waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+
+
+class TokenBucket:
+    """
+    Token bucket smoothing bursts of calls to a steady rate. Callers are served in arrival order.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens, i.e. the largest burst let through at once.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                if self.try_acquire():
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a token if one is available, without waiting.
+
+        Returns:
+            bool: Whether a token was taken.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class ChatQueues:
+    """
+    Bounded FIFO queue of jobs per chat. The jobs of a chat run one at a time in the order they were
+    submitted, while different chats run concurrently. A chat's worker task exists only while the chat
+    has jobs.
+
+    Attributes:
+        depth (int): Maximum number of jobs waiting in the queue of one chat, not counting the running one.
+        rejected (int): Number of jobs rejected because the queue of their chat was full.
+        waits (WaitStats): Time the jobs spent in the queue before they started.
+    """
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.rejected = 0
+        self.waits = WaitStats()
+        self._queues: Dict[int, Deque[Tuple[float, Job]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, job: Job) -> bool:
+        """
+        Queues a job of the chat.
+
+        Args:
+            chat_id (int): The chat the job belongs to.
+            job (Job): The coroutine function to run.
+
+        Returns:
+            bool: False if the queue of the chat is full and the job was rejected.
+        """
+        queue = self._queues.setdefault(chat_id, deque())
+        if len(queue) >= self.depth:
+            self.rejected += 1
+            return False
+
+        queue.append((time.monotonic(), job))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return True
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._workers)
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                queued_at, job = queue.popleft()
+                self.waits.observe(time.monotonic() - queued_at)
+                try:
+                    await job()
+                except Exception:
+                    logger.exception(f"Job of chat {chat_id} failed")
+        finally:
+            del self._queues[chat_id]
+            del self._workers[chat_id]
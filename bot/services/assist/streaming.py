@@ -0,0 +1,187 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from .client import AppError
+from .queues import TokenBucket
+
+MESSAGE_LIMIT = 4096
+TYPING_MARK = " …"
+
+# MESSAGE_LIMIT: Maximum length of a Telegram message text.
+# TYPING_MARK: Appended to a message while its answer is still being generated.
+
+DECODER = json.JSONDecoder()
+
+
+def complete_field(text: str, key: str) -> Optional[Any]:
+    """
+    Extracts the value of a field from a partially generated JSON answer, once the value is complete.
+
+    Args:
+        text (str): The answer generated so far.
+        key (str): The name of the field.
+
+    Returns:
+        Optional[Any]: The value, or None if the field has not been generated completely yet.
+    """
+    match = re.search(rf'"{re.escape(key)}"\s*:\s*', text)
+    if match is None:
+        return None
+    try:
+        value, _ = DECODER.raw_decode(text, match.end())
+    except json.JSONDecodeError:
+        return None
+    return value
+
+
+def render_partial(text: str) -> str:
+    """
+    Renders a partially generated answer: the `thoughts.speak` and `command` fields once they are
+    complete, and the raw text until then.
+
+    Args:
+        text (str): The answer generated so far.
+
+    Returns:
+        str: The text of the message.
+    """
+    parts = []
+    speak = complete_field(text, "speak")
+    if isinstance(speak, str):
+        parts.append(speak)
+    command = complete_field(text, "command")
+    if command is not None:
+        parts.append(json.dumps(command, ensure_ascii=False, indent=2))
+    return "\n\n".join(parts) if parts else text
+
+
+class StreamedMessage:
+    """
+    A bot message edited in place as the answer it shows grows. Edits of one message are at least
+    `interval` seconds apart and all edits of the bot share the `bucket`, so the bot stays under the
+    Telegram flood limits; intermediate texts are skipped when no edit is allowed.
+
+    Attributes:
+        message (Message): The user message being answered.
+        interval (float): Minimum seconds between edits of the message.
+        bucket (TokenBucket): Rate limiter shared by the edits of all the messages.
+        reply (Optional[Message]): The bot message, once sent.
+    """
+
+    def __init__(self, message: Message, interval: float, bucket: TokenBucket):
+        self.message = message
+        self.interval = interval
+        self.bucket = bucket
+        self.reply: Optional[Message] = None
+        self._text = ""
+        self._edited_at = 0.0
+
+    async def update(self, text: str) -> None:
+        """
+        Shows a partial answer, if an edit is allowed now.
+
+        Args:
+            text (str): The partial answer.
+        """
+        text = self._clip(text, reserve=len(TYPING_MARK)) + TYPING_MARK
+        if text == self._text or time.monotonic() - self._edited_at < self.interval:
+            return
+        if not self.bucket.try_acquire():
+            return
+        try:
+            await self._show(text)
+        except TelegramRetryAfter as error:
+            self._edited_at = time.monotonic() + error.retry_after
+
+    async def finish(self, text: str) -> None:
+        """
+        Replaces the partial answer with the final one, waiting for the rate limits if needed.
+
+        Args:
+            text (str): The final answer.
+        """
+        text = self._clip(text)
+        if text == self._text:
+            return
+        await asyncio.sleep(max(0.0, self._edited_at + self.interval - time.monotonic()))
+        await self.bucket.acquire()
+        try:
+            await self._show(text)
+        except TelegramRetryAfter as error:
+            await asyncio.sleep(error.retry_after)
+            await self._show(text)
+
+    async def _show(self, text: str) -> None:
+        self._edited_at = time.monotonic()
+        if self.reply is None:
+            self.reply = await self.message.answer(text=text)
+        else:
+            try:
+                await self.reply.edit_text(text=text)
+            except TelegramBadRequest as error:
+                if "message is not modified" not in str(error):
+                    raise
+        self._text = text
+
+    @staticmethod
+    def _clip(text: str, reserve: int = 0) -> str:
+        limit = MESSAGE_LIMIT - reserve
+        return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+class AnswerStreamer:
+    """
+    Shows answers streamed by the app in progressively edited messages.
+
+    Attributes:
+        interval (float): Minimum seconds between edits of one message.
+        bucket (TokenBucket): Rate limiter shared by the edits of all the messages.
+    """
+
+    def __init__(self, interval: float, edits_per_second: float):
+        self.interval = interval
+        self.bucket = TokenBucket(edits_per_second, edits_per_second)
+
+    def open(self, message: Message) -> StreamedMessage:
+        """
+        Starts the answer to a user message.
+
+        Args:
+            message (Message): The user message.
+
+        Returns:
+            StreamedMessage: The answer message, sent on the first update.
+        """
+        return StreamedMessage(message, self.interval, self.bucket)
+
+    @staticmethod
+    async def consume(events: AsyncIterator[Dict[str, Any]], streamed: StreamedMessage) -> str:
+        """
+        Shows the streamed answer as it grows.
+
+        Args:
+            events (AsyncIterator[Dict[str, Any]]): The events of the answer.
+            streamed (StreamedMessage): The message the answer is shown in.
+
+        Returns:
+            str: The final answer.
+
+        Raises:
+            AppError: If the app answered with an error or the stream ended before the final answer.
+        """
+        text = ""
+        async for event in events:
+            if "delta" in event:
+                text += event["delta"]
+                await streamed.update(render_partial(text))
+            elif "text" in event:
+                return event["text"]
+            else:
+                raise AppError(event.get("status", 500), str(event.get("detail")))
+        raise AppError(502, "the answer stream ended unexpectedly.")
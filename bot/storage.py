@@ -0,0 +1,177 @@
+import asyncio
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Mapping, Optional, TypeVar
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import Settings
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT,
+    expires_at REAL
+) WITHOUT ROWID
+"""
+
+# SCHEMA: One row per chat with its state, its data as JSON and the moment the state expires.
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage in an embedded SQLite database, shared by all the bot processes on the host and kept
+    across restarts.
+
+    The database runs in WAL mode, so readers do not block the writer. Every operation is a single
+    statement on the primary key, executed by a small pool of threads, each holding its own connection.
+    States listed in `state_ttl` expire, so a chat does not stay stuck in them after a crash or a restart.
+
+    Attributes:
+        path (str): Path to the database file.
+        state_ttl (Mapping[str, float]): Seconds after which each of the listed states expires.
+        expired_state (Optional[str]): State an expired state is replaced with.
+        key_builder (DefaultKeyBuilder): Builds the row keys from the storage keys.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        pool_size: int = 4,
+        state_ttl: Optional[Mapping[str, float]] = None,
+        expired_state: StateType = None,
+    ):
+        self.path = path
+        self.state_ttl = dict(state_ttl or {})
+        self.expired_state = self._state_name(expired_state)
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="fsm-sqlite")
+
+        connection = self._open()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(SCHEMA)
+        connection.close()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self._state_name(state)
+        ttl = self.state_ttl.get(name) if name is not None else None
+        expires_at = time.time() + ttl if ttl is not None else None
+        await self._run(
+            lambda connection: connection.execute(
+                "INSERT INTO fsm (key, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+                (self.key_builder.build(key), name, expires_at),
+            )
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run(
+            lambda connection: connection.execute(
+                "SELECT state, expires_at FROM fsm WHERE key = ?", (self.key_builder.build(key),)
+            ).fetchone()
+        )
+        if row is None:
+            return None
+        state, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return self.expired_state
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(
+            lambda connection: connection.execute(
+                "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET data = excluded.data",
+                (self.key_builder.build(key), json.dumps(data, ensure_ascii=False)),
+            )
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run(
+            lambda connection: connection.execute(
+                "SELECT data FROM fsm WHERE key = ?", (self.key_builder.build(key),)
+            ).fetchone()
+        )
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    async def _run(self, operation: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        Runs a statement in the thread pool on the connection of the thread.
+        """
+
+        def run() -> T:
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = self._local.connection = self._open()
+                with self._lock:
+                    self._connections.append(connection)
+            return operation(connection)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=30000")
+        return connection
+
+    @staticmethod
+    def _state_name(state: StateType) -> Optional[str]:
+        return state.state if isinstance(state, State) else state
+
+
+def create_storage(settings: Settings, state_ttl: Mapping[str, float], expired_state: StateType) -> BaseStorage:
+    """
+    Creates the FSM storage selected by the `FSM_STORAGE` setting.
+
+    `memory` keeps the states in the current process only. `sqlite` shares them between the processes
+    of one host and keeps them across restarts. `redis` shares them between hosts through any
+    Redis-compatible server; it needs the `redis` package and does not expire the states.
+
+    Args:
+        settings (Settings): The bot settings.
+        state_ttl (Mapping[str, float]): Seconds after which each of the listed states expires.
+        expired_state (StateType): State an expired state is replaced with.
+
+    Returns:
+        BaseStorage: The FSM storage.
+
+    Raises:
+        ValueError: If `redis` is selected without `FSM_REDIS_URL`.
+    """
+    if settings.FSM_STORAGE == "sqlite":
+        return SQLiteStorage(
+            settings.FSM_SQLITE_PATH,
+            pool_size=settings.FSM_SQLITE_POOL_SIZE,
+            state_ttl=state_ttl,
+            expired_state=expired_state,
+        )
+
+    if settings.FSM_STORAGE == "redis":
+        if not settings.FSM_REDIS_URL:
+            raise ValueError("FSM_REDIS_URL is required for the redis FSM storage")
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(settings.FSM_REDIS_URL, key_builder=DefaultKeyBuilder(with_destiny=True))
+
+    return MemoryStorage()
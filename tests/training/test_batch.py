@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+from batch import BatchRunner, LocalBatchBackend, response_format
+from pydantic import BaseModel
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def make_requests(count):
+    return [
+        (f"request-{index}", {"model": "stub", "messages": [{"role": "user", "content": f"message {index}"}]})
+        for index in range(count)
+    ]
+
+
+class CrashingBackend(LocalBatchBackend):
+    """Local backend failing after a number of submitted batches, as a build killed while submitting."""
+
+    def __init__(self, directory, crash_after):
+        super().__init__(directory, latency=0.0)
+        self.crash_after = crash_after
+        self.submitted = []
+
+    def submit(self, path):
+        if len(self.submitted) == self.crash_after:
+            raise RuntimeError("crash")
+        self.submitted.append(path)
+        return super().submit(path)
+
+
+def test_run_joins_results_by_custom_id(tmp_path):
+    backend = LocalBatchBackend(str(tmp_path / "backend"), latency=0.0)
+    runner = BatchRunner(backend, str(tmp_path / "batches"), max_requests=4, poll_interval=0.01)
+
+    results = runner.run(make_requests(10))
+
+    assert results == {f"request-{index}": f"message {index}" for index in range(10)}
+    assert sorted(name for name in os.listdir(tmp_path / "batches") if name.startswith("requests-")) == [
+        "requests-0000.jsonl",
+        "requests-0001.jsonl",
+        "requests-0002.jsonl",
+    ]
+    assert not (tmp_path / "batches" / "batches.json").exists()
+
+
+def test_run_answers_structured_requests(tmp_path):
+    backend = LocalBatchBackend(str(tmp_path / "backend"), latency=0.0)
+    runner = BatchRunner(backend, str(tmp_path / "batches"), poll_interval=0.01)
+    requests = [
+        (custom_id, {**body, "response_format": response_format(Answer)}) for custom_id, body in make_requests(2)
+    ]
+
+    results = runner.run(requests)
+
+    assert [Answer.model_validate_json(content).text for content in results.values()] == ["заглушка"] * 2
+
+
+def test_run_reports_failed_requests(tmp_path):
+    backend = LocalBatchBackend(str(tmp_path / "backend"), latency=0.0, error_rate=1.0)
+    runner = BatchRunner(backend, str(tmp_path / "batches"), max_requests=2, poll_interval=0.01)
+
+    results = runner.run(make_requests(3))
+
+    assert results == {"request-0": None, "request-1": None, "request-2": None}
+
+
+def test_run_resumes_without_resubmitting(tmp_path):
+    directory = str(tmp_path / "batches")
+    backend = CrashingBackend(str(tmp_path / "backend"), crash_after=2)
+    with pytest.raises(RuntimeError):
+        BatchRunner(backend, directory, max_requests=2, poll_interval=0.01).run(make_requests(5))
+    with open(os.path.join(directory, "batches.json"), "r", encoding="utf-8") as f:
+        assert len(json.load(f)["batches"]) == 2
+
+    backend.crash_after = None
+    results = BatchRunner(backend, directory, max_requests=2, poll_interval=0.01).run([])
+
+    assert backend.submitted == [os.path.join(directory, f"requests-{index:04d}.jsonl") for index in range(3)]
+    assert results == {f"request-{index}": f"message {index}" for index in range(5)}
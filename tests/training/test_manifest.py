@@ -0,0 +1,77 @@
+import json
+import sys
+import types
+
+import pytest
+from manifest import MANIFEST, upload, write_manifest
+
+
+class FakeHfApi:
+    """In-memory Hugging Face Hub, keeping the hashes of the LFS files only, as the real tree listing."""
+
+    files = {}
+    uploads = []
+
+    def create_repo(self, repo_id, exist_ok, private):
+        pass
+
+    def list_repo_tree(self, repo_id):
+        return [
+            types.SimpleNamespace(path=path, lfs=types.SimpleNamespace(sha256=sha256) if lfs else None)
+            for path, (sha256, lfs) in self.files.items()
+        ]
+
+    def upload_file(self, path_or_fileobj, path_in_repo, repo_id, commit_message):
+        self.uploads.append(path_in_repo)
+        self.files[path_in_repo] = (None, path_in_repo.endswith(".safetensors"))
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    FakeHfApi.files = {}
+    FakeHfApi.uploads = []
+    monkeypatch.setitem(sys.modules, "huggingface_hub", types.SimpleNamespace(HfApi=FakeHfApi))
+    return FakeHfApi
+
+
+@pytest.fixture
+def export(tmp_path):
+    (tmp_path / "config.json").write_text("{}")
+    (tmp_path / "model-00001-of-00002.safetensors").write_bytes(b"first shard")
+    (tmp_path / "model-00002-of-00002.safetensors").write_bytes(b"second shard")
+    return tmp_path, write_manifest(str(tmp_path), {"format": "safetensors"})
+
+
+def test_upload_sends_the_manifest_last(hub, export):
+    directory, manifest = export
+
+    upload(str(directory), "user/model")
+
+    assert hub.uploads == [file["path"] for file in manifest["files"]] + [MANIFEST]
+
+
+def test_upload_skips_the_weights_already_uploaded(hub, export):
+    directory, manifest = export
+    hashes = {file["path"]: file["sha256"] for file in manifest["files"]}
+    hub.files = {
+        "model-00001-of-00002.safetensors": (hashes["model-00001-of-00002.safetensors"], True),
+        "model-00002-of-00002.safetensors": ("outdated", True),
+        MANIFEST: (None, False),
+    }
+
+    upload(str(directory), "user/model")
+
+    assert hub.uploads == ["config.json", "model-00002-of-00002.safetensors", MANIFEST]
+
+
+def test_write_manifest_lists_the_files_but_itself(export):
+    directory, manifest = export
+
+    with open(directory / MANIFEST, "r", encoding="utf-8") as f:
+        assert json.load(f) == manifest
+    assert [file["path"] for file in manifest["files"]] == [
+        "config.json",
+        "model-00001-of-00002.safetensors",
+        "model-00002-of-00002.safetensors",
+    ]
+    assert manifest["files"][0]["size"] == 2
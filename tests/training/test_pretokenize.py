@@ -0,0 +1,144 @@
+import json
+
+import numpy as np
+import pytest
+from pretokenize import (
+    IGNORE_INDEX,
+    BucketSampler,
+    PretokenizedDataset,
+    bucket_batches,
+    collate,
+    encode_dialogue,
+    pack_sequences,
+)
+
+BOS = 1
+SETTINGS = {
+    "prompt_template": {
+        "role_tag_mapping": {"bot": "assistant", "user": "user", "system": "system"},
+        "prefix_template": "<{role}>",
+        "suffix_template": "|",
+    },
+    "max_tokens_count": 64,
+    "only_answer_loss": True,
+}
+
+
+class CharTokenizer:
+    """Tokenizer with one token per character."""
+
+    bos_token_id = BOS
+
+    def encode(self, text, add_special_tokens=False):
+        return [ord(char) for char in text]
+
+    def get_vocab(self):
+        return {chr(code): code for code in range(128)}
+
+    def __len__(self):
+        """Returns the size of the vocabulary."""
+        return 128
+
+
+def dialogue(*contents):
+    roles = ["system", "user", "bot"] + ["user", "bot"] * len(contents)
+    return [{"role": role, "content": content} for role, content in zip(roles, contents)]
+
+
+def test_encode_dialogue_learns_only_the_answers():
+    ids, mask = encode_dialogue(CharTokenizer(), dialogue("s", "hi", "yo"), SETTINGS)
+
+    assert ids[0] == BOS
+    assert "".join(chr(token) for token in ids[1:]) == "<system>s|<user>hi|<assistant>yo|"
+    assert "".join(chr(token) for token, learned in zip(ids, mask) if learned) == "yo|"
+
+
+def test_encode_dialogue_learns_every_message_without_answer_only_loss():
+    ids, mask = encode_dialogue(CharTokenizer(), dialogue("s", "hi", "yo"), {**SETTINGS, "only_answer_loss": False})
+
+    assert mask == [0] + [1] * (len(ids) - 1)
+
+
+def test_encode_dialogue_cuts_after_the_last_fitting_answer():
+    settings = {**SETTINGS, "max_tokens_count": 40}
+
+    ids, mask = encode_dialogue(CharTokenizer(), dialogue("s", "hi", "yo", "again", "no room left"), settings)
+
+    assert "".join(chr(token) for token in ids).endswith("<assistant>yo|")
+    assert len(ids) == len(mask) <= 40
+
+
+def test_encode_dialogue_drops_a_dialogue_whose_first_answer_does_not_fit():
+    assert encode_dialogue(CharTokenizer(), dialogue("s", "x" * 100, "yo"), SETTINGS) is None
+
+
+def test_pretokenized_dataset_masks_the_labels(tmp_path):
+    records = tmp_path / "records.jsonl"
+    records.write_text(
+        "\n".join(json.dumps({"messages": dialogue("s", "q" * index, "a")}) for index in (1, 2, 80)) + "\n"
+    )
+    settings = {**SETTINGS, "sources": [{"path": str(records), "num_samples": 10}]}
+
+    dataset = PretokenizedDataset.load(CharTokenizer(), settings, str(tmp_path / "cache"))
+
+    assert len(dataset) == 2
+    assert dataset.meta["dropped"] == 1
+    item = dataset[1]
+    learned = item["labels"] != IGNORE_INDEX
+    assert "".join(chr(token) for token in item["input_ids"][learned]) == "a|"
+    assert PretokenizedDataset.load(CharTokenizer(), settings, str(tmp_path / "cache")).directory == dataset.directory
+
+
+@pytest.mark.parametrize("count", [1, 7, 300, 1001])
+def test_bucket_batches_cover_every_dialogue_once(count):
+    lengths = np.random.default_rng(count).integers(1, 2000, count)
+
+    batches = bucket_batches(lengths, 8, seed=0)
+
+    assert sorted(index for batch in batches for index in batch) == list(range(count))
+    assert sum(len(batch) < 8 for batch in batches) <= 1
+    assert all(list(lengths[batch]) == sorted(lengths[batch], reverse=True) for batch in batches)
+
+
+def test_bucket_batches_pad_less_than_random_batches():
+    lengths = np.random.default_rng(0).integers(1, 2000, 4000)
+
+    slots = sum(len(batch) * int(lengths[batch].max()) for batch in bucket_batches(lengths, 8, seed=0))
+
+    assert slots < 1.1 * lengths.sum()
+
+
+def test_bucket_sampler_keeps_the_batches_for_a_loader_of_the_same_size():
+    lengths = np.random.default_rng(0).integers(1, 2000, 1003)
+    sampler = BucketSampler(lengths, 8, seed=0)
+
+    order = list(sampler)
+    chunks = [order[start : start + 8] for start in range(0, len(order), 8)]
+
+    assert len(sampler) == len(order) == 1003
+    assert sorted(map(sorted, chunks)) == sorted(map(sorted, bucket_batches(lengths, 8, seed=0)))
+    sampler.set_epoch(1)
+    assert list(sampler) != order
+
+
+@pytest.mark.parametrize("count", [1, 50, 500])
+def test_pack_sequences_fit_the_length_and_cover_every_dialogue_once(count):
+    lengths = np.random.default_rng(count).integers(1, 512, count)
+
+    packs = pack_sequences(lengths, 512)
+
+    assert sorted(index for pack in packs for index in pack) == list(range(count))
+    assert all(lengths[pack].sum() <= 512 for pack in packs)
+
+
+def test_collate_pads_to_the_longest_dialogue():
+    items = [
+        {"input_ids": np.array([5, 6, 7]), "labels": np.array([IGNORE_INDEX, 6, 7])},
+        {"input_ids": np.array([8]), "labels": np.array([8])},
+    ]
+
+    batch = collate(items, pad_token_id=0)
+
+    assert batch["input_ids"].tolist() == [[5, 6, 7], [8, 0, 0]]
+    assert batch["labels"].tolist() == [[IGNORE_INDEX, 6, 7], [8, IGNORE_INDEX, IGNORE_INDEX]]
+    assert batch["attention_mask"].tolist() == [[1, 1, 1], [1, 0, 0]]
@@ -0,0 +1,91 @@
+import contextlib
+import io
+import json
+import random
+import re
+
+import pytest
+from specs import parse_specs, parse_to_list_of_dicts_general
+
+WORDS = ["get", "the", "current", "weather", "for", "a", "city", "погода", "в", "городе", "amount", "of", "loan"]
+TRICKY = ["user's", "don't", 'the "best" one', "50% off", "a, b: c", "{braces}", "[list]", "back\\slash", "café"]
+BARE_KEY_PATTERN = re.compile(r'"(\w+)"(\s*:)')
+STYLES = ["json", "list", "python", "bare", "trailing"]
+
+
+def random_text(rng):
+    words = rng.choices(WORDS, k=rng.randint(1, 6))
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(TRICKY))
+    return " ".join(words)
+
+
+def random_spec(rng, index):
+    properties = {}
+    for number in range(rng.randint(0, 4)):
+        kind = rng.choice(["string", "number", "integer", "boolean", "array"])
+        value = {"type": kind, "description": random_text(rng)}
+        if kind == "string" and rng.random() < 0.3:
+            value["enum"] = [random_text(rng) for _ in range(rng.randint(1, 3))]
+        if kind == "array":
+            value["items"] = {"type": "string"}
+        if kind == "number" and rng.random() < 0.3:
+            value["minimum"] = rng.choice([0, -1.5, 1e3])
+        properties[f"arg_{number}"] = value
+    return {
+        "name": f"function_{index}",
+        "description": random_text(rng),
+        "parameters": {"type": "object", "properties": properties, "required": list(properties)[:1]},
+    }
+
+
+def render(specs, style):
+    """Writes specs as the pseudo-JSON of a system prompt, in one of the styles seen in the corpus."""
+    if style == "list":
+        return json.dumps(specs, ensure_ascii=False)
+    if style == "python":
+        return "\n\n".join(repr(spec) for spec in specs)
+    text = "\n\n".join(json.dumps(spec, ensure_ascii=False, indent=4) for spec in specs)
+    if style == "bare":
+        return BARE_KEY_PATTERN.sub(r"\1\2", text)
+    if style == "trailing":
+        return re.sub(r"(\n\s*[}\]])", r",\1", text)
+    return text
+
+
+@pytest.mark.parametrize("style", STYLES)
+def test_parse_specs_recovers_random_specs(style):
+    rng = random.Random(style)
+    for _ in range(200):
+        specs = [random_spec(rng, index) for index in range(rng.randint(1, 4))]
+        text = render(specs, style)
+
+        assert parse_specs(text) == specs, text
+
+
+@pytest.mark.parametrize("style", STYLES)
+def test_parse_specs_agrees_with_the_legacy_parser(style):
+    rng = random.Random(f"legacy-{style}")
+    for _ in range(200):
+        specs = [random_spec(rng, index) for index in range(rng.randint(1, 4))]
+        text = render(specs, style)
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy = parse_to_list_of_dicts_general(text)
+
+        if legacy:
+            assert parse_specs(text) == legacy, text
+
+
+@pytest.mark.parametrize("text", ["{a: " * 3000, "[" * 100000, '{"a": ' * 3000])
+def test_parse_specs_gives_up_on_deeply_nested_text(text):
+    assert parse_specs(text) == []
+
+
+def test_parse_specs_skips_text_around_specs():
+    spec = {"name": "get_weather", "description": "Get the weather", "parameters": {}}
+
+    assert parse_specs(f"Use these functions:\n{json.dumps(spec)}\nThanks") == [spec]
+
+
+def test_parse_specs_returns_nothing_without_specs():
+    assert parse_specs("No functions available") == []
@@ -0,0 +1,295 @@
+import json
+import os
+import random
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+from stub_server import fake_completion
+
+ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS = 50000
+MAX_BYTES = 190 * 1024 * 1024
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# ENDPOINT: The endpoint the batched requests are sent to.
+# MAX_REQUESTS: Maximum number of requests of a batch input file accepted by the Batch API.
+# MAX_BYTES: Maximum size of a batch input file, under the 200 MB accepted by the Batch API.
+# FINAL_STATUSES: The statuses of a batch that will not change anymore.
+
+Request = Tuple[str, Dict[str, Any]]
+
+# Request: The custom id of a request, unique within a build, and its chat completion body.
+
+
+def strict_schema(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rewrites a JSON schema in place into the strict subset accepted by structured outputs: objects list all
+    their properties as required and forbid the others unless their additional properties are typed, null
+    defaults are dropped, and references with sibling keys are inlined.
+
+    Args:
+        schema (Dict[str, Any]): The schema, or a subschema of `root`.
+        root (Dict[str, Any]): The whole schema, against which references are resolved.
+
+    Returns:
+        Dict[str, Any]: The strict schema.
+    """
+    for definitions in (schema.get("$defs"), schema.get("definitions")):
+        for definition in (definitions or {}).values():
+            strict_schema(definition, root)
+    if schema.get("type") == "object":
+        schema.setdefault("additionalProperties", False)
+    if isinstance(schema.get("properties"), dict):
+        schema["required"] = list(schema["properties"])
+        for value in schema["properties"].values():
+            strict_schema(value, root)
+    if isinstance(schema.get("items"), dict):
+        strict_schema(schema["items"], root)
+    for variant in schema.get("anyOf", []):
+        strict_schema(variant, root)
+    all_of = schema.get("allOf", [])
+    for entry in all_of:
+        strict_schema(entry, root)
+    if len(all_of) == 1:
+        schema.update(schema.pop("allOf")[0])
+    if "default" in schema and schema["default"] is None:
+        del schema["default"]
+    if "$ref" in schema and len(schema) > 1:
+        resolved: Any = root
+        for part in schema["$ref"][2:].split("/"):
+            resolved = resolved[part]
+        schema.update({**resolved, **schema})
+        del schema["$ref"]
+    return schema
+
+
+def response_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Builds the structured output parameter of a chat completion request body from a Pydantic model, as
+    `client.beta.chat.completions.parse` does for the synchronous requests.
+
+    Args:
+        model (Type[BaseModel]): The model of the answer.
+
+    Returns:
+        Dict[str, Any]: The `response_format` of the request body.
+    """
+    schema = model.model_json_schema()
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "schema": strict_schema(schema, schema), "strict": True},
+    }
+
+
+def write_requests(requests: List[Request], directory: str, max_requests: int = MAX_REQUESTS) -> List[str]:
+    """
+    Writes the requests to batch input files within the limits of the Batch API.
+
+    Args:
+        requests (List[Request]): The requests.
+        directory (str): The directory of the files.
+        max_requests (int): Maximum number of requests per file.
+
+    Returns:
+        List[str]: The paths of the files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths: List[str] = []
+    f, count, size = None, 0, 0
+    for custom_id, body in requests:
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}, ensure_ascii=False)
+        line_size = len(line.encode()) + 1
+        if f is None or count >= max_requests or size + line_size > MAX_BYTES:
+            if f is not None:
+                f.close()
+            paths.append(os.path.join(directory, f"requests-{len(paths):04d}.jsonl"))
+            f, count, size = open(paths[-1], "w", encoding="utf-8"), 0, 0
+        f.write(line + "\n")
+        count += 1
+        size += line_size
+    if f is not None:
+        f.close()
+    return paths
+
+
+def read_results(path: str) -> Dict[str, Optional[str]]:
+    """
+    Reads a batch output or error file.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        Dict[str, Optional[str]]: The answer content by custom id, None for the failed requests.
+    """
+    results: Dict[str, Optional[str]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                results[record["custom_id"]] = None
+            else:
+                results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+class OpenAIBatchBackend:
+    """
+    The OpenAI Batch API, which runs the requests within 24 hours at half the price and outside the quotas
+    of the synchronous API.
+
+    Attributes:
+        client (Any): The OpenAI client.
+    """
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT, completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, directory: str) -> List[str]:
+        batch = self.client.batches.retrieve(batch_id)
+        paths = []
+        for kind, file_id in (("output", batch.output_file_id), ("errors", batch.error_file_id)):
+            if file_id:
+                paths.append(os.path.join(directory, f"{batch_id}-{kind}.jsonl"))
+                self.client.files.content(file_id).write_to_file(paths[-1])
+        return paths
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in of the Batch API, answering like `stub_server.py`, used to run the batch mode
+    without the API. A batch completes `latency` seconds after its submission, with a share of its requests
+    failed.
+
+    Attributes:
+        directory (str): The directory of the submitted batches.
+        latency (float): Seconds a batch takes.
+        error_rate (float): Share of the requests failed.
+    """
+
+    def __init__(self, directory: str, latency: float = 1.0, error_rate: float = 0.0):
+        self.directory = directory
+        self.latency = latency
+        self.error_rate = error_rate
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        shutil.copyfile(path, self._path(batch_id, "input.jsonl"))
+        with open(self._path(batch_id, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"submitted_at": time.time()}, f)
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        with open(self._path(batch_id, "meta.json"), "r", encoding="utf-8") as f:
+            submitted_at = json.load(f)["submitted_at"]
+        return "completed" if time.time() - submitted_at >= self.latency else "in_progress"
+
+    def download(self, batch_id: str, directory: str) -> List[str]:
+        path = os.path.join(directory, f"{batch_id}-output.jsonl")
+        with open(self._path(batch_id, "input.jsonl"), "r", encoding="utf-8") as source, open(path, "w") as output:
+            for line in source:
+                request = json.loads(line)
+                record: Dict[str, Any] = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"]}
+                if random.random() < self.error_rate:
+                    record.update(response={"status_code": 500, "body": {}}, error=None)
+                else:
+                    record.update(response={"status_code": 200, "body": fake_completion(request["body"])}, error=None)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return [path]
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}-{name}")
+
+
+class BatchRunner:
+    """
+    Runs requests through a batch backend unattended: writes them to input files, submits every file as a
+    batch, polls the batches with a growing interval and joins their results by custom id.
+
+    The input files and the id of every batch are saved in the directory as soon as the batch is submitted, so
+    that a restarted build waits for the batches in flight and only submits the files not submitted yet.
+
+    Attributes:
+        backend (Any): The batch backend, `OpenAIBatchBackend` or `LocalBatchBackend`.
+        directory (str): The directory of the input, output and state files.
+        max_requests (int): Maximum number of requests per batch.
+        poll_interval (float): First interval between two polls, in seconds.
+        max_poll_interval (float): Maximum interval between two polls, in seconds.
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        directory: str,
+        max_requests: int = MAX_REQUESTS,
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 300.0,
+    ):
+        self.backend = backend
+        self.directory = directory
+        self.max_requests = max_requests
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def run(self, requests: List[Request]) -> Dict[str, Optional[str]]:
+        """
+        Runs the requests, or resumes the run interrupted in the directory, whose requests were already written.
+
+        Args:
+            requests (List[Request]): The requests.
+
+        Returns:
+            Dict[str, Optional[str]]: The answer content by custom id, None for the failed requests. The
+            requests of failed or expired batches are missing.
+        """
+        state_path = os.path.join(self.directory, "batches.json")
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            print(f"Resuming the {len(state['files'])} batches of the previous run")
+        else:
+            state = {"files": write_requests(requests, self.directory, self.max_requests), "batches": {}}
+            self._save(state_path, state)
+            print(f"Submitting {len(requests)} requests in {len(state['files'])} batches")
+        for path in state["files"]:
+            if path not in state["batches"]:
+                state["batches"][path] = self.backend.submit(path)
+                self._save(state_path, state)
+        batch_ids = list(state["batches"].values())
+
+        results: Dict[str, Optional[str]] = {}
+        interval = self.poll_interval
+        while batch_ids:
+            for batch_id in list(batch_ids):
+                status = self.backend.status(batch_id)
+                if status in FINAL_STATUSES:
+                    print(f"Batch {batch_id} {status}")
+                    for path in self.backend.download(batch_id, self.directory):
+                        results.update(read_results(path))
+                    batch_ids.remove(batch_id)
+            if batch_ids:
+                time.sleep(interval * random.uniform(0.8, 1.2))
+                interval = min(self.max_poll_interval, interval * 1.5)
+        os.remove(state_path)
+        return results
+
+    @staticmethod
+    def _save(path: str, state: Dict[str, Any]) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,127 @@
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import torch
+from step_metrics import StepMetrics
+from transformers import AutoModelForCausalLM, LlamaConfig
+
+TINY_MODEL = {
+    "vocab_size": 1024,
+    "hidden_size": 128,
+    "intermediate_size": 256,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 4,
+    "num_key_value_heads": 2,
+    "max_position_embeddings": 4096,
+}
+
+# TINY_MODEL: Configuration of a Llama model small enough to train on CPU, with the architecture of the
+# fine-tuned model.
+
+
+def benchmark(
+    attn_implementation: str, batch_size: int, seq_len: int, steps: int, seed: int, threads: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Trains a tiny randomly initialized model for a few steps with an attention implementation.
+
+    Args:
+        attn_implementation (str): The attention implementation, e.g. "eager" or "sdpa".
+        batch_size (int): Number of sequences per step.
+        seq_len (int): Number of tokens per sequence.
+        steps (int): Number of measured steps, after one warm-up step.
+        seed (int): The seed of the weights and the inputs.
+        threads (Optional[int]): Number of CPU threads of torch, its default if not set.
+
+    Returns:
+        Dict[str, Any]: The mean metrics of the steps, and the logits of the first batch before training.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(seed)
+    model = AutoModelForCausalLM.from_config(LlamaConfig(**TINY_MODEL), attn_implementation=attn_implementation)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    inputs = {
+        "input_ids": torch.randint(TINY_MODEL["vocab_size"], (batch_size, seq_len)),
+        "attention_mask": torch.ones(batch_size, seq_len, dtype=torch.long),
+    }
+    with torch.no_grad():
+        logits = model(**inputs).logits
+
+    metrics = StepMetrics()
+    records: List[Dict[str, Any]] = []
+    for step in range(steps + 1):
+        metrics.begin()
+        metrics.observe(inputs)
+        loss = model(**inputs, labels=inputs["input_ids"]).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        record = metrics.end(step)
+        if step:
+            records.append(record)
+    return {
+        "wall_time": sum(record["wall_time"] for record in records) / len(records),
+        "tokens_per_second": sum(record["tokens_per_second"] for record in records) / len(records),
+        "peak_memory_mb": max(record["peak_memory_mb"] for record in records),
+        "logits": logits,
+    }
+
+
+def benchmark_in_process(*args: Any) -> Dict[str, Any]:
+    """
+    Runs `benchmark` in a new process, so that the peak memory it reports is that of this configuration only:
+    on CPU the peak resident set size of a process never goes down.
+
+    Args:
+        *args (Any): The arguments of `benchmark`.
+
+    Returns:
+        Dict[str, Any]: The result of `benchmark`.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(benchmark, *args).result()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Compare the attention implementations on a tiny model on CPU.")
+    parser.add_argument(
+        "--attn-implementation", type=str, nargs="+", default=["eager", "sdpa"], help="Implementations to compare."
+    )
+    parser.add_argument("--batch-size", type=int, default=4, help="Number of sequences per step.")
+    parser.add_argument("--seq-len", type=int, nargs="+", default=[256, 1024, 2000], help="Sequence lengths.")
+    parser.add_argument("--steps", type=int, default=5, help="Number of measured steps.")
+    parser.add_argument("--threads", type=int, default=None, help="Number of CPU threads of torch.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the weights and the inputs.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Trains the tiny model with every attention implementation and sequence length, and prints the step time,
+    the throughput, the peak memory, and the largest logit difference with the first implementation. Every
+    configuration runs in its own process, so the peak memory on CPU is not that of the largest run so far.
+    """
+    args = parse_arguments()
+    print(f"{'attention':>18} {'seq len':>8} {'step s':>8} {'tokens/s':>10} {'peak MiB':>9} {'max diff':>9}")
+    for seq_len in args.seq_len:
+        reference = None
+        for attn_implementation in args.attn_implementation:
+            result = benchmark_in_process(
+                attn_implementation, args.batch_size, seq_len, args.steps, args.seed, args.threads
+            )
+            if reference is None:
+                reference = result["logits"]
+            difference = (result["logits"] - reference).abs().max().item()
+            print(
+                f"{attn_implementation:>18} {seq_len:>8} {result['wall_time']:>8.3f} "
+                f"{result['tokens_per_second']:>10.0f} {result['peak_memory_mb']:>9.0f} {difference:>9.2e}"
+            )
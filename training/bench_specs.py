@@ -0,0 +1,116 @@
+import argparse
+import contextlib
+import io
+import itertools
+import time
+from typing import Any, Callable, List, Tuple
+
+from create_datasets import SOURCE
+from sampling import iter_source
+from specs import parse_specs, parse_to_list_of_dicts_general
+
+Parser = Callable[[str], List[Any]]
+
+
+def legacy_parse(text: str) -> List[Any]:
+    """
+    Runs the legacy parser with its diagnostics silenced.
+
+    Args:
+        text (str): The specs.
+
+    Returns:
+        List[Any]: The parsed specs.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return parse_to_list_of_dicts_general(text)
+
+
+def load_specs(source: str, limit: int) -> List[str]:
+    """
+    Collects the function specs of the system prompts of the source.
+
+    Args:
+        source (str): A local copy or the name of a Hugging Face dataset.
+        limit (int): Number of leading samples to read.
+
+    Returns:
+        List[str]: The specs of the prompts that list functions.
+    """
+    specs = []
+    for example in itertools.islice(iter_source(source), limit):
+        splitted_prompt = example["system"].split(" -\n")
+        if len(splitted_prompt) > 1:
+            specs.append(splitted_prompt[-1])
+    return specs
+
+
+def measure(parser: Parser, texts: List[str]) -> Tuple[float, float, List[Any]]:
+    """
+    Times a parser on every text.
+
+    Args:
+        parser (Parser): The parser.
+        texts (List[str]): The texts.
+
+    Returns:
+        Tuple[float, float, List[Any]]: The total and the slowest time in seconds, and the parsed texts.
+    """
+    total, slowest, results = 0.0, 0.0, []
+    for text in texts:
+        started_at = time.perf_counter()
+        results.append(parser(text))
+        elapsed = time.perf_counter() - started_at
+        total += elapsed
+        slowest = max(slowest, elapsed)
+    return total, slowest, results
+
+
+def benchmark(texts: List[str]) -> None:
+    """
+    Compares the parsers on the specs of the corpus, and on catalogs of a growing number of specs.
+
+    Args:
+        texts (List[str]): The specs of the corpus.
+    """
+    legacy_total, legacy_slowest, legacy_results = measure(legacy_parse, texts)
+    total, slowest, results = measure(parse_specs, texts)
+    agree = sum(legacy == new for legacy, new in zip(legacy_results, results))
+    recovered = sum(not legacy and bool(new) for legacy, new in zip(legacy_results, results))
+    print(f"{len(texts)} catalogs, {agree} parsed the same, {recovered} only parsed by the new parser")
+    print(f"{'parser':>7} {'total s':>8} {'mean ms':>8} {'max ms':>8}")
+    for name, parser_total, parser_slowest in (("legacy", legacy_total, legacy_slowest), ("new", total, slowest)):
+        mean = parser_total / max(len(texts), 1)
+        print(f"{name:>7} {parser_total:>8.3f} {mean * 1e3:>8.3f} {parser_slowest * 1e3:>8.3f}")
+
+    longest = max(texts, key=len, default='{"name": "f", "description": "d", "parameters": {}}')
+    print(f"\n{'specs':>6} {'chars':>7} {'legacy ms':>10} {'new ms':>8}")
+    for count in (1, 2, 4, 8, 16, 32):
+        catalog = "\n\n".join([longest] * count)
+        legacy_time, _, _ = measure(legacy_parse, [catalog])
+        new_time, _, _ = measure(parse_specs, [catalog])
+        print(f"{count:>6} {len(catalog):>7} {legacy_time * 1e3:>10.2f} {new_time * 1e3:>8.3f}")
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the function spec parsers.")
+    parser.add_argument(
+        "--source", type=str, default=SOURCE, help="Hugging Face dataset, or a local .jsonl/.parquet/.arrow copy."
+    )
+    parser.add_argument("--limit", type=int, default=5000, help="Number of samples of the source to parse.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Times the legacy and the new spec parsers on the system prompts of the corpus and on growing catalogs.
+    The new parser is checked against random specs by `tests/training/test_specs.py`.
+    """
+    args = parse_arguments()
+    benchmark(load_specs(args.source, args.limit))
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Type
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
+from pydantic import BaseModel
+
+CHARS_PER_TOKEN = 4
+RETRY_STATUSES = {408, 409, 429}
+
+# CHARS_PER_TOKEN: Rough number of characters per token, used to reserve the tokens of a request before it is sent.
+# RETRY_STATUSES: Status codes besides 5xx on which a request is retried.
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its capacity.
+
+    Attributes:
+        capacity (float): Maximum number of tokens held, the burst size.
+        rate (float): Tokens added per second.
+        tokens (float): Tokens currently available, negative while a debt is being paid back.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def delay(self, amount: float) -> float:
+        """
+        Computes how long to wait until an amount of tokens is available.
+
+        Args:
+            amount (float): The tokens needed, capped at the capacity.
+
+        Returns:
+            float: The wait in seconds, 0 if the tokens are available.
+        """
+        self.refill()
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Limiter of the requests sent to an API with per-minute quotas of requests and tokens.
+
+    Every request reserves one request and an estimate of its tokens before it is sent, waiting for the
+    buckets to refill if needed, and the estimate is corrected with the usage reported by the API.
+    Requests are admitted in arrival order, so large requests are not starved by small ones.
+
+    Attributes:
+        requests_per_minute (float): The request quota, 0 for no limit.
+        tokens_per_minute (float): The token quota, 0 for no limit.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """
+        Waits until a request of a given size fits the quotas, and reserves it.
+
+        Args:
+            tokens (int): The estimated tokens of the request, prompt and completion.
+        """
+        async with self._lock:
+            while True:
+                delay = max(
+                    self._requests.delay(1) if self._requests else 0.0,
+                    self._tokens.delay(tokens) if self._tokens else 0.0,
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            if self._requests:
+                self._requests.tokens -= 1
+            if self._tokens:
+                self._tokens.tokens -= tokens
+
+    def settle(self, reserved: int, used: int) -> None:
+        """
+        Corrects the reservation of a request with its actual token usage.
+
+        Args:
+            reserved (int): The tokens reserved by `acquire`.
+            used (int): The tokens reported by the API.
+        """
+        if self._tokens:
+            self._tokens.refill()
+            self._tokens.tokens = min(self._tokens.capacity, self._tokens.tokens + reserved - used)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Empties the buckets so that no request is admitted for a while, after the API rejected one.
+
+        Args:
+            seconds (float): The time to wait before the next request.
+        """
+        for bucket in (self._requests, self._tokens):
+            if bucket:
+                bucket.refill()
+                bucket.tokens = min(bucket.tokens, -seconds * bucket.rate)
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """
+    Estimates the tokens a chat completion counts against the quota: the prompt and the completion.
+
+    Args:
+        messages (List[Dict[str, Any]]): The chat messages.
+        max_tokens (int): The expected completion length.
+
+    Returns:
+        int: The estimated tokens.
+    """
+    return sum(len(str(message.get("content", ""))) // CHARS_PER_TOKEN + 4 for message in messages) + max_tokens
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of the model responses, so that a rebuild with unchanged prompts makes
+    no API calls. Every response is a file named by the hash of its request, written atomically.
+
+    Attributes:
+        directory (str): The directory of the cached responses.
+        hits (int): Number of requests answered from the cache.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+
+    @staticmethod
+    def key(kwargs: Dict[str, Any]) -> str:
+        """
+        Hashes a request: the model, the messages, the response format and the sampling parameters.
+
+        Args:
+            kwargs (Dict[str, Any]): The arguments of the request.
+
+        Returns:
+            str: The hex digest of the request.
+        """
+        request = dict(kwargs)
+        response_format = request.get("response_format")
+        if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+            request["response_format"] = response_format.model_json_schema()
+        return hashlib.sha256(json.dumps(request, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                content = json.load(f)["content"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, key: str, content: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"content": content}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+
+class ChatClient:
+    """
+    Asynchronous chat completion client bounded by the API quotas rather than by a number of threads.
+
+    Requests wait for the rate limiter, and the ones failing with a rate limit, a server error or a
+    connection error are retried with exponential backoff and full jitter, honouring the `Retry-After`
+    header. The number of requests in flight is capped by `concurrency`. Responses found in the cache are
+    returned without a request.
+
+    Attributes:
+        client (AsyncOpenAI): The OpenAI client, with its own retries disabled.
+        limiter (RateLimiter): The limiter of the requests.
+        cache (Optional[ResponseCache]): The cache of the responses.
+        max_retries (int): Maximum number of retries of a request.
+        backoff (float): Base delay of the retries in seconds.
+        max_backoff (float): Maximum delay of a retry in seconds.
+        completion_tokens (int): Expected completion length reserved for every request.
+        requests (int): Number of requests sent, retries included.
+        retries (int): Number of retried requests.
+        tokens (int): Number of tokens used.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        limiter: RateLimiter,
+        concurrency: int = 32,
+        max_retries: int = 6,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        completion_tokens: int = 1024,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.client = client
+        self.limiter = limiter
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.completion_tokens = completion_tokens
+        self.requests = 0
+        self.retries = 0
+        self.tokens = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def create(self, **kwargs: Any) -> str:
+        """
+        Creates a chat completion.
+
+        Args:
+            **kwargs (Any): The arguments of `chat.completions.create`.
+
+        Returns:
+            str: The content of the answer.
+        """
+        return await self._call(self.client.chat.completions.create, kwargs)
+
+    async def parse(self, response_format: Type[BaseModel], **kwargs: Any) -> BaseModel:
+        """
+        Creates a chat completion parsed into a structured response format.
+
+        Args:
+            response_format (Type[BaseModel]): The model of the answer.
+            **kwargs (Any): The other arguments of `beta.chat.completions.parse`.
+
+        Returns:
+            BaseModel: The parsed answer.
+        """
+        content = await self._call(
+            self.client.beta.chat.completions.parse, {**kwargs, "response_format": response_format}
+        )
+        return response_format.model_validate_json(content)
+
+    async def _call(self, method: Any, kwargs: Dict[str, Any]) -> str:
+        key = self.cache.key(kwargs) if self.cache else None
+        content = self.cache.get(key) if self.cache else None
+        if content is None:
+            content = await self._request(method, kwargs)
+            if self.cache:
+                self.cache.put(key, content)
+        return content
+
+    async def _request(self, method: Any, kwargs: Dict[str, Any]) -> str:
+        reserved = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens") or self.completion_tokens)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(reserved)
+            try:
+                async with self._slots:
+                    self.requests += 1
+                    completion = await method(**kwargs)
+            except (APIStatusError, APIConnectionError, APITimeoutError) as e:
+                self.limiter.settle(reserved, 0)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+
+            used = completion.usage.total_tokens if completion.usage else reserved
+            self.limiter.settle(reserved, used)
+            self.tokens += used
+            return completion.choices[0].message.content
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(error, APIStatusError) and error.status_code < 500 and error.status_code not in RETRY_STATUSES:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            if error.status_code == 429:
+                self.limiter.pause(delay)
+        return delay
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Set
+
+Dialogue = List[Dict[str, Any]]
+
+# Dialogue: A converted dialogue, a list of `{"role": ..., "content": ...}` messages.
+
+
+def sample_id(example: Dict[str, Any]) -> str:
+    """
+    Computes a stable id of a source sample from its content, independent of its position in the dataset.
+
+    Args:
+        example (Dict[str, Any]): The sample with its system prompt and chat.
+
+    Returns:
+        str: The id.
+    """
+    return hashlib.sha256(f"{example['system']}\0{example['chat']}".encode()).hexdigest()[:16]
+
+
+class Checkpoint:
+    """
+    Append-only record of a dataset build, so that a crashed or interrupted build resumes where it stopped.
+
+    Every converted dialogue is appended to `results.jsonl` and flushed to disk as soon as it is ready, then
+    its source id is appended to `manifest.jsonl`. A dialogue counts as done only once its id is in the
+    manifest, so a record torn by a crash is converted again and its duplicate ignored on load.
+
+    Attributes:
+        directory (str): The directory of the build.
+        completed (Set[str]): The ids of the converted samples.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.completed: Set[str] = set()
+        self._dialogues: Dict[str, Dialogue] = {}
+        self._load()
+        self._results = open(os.path.join(directory, "results.jsonl"), "a", encoding="utf-8")
+        self._manifest = open(os.path.join(directory, "manifest.jsonl"), "a", encoding="utf-8")
+
+    def add(self, source_id: str, dialogue: Dialogue) -> None:
+        """
+        Records a converted dialogue.
+
+        Args:
+            source_id (str): The id of the source sample.
+            dialogue (Dialogue): The converted dialogue.
+        """
+        self._append(self._results, {"id": source_id, "dialogue": dialogue})
+        self._append(self._manifest, {"id": source_id})
+        self.completed.add(source_id)
+        self._dialogues[source_id] = dialogue
+
+    def dialogues(self) -> List[Dialogue]:
+        """
+        Returns the converted dialogues of this and the previous runs, in the order of their ids, so that the
+        split of a resumed build does not depend on the completion order.
+
+        Returns:
+            List[Dialogue]: The dialogues.
+        """
+        return [self._dialogues[source_id] for source_id in sorted(self._dialogues)]
+
+    def close(self) -> None:
+        self._results.close()
+        self._manifest.close()
+
+    def _load(self) -> None:
+        manifest_path = os.path.join(self.directory, "manifest.jsonl")
+        results_path = os.path.join(self.directory, "results.jsonl")
+        if not os.path.exists(manifest_path) or not os.path.exists(results_path):
+            return
+        completed = set()
+        for path in (manifest_path, results_path):
+            self._truncate_torn_line(path)
+        for record in self._read(manifest_path):
+            completed.add(record["id"])
+        for record in self._read(results_path):
+            if record["id"] in completed:
+                self._dialogues[record["id"]] = record["dialogue"]
+        self.completed = set(self._dialogues)
+
+    @staticmethod
+    def _read(path: str) -> List[Dict[str, Any]]:
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                records.append(json.loads(line))
+        return records
+
+    @staticmethod
+    def _truncate_torn_line(path: str) -> None:
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    @staticmethod
+    def _append(file: Any, record: Dict[str, Any]) -> None:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
@@ -1,17 +1,28 @@
-import concurrent.futures
+import argparse
+import asyncio
+import hashlib
 import json
+import os
 import re
 from typing import Any, Dict, List, Optional, Tuple, Union
 
-from datasets import load_dataset
-from openai import OpenAI
+from batch import BatchRunner, LocalBatchBackend, OpenAIBatchBackend, response_format
+from chat_client import ChatClient, RateLimiter, ResponseCache
+from checkpoint import Checkpoint, sample_id
+from openai import AsyncOpenAI, OpenAI
 from pydantic import BaseModel, Field
+from sampling import load_samples
 from sklearn.model_selection import train_test_split
+from specs import parse_specs
 from tqdm import tqdm
 
-# Load dataset
-ds = load_dataset("glaiveai/glaive-function-calling-v2")["train"].train_test_split(test_size=0.996)["train"]
-print(len(ds))
+SOURCE = "glaiveai/glaive-function-calling-v2"
+MODEL = "gpt-4o-2024-08-06"
+NO_FUNCTIONS_PROMPT = "Ты -- полезный помощник без дополнительных функций \n"
+
+# SOURCE: The Hugging Face dataset of English function calling dialogues converted to the training datasets.
+# MODEL: The OpenAI model converting the dialogues and translating the system prompts.
+# NO_FUNCTIONS_PROMPT: The system prompt of the samples without functions, which is not translated.
 
 
 def extract_function_calls(text: str) -> List[Dict[str, Any]]:
@@ -137,50 +148,6 @@ class DialogueResponse(BaseModel):
     dialogue: List[FullResponse] = Field(..., description="Full dialogue according to schemas")
 
 
-client = OpenAI(api_key="")
-
-
-def parse_to_list_of_dicts_general(text: str) -> List[Dict[str, Any]]:
-    """
-    Parses a given text into a list of dictionaries, handling common JSON formatting issues.
-
-    Args:
-        text (str): The input text to be parsed.
-
-    Returns:
-        List[Dict[str, Any]]: A list of dictionaries parsed from the text.
-    """
-    text = re.sub(r"(?<!\\)'(?!s\b)(?=[^']*(?:'[^']*'[^']*)*$)", '"', text)
-    text = re.sub(r"\\(')", r"\1", text)
-    text = re.sub(
-        r'(?<!\\)(")((?:.(?!(?<!\\)"))*.)(")', lambda m: m.group(1) + m.group(2).replace('"', '\\"') + m.group(3), text
-    )
-
-    if not text.strip().startswith("["):
-        corrected_text = re.sub(r"\}\s*\{", "},{", text)
-        corrected_text = f"[{corrected_text}]"
-    else:
-        corrected_text = text
-
-    try:
-        parsed_dicts = json.loads(corrected_text)
-        if not isinstance(parsed_dicts, list):
-            parsed_dicts = [parsed_dicts]
-    except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}")
-        print(f"Problematic text: {corrected_text}")
-        try:
-            fixed_text = re.sub(r"([{,]\s*)(\w+)(\s*:)", r'\1"\2"\3', corrected_text)
-            parsed_dicts = json.loads(fixed_text)
-            if not isinstance(parsed_dicts, list):
-                parsed_dicts = [parsed_dicts]
-        except json.JSONDecodeError:
-            print("Failed to fix JSON. Returning empty list.")
-            parsed_dicts = []
-
-    return parsed_dicts
-
-
 def convert_properties_to_args(parameters: Dict[str, Any]) -> str:
     """
     Converts a dictionary of parameters into a string of arguments.
@@ -210,25 +177,49 @@ def convert_properties_to_args(parameters: Dict[str, Any]) -> str:
     return str(args).replace("{", "").replace("}", "")
 
 
-def translate_system(prompt: str) -> str:
+def parse_system_functions(prompt: str) -> Optional[List[Dict[str, Any]]]:
     """
-    Translates a system prompt into Russian using an OpenAI model.
+    Extracts the function specs listed in a glaive system prompt.
 
     Args:
-        prompt (str): The prompt text to be translated.
+        prompt (str): The system prompt.
 
     Returns:
-        str: The translated prompt text in Russian.
+        Optional[List[Dict[str, Any]]]: The function specs, or None if the prompt lists no functions.
     """
     splitted_prompt = prompt.split(" -\n")
     if len(splitted_prompt) == 1:
-        return "Ты -- полезный помощник без дополнительных функций \n"
+        return None
+    return parse_specs(splitted_prompt[-1])
+
+
+def catalog_key(functions: List[Dict[str, Any]]) -> str:
+    """
+    Hashes a function catalog, normalized so that the key order and the formatting of the specs do not matter.
+
+    Args:
+        functions (List[Dict[str, Any]]): The function specs.
+
+    Returns:
+        str: The hex digest of the catalog.
+    """
+    normalized = json.dumps(functions, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def translation_messages(functions: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Builds the request translating a function catalog into a Russian system prompt.
 
-    json_thing = parse_to_list_of_dicts_general(splitted_prompt[-1])
+    Args:
+        functions (List[Dict[str, Any]]): The function specs.
 
+    Returns:
+        List[Dict[str, str]]: The chat messages of the request.
+    """
     base_prompt = "Ты -- полезный помощник со следующими функциями:\n "
 
-    for func in json_thing:
+    for func in functions:
         args = convert_properties_to_args(func.get("parameters", {}))
         str_to_add = f"{func['description']}: '{func['name']}', args: {args}"
         base_prompt += str_to_add + "\n"
@@ -241,85 +232,368 @@ def translate_system(prompt: str) -> str:
         },
         {"role": "user", "content": base_prompt},
     ]
+    return messages
 
-    completion = client.chat.completions.create(model="gpt-4o-2024-08-06", messages=messages, temperature=0)
-    translated_text = completion.choices[0].message.content
+
+async def translate_system(functions: Optional[List[Dict[str, Any]]], client: ChatClient, model: str = MODEL) -> str:
+    """
+    Translates the function catalog of a system prompt into Russian using an OpenAI model.
+
+    Args:
+        functions (Optional[List[Dict[str, Any]]]): The function specs of the prompt, None if it has none.
+        client (ChatClient): The rate-limited chat client.
+        model (str): The model to translate with.
+
+    Returns:
+        str: The translated prompt text in Russian.
+    """
+    if functions is None:
+        return NO_FUNCTIONS_PROMPT
+
+    translated_text = await client.create(model=model, messages=translation_messages(functions), temperature=0)
 
     return translated_text
 
 
-def prepare_sample(example: Dict[str, Any]) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+class SystemTranslator:
     """
-    Prepares a sample by processing the chat and system prompts and extracting function calls.
+    Memoized translation of the system prompts. Glaive samples share a small set of function catalogs, so
+    every distinct catalog is translated once: concurrent samples with the same catalog wait for the same
+    request, and the translations are kept in a JSON map on disk, reused across runs.
+
+    Attributes:
+        client (Optional[ChatClient]): The rate-limited chat client, None if the translations are requested
+            in batches.
+        model (str): The model to translate with.
+        path (Optional[str]): The file of the translations by catalog hash.
+        translations (Dict[str, str]): The translations by catalog hash.
+        lookups (int): Number of prompts with functions translated.
+        calls (int): Number of translation requests made.
+    """
+
+    def __init__(self, client: Optional[ChatClient], model: str = MODEL, path: Optional[str] = None):
+        self.client = client
+        self.model = model
+        self.path = path
+        self.translations: Dict[str, str] = {}
+        self.lookups = 0
+        self.calls = 0
+        self._keys: Dict[str, Optional[str]] = {}
+        self._catalogs: Dict[str, List[Dict[str, Any]]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.translations = json.load(f)
+
+    def key(self, prompt: str) -> Optional[str]:
+        """
+        Parses the catalog of a system prompt once and hashes it.
+
+        Args:
+            prompt (str): The system prompt.
+
+        Returns:
+            Optional[str]: The catalog hash, or None if the prompt lists no functions.
+        """
+        if prompt not in self._keys:
+            functions = parse_system_functions(prompt)
+            key = None if functions is None else catalog_key(functions)
+            if key is not None:
+                self._catalogs.setdefault(key, functions)
+            self._keys[prompt] = key
+        return self._keys[prompt]
+
+    def prepare(self, dataset: List[Dict[str, Any]]) -> None:
+        """
+        Hashes the catalogs of a dataset ahead of the build and reports how many translations it needs.
+
+        Args:
+            dataset (List[Dict[str, Any]]): The samples to process.
+        """
+        keys = [self.key(example["system"]) for example in dataset]
+        with_catalog = [key for key in keys if key is not None]
+        unique = set(with_catalog)
+        missing = unique - self.translations.keys()
+        print(
+            f"System prompts: {len(with_catalog)} with functions, {len(unique)} unique catalogs, "
+            f"{len(unique) - len(missing)} already translated, {len(missing)} translations to request, "
+            f"{len(with_catalog) - len(missing)} calls saved"
+        )
+
+    def pending(self, dataset: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Collects the catalogs of a dataset that were never translated.
+
+        Args:
+            dataset (List[Dict[str, Any]]): The samples to process.
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: The function specs of the catalogs by hash.
+        """
+        keys = {self.key(example["system"]) for example in dataset} - {None} - self.translations.keys()
+        return {key: self._catalogs[key] for key in sorted(keys)}
+
+    def add(self, key: str, translation: str) -> None:
+        """
+        Records the translation of a catalog.
+
+        Args:
+            key (str): The catalog hash.
+            translation (str): The translated prompt text in Russian.
+        """
+        self.translations[key] = translation
+        self._save()
+
+    async def translate(self, prompt: str) -> str:
+        """
+        Translates a system prompt, requesting the translation of its catalog only if it was never requested.
+
+        Args:
+            prompt (str): The system prompt.
+
+        Returns:
+            str: The translated prompt text in Russian.
+        """
+        key = self.key(prompt)
+        if key is None:
+            return NO_FUNCTIONS_PROMPT
+        self.lookups += 1
+        if key in self.translations:
+            return self.translations[key]
+        if key not in self._inflight:
+            self._inflight[key] = asyncio.ensure_future(self._request(key))
+        return await asyncio.shield(self._inflight[key])
+
+    def report(self) -> None:
+        print(
+            f"Translations: {self.lookups} prompts with functions, {self.calls} calls, "
+            f"{self.lookups - self.calls} saved"
+        )
+
+    async def _request(self, key: str) -> str:
+        try:
+            self.calls += 1
+            translation = await translate_system(self._catalogs[key], self.client, self.model)
+            self.add(key, translation)
+            return translation
+        finally:
+            del self._inflight[key]
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.translations, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def conversion_messages(chat: str) -> List[Dict[str, str]]:
+    """
+    Builds the request converting a glaive chat into a Russian dialogue.
 
     Args:
-        example (Dict[str, Any]): The sample example containing chat and system prompts.
+        chat (str): The chat of the sample.
 
     Returns:
-        Tuple[Optional[List[Dict[str, Any]]], bool]: A tuple where the first element is the processed dialogue or
-        None, and the second element is a boolean indicating success.
+        List[Dict[str, str]]: The chat messages of the request.
     """
-    messages = [
+    return [
         {
             "role": "system",
             "content": "ANSWER IN RUSSIAN. You are a helpful ASSISTANT that helps with converting answers and "
             "translations from English to Russian. Always answer in Russian. If there is no useful command "
             "then answer 'NoFunction'",
         },
-        {"role": "user", "content": example["chat"]},
+        {"role": "user", "content": chat},
     ]
 
-    try:
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06", messages=messages, response_format=DialogueResponse, temperature=0
-        )
-        dialogue = completion.choices[0].message.parsed
 
-        system_ru = translate_system(example["system"])
+def assemble_dialogue(example: Dict[str, Any], dialogue: DialogueResponse, system_ru: str) -> List[Dict[str, Any]]:
+    """
+    Puts the converted dialogue of a sample together with the function calls of its chat and its translated
+    system prompt.
+
+    Args:
+        example (Dict[str, Any]): The sample example containing chat and system prompts.
+        dialogue (DialogueResponse): The converted dialogue.
+        system_ru (str): The translated system prompt.
+
+    Returns:
+        List[Dict[str, Any]]: The processed dialogue.
+    """
+    extracted_function_calls = extract_function_calls(example["chat"])
+    processed_dialogue = post_process_dialogue(dialogue.model_dump()["dialogue"], extracted_function_calls)
+    processed_dialogue[0]["content"] = system_ru + "\n" + processed_dialogue[0]["content"]
+    return processed_dialogue
 
-        extracted_function_calls = extract_function_calls(example["chat"])
-        processed_dialogue = post_process_dialogue(dialogue.model_dump()["dialogue"], extracted_function_calls)
-        processed_dialogue[0]["content"] = system_ru + "\n" + processed_dialogue[0]["content"]
 
-        return processed_dialogue, True
+async def prepare_sample(
+    example: Dict[str, Any], client: ChatClient, translator: SystemTranslator, model: str = MODEL
+) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+    """
+    Prepares a sample by processing the chat and system prompts and extracting function calls. The dialogue
+    conversion and the system prompt translation are requested concurrently.
+
+    Args:
+        example (Dict[str, Any]): The sample example containing chat and system prompts.
+        client (ChatClient): The rate-limited chat client.
+        translator (SystemTranslator): The memoized translator of the system prompts.
+        model (str): The model to convert with.
+
+    Returns:
+        Tuple[Optional[List[Dict[str, Any]]], bool]: A tuple where the first element is the processed dialogue or
+        None, and the second element is a boolean indicating success.
+    """
+    messages = conversion_messages(example["chat"])
+
+    try:
+        dialogue, system_ru = await asyncio.gather(
+            client.parse(model=model, messages=messages, response_format=DialogueResponse, temperature=0),
+            translator.translate(example["system"]),
+        )
+        return assemble_dialogue(example, dialogue, system_ru), True
     except Exception as e:
         print(f"Error processing sample: {e}")
         print("SYSTEM:", example["system"])
         print("CHAT:", example["chat"])
-        print("Extracted function calls:", extracted_function_calls)
+        print("Extracted function calls:", extract_function_calls(example["chat"]))
         return None, False
 
 
-def process_dataset(dataset: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+def pending_samples(dataset: List[Dict[str, Any]], checkpoint: Checkpoint) -> Dict[str, Dict[str, Any]]:
+    """
+    Selects the samples of a dataset not processed by a previous run.
+
+    Args:
+        dataset (List[Dict[str, Any]]): The list of dataset examples to process.
+        checkpoint (Checkpoint): The record of the build.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The samples left by id.
     """
-    Processes a dataset by preparing samples and handling results with concurrency.
+    pending = {sample_id(example): example for example in dataset}
+    pending = {source_id: example for source_id, example in pending.items() if source_id not in checkpoint.completed}
+    print(f"Resuming with {len(checkpoint.completed)} samples done, {len(pending)} to process")
+    return pending
+
+
+async def process_dataset(
+    dataset: List[Dict[str, Any]],
+    client: ChatClient,
+    checkpoint: Checkpoint,
+    translator: SystemTranslator,
+    model: str = MODEL,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Processes a dataset by preparing all samples concurrently. The throughput is bounded by the quotas and
+    the concurrency of the client. Every processed sample is recorded in the checkpoint as soon as it is
+    ready, and the samples recorded by a previous run are skipped.
 
     Args:
         dataset (List[Dict[str, Any]]): The list of dataset examples to process.
+        client (ChatClient): The rate-limited chat client.
+        checkpoint (Checkpoint): The record of the build.
+        translator (SystemTranslator): The memoized translator of the system prompts.
+        model (str): The model to convert with.
 
     Returns:
-        List[List[Dict[str, Any]]]: A list of processed results for each dataset example.
+        List[List[Dict[str, Any]]]: A list of processed results for each dataset example, of this and the
+        previous runs.
     """
+
+    async def prepare(source_id: str, example: Dict[str, Any]) -> Tuple[str, Optional[List[Dict[str, Any]]], bool]:
+        return (source_id, *await prepare_sample(example, client, translator, model))
+
+    pending = pending_samples(dataset, checkpoint)
+    translator.prepare(list(pending.values()))
+
     successful_samples = 0
     failed_samples = 0
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        futures = [executor.submit(prepare_sample, example) for example in dataset]
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(dataset), desc="Processing samples"):
-            try:
-                result, success = future.result()
-                if success:
-                    results.append(result)
-                    successful_samples += 1
-                else:
-                    failed_samples += 1
-            except Exception as e:
-                print(f"Error processing sample: {e}")
-                failed_samples += 1
+    tasks = [asyncio.ensure_future(prepare(source_id, example)) for source_id, example in pending.items()]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing samples"):
+        source_id, result, success = await task
+        if success:
+            checkpoint.add(source_id, result)
+            successful_samples += 1
+        else:
+            failed_samples += 1
 
     print(f"Successful samples: {successful_samples}")
     print(f"Failed samples: {failed_samples}")
-    return results
+    print(f"Requests: {client.requests}, retries: {client.retries}, tokens: {client.tokens}")
+    if client.cache:
+        print(f"Cached responses: {client.cache.hits}")
+    translator.report()
+    return checkpoint.dialogues()
+
+
+def process_dataset_batch(
+    dataset: List[Dict[str, Any]],
+    runner: BatchRunner,
+    checkpoint: Checkpoint,
+    translator: SystemTranslator,
+    model: str = MODEL,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Processes a dataset through the Batch API: the translations of the new catalogs and the conversions of the
+    samples left are submitted at once, and their results are joined back by custom id. The samples whose
+    requests failed are left for the next run.
+
+    Args:
+        dataset (List[Dict[str, Any]]): The list of dataset examples to process.
+        runner (BatchRunner): The runner of the batches.
+        checkpoint (Checkpoint): The record of the build.
+        translator (SystemTranslator): The memoized translator of the system prompts.
+        model (str): The model to convert with.
+
+    Returns:
+        List[List[Dict[str, Any]]]: A list of processed results for each dataset example, of this and the
+        previous runs.
+    """
+    pending = pending_samples(dataset, checkpoint)
+    translator.prepare(list(pending.values()))
+    catalogs = translator.pending(list(pending.values()))
+    requests = [
+        (f"catalog-{key}", {"model": model, "messages": translation_messages(functions), "temperature": 0})
+        for key, functions in catalogs.items()
+    ]
+    dialogue_format = response_format(DialogueResponse)
+    requests += [
+        (
+            f"dialogue-{source_id}",
+            {
+                "model": model,
+                "messages": conversion_messages(example["chat"]),
+                "response_format": dialogue_format,
+                "temperature": 0,
+            },
+        )
+        for source_id, example in pending.items()
+    ]
+    results = runner.run(requests)
+
+    for key in catalogs:
+        if results.get(f"catalog-{key}") is not None:
+            translator.add(key, results[f"catalog-{key}"])
+    successful_samples = 0
+    for source_id, example in pending.items():
+        key = translator.key(example["system"])
+        system_ru = NO_FUNCTIONS_PROMPT if key is None else translator.translations.get(key)
+        content = results.get(f"dialogue-{source_id}")
+        if system_ru is None or content is None:
+            continue
+        try:
+            dialogue = DialogueResponse.model_validate_json(content)
+            checkpoint.add(source_id, assemble_dialogue(example, dialogue, system_ru))
+            successful_samples += 1
+        except Exception as e:
+            print(f"Error processing sample {source_id}: {e}")
+
+    print(f"Successful samples: {successful_samples}")
+    print(f"Failed samples: {len(pending) - successful_samples}, left for the next run")
+    return checkpoint.dialogues()
 
 
 def create_jsonl_from_processed_results(
@@ -380,6 +654,75 @@ def process_and_split_results(
     create_jsonl_from_processed_results(test_data, test_file)
 
 
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Convert glaive dialogues into the training datasets.")
+    parser.add_argument(
+        "--source", type=str, default=SOURCE, help="Hugging Face dataset, or a local .jsonl/.parquet/.arrow copy."
+    )
+    parser.add_argument("--split", type=str, default="train", help="Split of a Hugging Face dataset.")
+    parser.add_argument("--samples", type=int, default=450, help="Number of dialogues sampled from the source.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the sample.")
+    parser.add_argument("--limit", type=int, default=None, help="Only sample from the first dialogues of the source.")
+    parser.add_argument("--api-key", type=str, default=None, help="OpenAI API key, OPENAI_API_KEY if not set.")
+    parser.add_argument("--base-url", type=str, default=None, help="API URL, e.g. of `stub_server.py`.")
+    parser.add_argument("--model", type=str, default=MODEL, help="Model to convert with.")
+    parser.add_argument("--rpm", type=float, default=500, help="Requests per minute quota, 0 for no limit.")
+    parser.add_argument("--tpm", type=float, default=30000, help="Tokens per minute quota, 0 for no limit.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Maximum number of requests in flight.")
+    parser.add_argument("--max-retries", type=int, default=6, help="Retries of a rate-limited or failed request.")
+    parser.add_argument("--build-dir", type=str, default="build", help="Directory of the resumable build.")
+    parser.add_argument(
+        "--cache-dir", type=str, default="build/responses", help="Directory of the cached model responses."
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Do not cache the model responses.")
+    parser.add_argument(
+        "--translations",
+        type=str,
+        default="build/translations.json",
+        help="File of the system prompt translations by catalog hash.",
+    )
+    parser.add_argument(
+        "--batch",
+        choices=["openai", "local"],
+        default=None,
+        help="Convert through the Batch API, or through its local file-based stand-in.",
+    )
+    parser.add_argument("--batch-dir", type=str, default="build/batches", help="Directory of the batch files.")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Maximum number of requests per batch.")
+    parser.add_argument("--poll-interval", type=float, default=30, help="First interval between two batch polls.")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    processed_results = process_dataset(ds)
+    args = parse_arguments()
+    dataset = load_samples(args.source, args.samples, args.seed, args.split, args.limit)
+    print(f"Sampled {len(dataset)} dialogues from {args.source}")
+    checkpoint = Checkpoint(args.build_dir)
+    try:
+        if args.batch:
+            if args.batch == "openai":
+                backend = OpenAIBatchBackend(OpenAI(api_key=args.api_key, base_url=args.base_url))
+            else:
+                backend = LocalBatchBackend(os.path.join(args.batch_dir, "local"))
+            runner = BatchRunner(backend, args.batch_dir, args.batch_size, args.poll_interval)
+            translator = SystemTranslator(None, args.model, args.translations)
+            processed_results = process_dataset_batch(dataset, runner, checkpoint, translator, args.model)
+        else:
+            client = ChatClient(
+                AsyncOpenAI(api_key=args.api_key, base_url=args.base_url, max_retries=0),
+                RateLimiter(args.rpm, args.tpm),
+                concurrency=args.concurrency,
+                max_retries=args.max_retries,
+                cache=None if args.no_cache else ResponseCache(args.cache_dir),
+            )
+            translator = SystemTranslator(client, args.model, args.translations)
+            processed_results = asyncio.run(process_dataset(dataset, client, checkpoint, translator, args.model))
+    finally:
+        checkpoint.close()
     process_and_split_results(processed_results, train_file="train_results.jsonl", test_file="test_results.jsonl")
@@ -1,12 +1,14 @@
-import json
+import argparse
+
+from jsonl_transform import RemapRoles, transform_file
 
 
 def replace_role_in_jsonl(file_path: str, old_role: str, new_role: str) -> None:
     """
     Replaces occurrences of a specific role with a new role in a JSONL file.
 
-    This function reads a JSONL (JSON Lines) file, replaces all instances of `old_role` with `new_role` in
-    the "role" field of each message, and writes the updated records back to the same file.
+    This function streams a JSONL (JSON Lines) file, replaces all instances of `old_role` with `new_role` in
+    the "role" field of each message, and atomically replaces the file with the updated records.
 
     Args:
         file_path (str): The path to the JSONL file to be processed.
@@ -16,22 +18,27 @@ def replace_role_in_jsonl(file_path: str, old_role: str, new_role: str) -> None:
     Returns:
         None
     """
-    # Read the original JSONL file
-    with open(file_path, "r") as file:
-        lines = file.readlines()
+    transform_file(file_path, file_path, [RemapRoles({old_role: new_role})])
+
 
-    # Replace the role in each line
-    updated_lines = []
-    for line in lines:
-        record = json.loads(line)
-        for message in record.get("messages", []):
-            if message.get("role") == old_role:
-                message["role"] = new_role
-        updated_lines.append(json.dumps(record, ensure_ascii=False))
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
 
-    # Write the updated lines back to the file
-    with open(file_path, "w") as file:
-        file.write("\n".join(updated_lines))
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Replace a message role in JSONL datasets.")
+    parser.add_argument(
+        "paths",
+        type=str,
+        nargs="*",
+        default=["prompts/train_results.jsonl", "prompts/test_results.jsonl"],
+        help="JSONL files to fix in place.",
+    )
+    parser.add_argument("--old-role", type=str, default="function response", help="The role to replace.")
+    parser.add_argument("--new-role", type=str, default="user", help="The role replacing it.")
+    return parser.parse_args()
 
 
 # Replace 'function response' with 'user' in the specified JSONL files
@@ -39,11 +46,9 @@ if __name__ == "__main__":
     """
     Main entry point of the script. Executes the role replacement process for specified JSONL files.
 
-    This script replaces 'function response' with 'user' in the JSONL files located at the specified paths.
+    This script replaces 'function response' with 'user' in the given JSONL files, by default the training
+    datasets. See `jsonl_transform.py` for other fixes.
     """
-    replace_role_in_jsonl(
-        "/Users/matvejsaprykin/Desktop/hacks-alignment/training/train_results.jsonl", "function response", "user"
-    )
-    replace_role_in_jsonl(
-        "/Users/matvejsaprykin/Desktop/hacks-alignment/training/test_results.jsonl", "function response", "user"
-    )
+    args = parse_arguments()
+    for path in args.paths:
+        replace_role_in_jsonl(path, args.old_role, args.new_role)
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional
+
+import torch
+from manifest import upload, write_manifest
+from peft import PeftModel
+from pretokenize import encode_dialogue, read_records, template_settings
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+MAX_SHARD_SIZE = "5GB"
+
+# MAX_SHARD_SIZE: Maximum size of a safetensors shard.
+
+
+def sample_inputs(tokenizer: Any, config: Dict[str, Any], count: int) -> List[List[int]]:
+    """
+    Tokenizes validation dialogues of an experiment config, as the model saw them in training.
+
+    Args:
+        tokenizer (Any): The tokenizer.
+        config (Dict[str, Any]): The experiment config.
+        count (int): Number of dialogues.
+
+    Returns:
+        List[List[int]]: The token ids of the dialogues.
+    """
+    settings = template_settings(config, "val_dataset_settings")
+    inputs = []
+    for record in read_records(settings):
+        if len(inputs) >= count:
+            break
+        encoded = encode_dialogue(tokenizer, record["messages"], settings)
+        if encoded is not None:
+            inputs.append(encoded[0])
+    return inputs
+
+
+@torch.no_grad()
+def predict(model: Any, inputs: List[List[int]], reference: Optional[List[torch.Tensor]] = None) -> List[torch.Tensor]:
+    """
+    Runs the model on every input and keeps, per position, the predicted token and the logit of a token: the
+    predicted one, or the one predicted by the reference. Full logits of a large vocabulary would not fit in
+    memory.
+
+    Args:
+        model (Any): The model.
+        inputs (List[List[int]]): The token ids of the inputs.
+        reference (Optional[List[torch.Tensor]]): The predictions of another model on the same inputs.
+
+    Returns:
+        List[torch.Tensor]: A (2, length) tensor per input, the predicted tokens and the kept logits.
+    """
+    predictions = []
+    for index, ids in enumerate(inputs):
+        logits = model(torch.tensor([ids], device=model.device)).logits[0].float()
+        tokens = logits.argmax(-1)
+        kept = tokens if reference is None else reference[index][0].long().to(logits.device)
+        predictions.append(torch.stack([tokens.float(), logits.gather(-1, kept[:, None])[:, 0]]).cpu())
+    return predictions
+
+
+def compare(adapter: List[torch.Tensor], merged: List[torch.Tensor]) -> Dict[str, float]:
+    """
+    Compares the predictions of the model with the adapter and of the merged model.
+
+    Args:
+        adapter (List[torch.Tensor]): The predictions of the model with the adapter.
+        merged (List[torch.Tensor]): The predictions of the merged model, with the logits of the tokens
+            predicted with the adapter.
+
+    Returns:
+        Dict[str, float]: The share of positions predicting the same token, and the largest difference of the
+        logits of the tokens predicted with the adapter.
+    """
+    agree = sum(int((a[0] == m[0]).sum()) for a, m in zip(adapter, merged))
+    positions = sum(a.shape[1] for a in adapter)
+    difference = max((float((a[1] - m[1]).abs().max()) for a, m in zip(adapter, merged)), default=0.0)
+    return {"prompts": len(adapter), "agreement": agree / max(positions, 1), "max_logit_difference": difference}
+
+
+def export(
+    config: Dict[str, Any],
+    adapter_path: str,
+    output: str,
+    base_path: Optional[str] = None,
+    max_shard_size: str = MAX_SHARD_SIZE,
+    verify: int = 4,
+    min_agreement: float = 0.99,
+) -> Dict[str, Any]:
+    """
+    Merges a LoRA adapter into its base model and saves the merged model as fp16 safetensors shards with their
+    index, the tokenizer and a manifest. The model is written to a temporary directory renamed to `output` once
+    verified, so `output` is never left half written.
+
+    Args:
+        config (Dict[str, Any]): The experiment config the adapter was trained with.
+        adapter_path (str): The adapter checkpoint.
+        output (str): The directory of the merged model.
+        base_path (Optional[str]): The base model, the one of the config if not set.
+        max_shard_size (str): Maximum size of a shard.
+        verify (int): Number of validation dialogues the merged model is checked on.
+        min_agreement (float): Minimum share of positions where the merged model predicts the same token.
+
+    Returns:
+        Dict[str, Any]: The manifest.
+    """
+    base_path = base_path or config["model_settings"]["model_path"]
+    tokenizer = AutoTokenizer.from_pretrained(
+        adapter_path if os.path.isfile(os.path.join(adapter_path, "tokenizer_config.json")) else base_path
+    )
+    model = AutoModelForCausalLM.from_pretrained(
+        base_path, torch_dtype=torch.float16, device_map="auto", low_cpu_mem_usage=True
+    )
+    model = PeftModel.from_pretrained(model, adapter_path)
+    model.eval()
+
+    inputs = sample_inputs(tokenizer, config, verify)
+    adapter_predictions = predict(model, inputs)
+    model = model.merge_and_unload()
+    verification = compare(adapter_predictions, predict(model, inputs, adapter_predictions))
+    print(
+        f"Merged model predicts the same token at {verification['agreement']:.2%} of the positions of "
+        f"{verification['prompts']} dialogues, max logit difference {verification['max_logit_difference']:.4f}"
+    )
+    if verification["agreement"] < min_agreement:
+        raise SystemExit(
+            f"The merged model disagrees with the adapter on more than {1 - min_agreement:.2%} of the tokens"
+        )
+
+    tmp_output = f"{output.rstrip(os.sep)}.partial"
+    shutil.rmtree(tmp_output, ignore_errors=True)
+    model.save_pretrained(tmp_output, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(tmp_output)
+    manifest = write_manifest(
+        tmp_output,
+        {
+            "format": "safetensors",
+            "dtype": "float16",
+            "base_model": base_path,
+            "adapter": adapter_path,
+            "verification": verification,
+        },
+    )
+    shutil.rmtree(output, ignore_errors=True)
+    os.rename(tmp_output, output)
+    return manifest
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Merge a LoRA adapter and export the model for serving.")
+    parser.add_argument(
+        "--config", type=str, default="training/configs/lora.json", help="Experiment config of the adapter."
+    )
+    parser.add_argument("--adapter", type=str, default="train_output/trainer/checkpoint-75", help="Adapter checkpoint.")
+    parser.add_argument("--base", type=str, default=None, help="Base model, the one of the config if not set.")
+    parser.add_argument(
+        "--output", type=str, default="build/merged", help="Directory of the merged model, WEIGHTS_DIR of the server."
+    )
+    parser.add_argument("--max-shard-size", type=str, default=MAX_SHARD_SIZE, help="Maximum size of a shard.")
+    parser.add_argument("--verify", type=int, default=4, help="Number of validation dialogues to verify the merge on.")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Minimum share of the same predicted tokens.")
+    parser.add_argument(
+        "--repo", type=str, default=None, help="Hugging Face repository to upload to, no upload if not set."
+    )
+    parser.add_argument(
+        "--upload-only", action="store_true", help="Upload an exported model without exporting it again."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Merges the adapter of an experiment into its base model, verifies the merged model against the adapter on
+    validation dialogues and exports it for the inference server, which memory-maps it with `WEIGHTS_DIR`
+    set to the output. With `--repo`, the export is then uploaded.
+    """
+    args = parse_arguments()
+    if not args.upload_only:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        manifest = export(
+            config, args.adapter, args.output, args.base, args.max_shard_size, args.verify, args.min_agreement
+        )
+        print(f"Exported {len(manifest['files'])} files to {args.output}")
+    if args.repo:
+        upload(args.output, args.repo)
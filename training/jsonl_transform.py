@@ -0,0 +1,283 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+Record = Dict[str, Any]
+
+# Record: A dialogue of a dataset, `{"id": ..., "source": ..., "messages": [{"role": ..., "content": ...}]}`.
+
+
+@dataclass
+class RemapRoles:
+    """
+    Renames the roles of the messages.
+
+    Attributes:
+        roles (Dict[str, str]): The new role by old role.
+    """
+
+    roles: Dict[str, str]
+
+    def __call__(self, record: Record) -> Optional[Record]:
+        for message in record.get("messages", []):
+            if "role" in message:
+                message["role"] = self.roles.get(message["role"], message["role"])
+        return record
+
+
+@dataclass
+class DropFields:
+    """
+    Removes fields of the records, or of their messages with a "messages." prefix.
+
+    Attributes:
+        fields (List[str]): The fields, e.g. "source" or "messages.name".
+    """
+
+    fields: List[str]
+
+    def __call__(self, record: Record) -> Optional[Record]:
+        for name in self.fields:
+            if name.startswith("messages."):
+                for message in record.get("messages", []):
+                    message.pop(name[len("messages.") :], None)
+            else:
+                record.pop(name, None)
+        return record
+
+
+@dataclass
+class FilterLength:
+    """
+    Keeps the records whose messages have a total length within bounds.
+
+    Attributes:
+        min_chars (int): Minimum total length of the message contents.
+        max_chars (Optional[int]): Maximum total length of the message contents, unbounded if not set.
+    """
+
+    min_chars: int = 0
+    max_chars: Optional[int] = None
+
+    def __call__(self, record: Record) -> Optional[Record]:
+        length = sum(len(str(message.get("content", ""))) for message in record.get("messages", []))
+        if length < self.min_chars or (self.max_chars is not None and length > self.max_chars):
+            return None
+        return record
+
+
+@dataclass
+class FilterSource:
+    """
+    Keeps the records of some sources.
+
+    Attributes:
+        sources (Set[str]): The sources kept.
+    """
+
+    sources: Set[str] = field(default_factory=set)
+
+    def __call__(self, record: Record) -> Optional[Record]:
+        return record if record.get("source") in self.sources else None
+
+
+def apply_rules(record: Record, rules: List[Any]) -> Optional[Record]:
+    """
+    Transforms a record.
+
+    Args:
+        record (Record): The record.
+        rules (List[Any]): The rules, applied in order, each returning the transformed record or None to drop it.
+
+    Returns:
+        Optional[Record]: The transformed record, or None if it is dropped.
+    """
+    for rule in rules:
+        record = rule(record)
+        if record is None:
+            return None
+    return record
+
+
+def chunk_offsets(path: str, chunks: int) -> List[Tuple[int, int]]:
+    """
+    Splits a file into byte ranges of about the same size that start and end at line boundaries.
+
+    Args:
+        path (str): The file.
+        chunks (int): Number of ranges.
+
+    Returns:
+        List[Tuple[int, int]]: The start and end offsets of the non-empty ranges, in file order.
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, "rb") as f:
+        for index in range(1, chunks):
+            f.seek(max(offsets[-1], size * index // chunks))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+def transform_chunk(path: str, start: int, end: int, rules: List[Any], directory: str) -> Tuple[str, List[Any], int]:
+    """
+    Transforms the lines of a byte range of a file into a part file.
+
+    Args:
+        path (str): The input file.
+        start (int): The offset of the first line.
+        end (int): The offset after the last line.
+        rules (List[Any]): The rules.
+        directory (str): The directory of the part file.
+
+    Returns:
+        Tuple[str, List[Any], int]: The part file, the ids of its records and the number of lines read.
+    """
+    ids, read = [], 0
+    with open(path, "rb") as source, tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, delete=False
+    ) as part:
+        source.seek(start)
+        while source.tell() < end:
+            line = source.readline().decode("utf-8")
+            if not line.strip():
+                continue
+            read += 1
+            record = apply_rules(json.loads(line), rules)
+            if record is not None:
+                part.write(json.dumps(record, ensure_ascii=False) + "\n")
+                ids.append(record.get("id"))
+    return part.name, ids, read
+
+
+def transform_file(
+    input_path: str, output_path: str, rules: List[Any], dedupe: bool = False, workers: int = 1
+) -> Dict[str, int]:
+    """
+    Transforms a JSONL file record by record, with memory independent of the file size. The output is written
+    to a temporary file renamed over `output_path` once complete, so `output_path` may be `input_path` and is
+    never left half written.
+
+    With several workers, the file is split into one range per worker, transformed in parallel into part files
+    that are concatenated in order. Records are deduplicated by id while concatenating, keeping the first; records
+    without an id are always kept.
+
+    Args:
+        input_path (str): The input file.
+        output_path (str): The output file.
+        rules (List[Any]): The rules, applied in order, each returning the transformed record or None to drop it.
+        dedupe (bool): Drop the records whose id was already written, records without an id are kept.
+        workers (int): Number of processes.
+
+    Returns:
+        Dict[str, int]: The numbers of records read, dropped by the rules, dropped as duplicates and written.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    ranges = chunk_offsets(input_path, max(workers, 1))
+    stats = {"read": 0, "dropped": 0, "duplicates": 0, "written": 0}
+    seen: Set[Any] = set()
+    parts = tempfile.TemporaryDirectory(dir=directory, prefix=".transform-")
+    executor = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+    if executor:
+        chunks = executor.map(
+            transform_chunk, *zip(*[(input_path, start, end, rules, parts.name) for start, end in ranges])
+        )
+    else:
+        chunks = (transform_chunk(input_path, start, end, rules, parts.name) for start, end in ranges)
+
+    output = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False)
+    try:
+        with output:
+            for part, ids, read in chunks:
+                stats["read"] += read
+                stats["dropped"] += read - len(ids)
+                with open(part, "r", encoding="utf-8") as f:
+                    for line, record_id in zip(f, ids):
+                        if dedupe and record_id is not None:
+                            if record_id in seen:
+                                stats["duplicates"] += 1
+                                continue
+                            seen.add(record_id)
+                        output.write(line)
+                        stats["written"] += 1
+                os.remove(part)
+            output.flush()
+            os.fsync(output.fileno())
+        shutil.copymode(input_path, output.name)
+        os.replace(output.name, output_path)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        parts.cleanup()
+        if os.path.exists(output.name):
+            os.remove(output.name)
+    return stats
+
+
+def build_rules(args: argparse.Namespace) -> List[Any]:
+    """
+    Builds the rules given on the command line, in the order role remap, field drop, length and source filters.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        List[Any]: The rules.
+    """
+    rules: List[Any] = []
+    if args.remap_role:
+        rules.append(RemapRoles(dict(mapping.split("=", 1) for mapping in args.remap_role)))
+    if args.drop_field:
+        rules.append(DropFields(args.drop_field))
+    if args.min_chars or args.max_chars is not None:
+        rules.append(FilterLength(args.min_chars, args.max_chars))
+    if args.source:
+        rules.append(FilterSource(set(args.source)))
+    return rules
+
+
+def parse_arguments(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Args:
+        argv (Optional[Iterable[str]]): The arguments, those of the command line if not set.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Transform JSONL dialogue datasets in a streaming pass.")
+    parser.add_argument("paths", type=str, nargs="+", help="JSONL files to transform.")
+    parser.add_argument("--output", type=str, default=None, help="Output file for a single input, in place if not set.")
+    parser.add_argument(
+        "--remap-role", type=str, action="append", default=[], help="Role rename as old=new, repeatable."
+    )
+    parser.add_argument(
+        "--drop-field", type=str, action="append", default=[], help="Field to drop, e.g. messages.name, repeatable."
+    )
+    parser.add_argument("--min-chars", type=int, default=0, help="Drop dialogues shorter than this many characters.")
+    parser.add_argument("--max-chars", type=int, default=None, help="Drop dialogues longer than this many characters.")
+    parser.add_argument("--source", type=str, action="append", default=[], help="Source to keep, repeatable.")
+    parser.add_argument("--dedupe", action="store_true", help="Keep only the first dialogue of every id.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes transforming chunks in parallel.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    """
+    Applies the rules given on the command line to every file, in place unless `--output` is set.
+    """
+    args = parse_arguments()
+    if args.output and len(args.paths) > 1:
+        raise SystemExit("--output only applies to a single input file")
+    rules = build_rules(args)
+    for path in args.paths:
+        stats = transform_file(path, args.output or path, rules, args.dedupe, args.workers)
+        print(f"{path}: " + ", ".join(f"{name}={count}" for name, count in stats.items()))
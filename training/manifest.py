@@ -0,0 +1,68 @@
+import datetime
+import json
+import os
+from typing import Any, Dict
+
+from pretokenize import file_digest
+
+MANIFEST = "manifest.json"
+
+# MANIFEST: Name of the manifest of an exported model, checked by the inference server before it loads the weights.
+
+
+def write_manifest(directory: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Lists the files of an exported model with their sizes and hashes.
+
+    Args:
+        directory (str): The exported model.
+        metadata (Dict[str, Any]): What the model was exported from and how it was verified.
+
+    Returns:
+        Dict[str, Any]: The manifest.
+    """
+    files = [
+        {
+            "path": name,
+            "size": os.path.getsize(os.path.join(directory, name)),
+            "sha256": file_digest(os.path.join(directory, name)),
+        }
+        for name in sorted(os.listdir(directory))
+        if name != MANIFEST
+    ]
+    manifest = {**metadata, "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), "files": files}
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def upload(directory: str, repo_id: str, private: bool = True) -> None:
+    """
+    Uploads an exported model to the Hugging Face Hub one file per commit, skipping the weights already
+    uploaded with the same hash, so that an interrupted upload resumes where it stopped. Large files are sent
+    in chunks by the LFS multipart transfer. The manifest is always uploaded, last, and marks the upload
+    complete.
+
+    Args:
+        directory (str): The exported model.
+        repo_id (str): The model repository.
+        private (bool): Create the repository as private.
+    """
+    from huggingface_hub import HfApi
+
+    api = HfApi()
+    api.create_repo(repo_id=repo_id, exist_ok=True, private=private)
+    uploaded = {item.path: item.lfs.sha256 for item in api.list_repo_tree(repo_id) if getattr(item, "lfs", None)}
+    with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    for file in manifest["files"] + [{"path": MANIFEST, "sha256": None}]:
+        if file["sha256"] and uploaded.get(file["path"]) == file["sha256"]:
+            print(f"{file['path']} already uploaded")
+            continue
+        api.upload_file(
+            path_or_fileobj=os.path.join(directory, file["path"]),
+            path_in_repo=file["path"],
+            repo_id=repo_id,
+            commit_message=f"Upload {file['path']}",
+        )
+        print(f"{file['path']} uploaded")
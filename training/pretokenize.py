@@ -0,0 +1,394 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+CACHE_VERSION = 1
+IGNORE_INDEX = -100
+BUCKET_BATCHES = 50
+
+# CACHE_VERSION: Version of the cache layout, part of the cache key.
+# IGNORE_INDEX: Label of the tokens without loss.
+# BUCKET_BATCHES: Number of batches of a random megabatch sorted by length by the bucketing sampler.
+
+
+def template_settings(config: Dict[str, Any], split: str) -> Dict[str, Any]:
+    """
+    Extracts what determines the tokens of a dataset from an experiment config.
+
+    Args:
+        config (Dict[str, Any]): The experiment config, e.g. `training/configs/sft.json`.
+        split (str): The dataset settings, e.g. "train_dataset_settings".
+
+    Returns:
+        Dict[str, Any]: The sources, the prompt template, the token limit and the loss masking.
+    """
+    settings = config[split]
+    return {
+        "sources": [
+            {"path": source["records_path"], "num_samples": source["num_samples"]} for source in settings["sources"]
+        ],
+        "prompt_template": settings["prompt_template"],
+        "max_tokens_count": settings["max_tokens_count"],
+        "only_answer_loss": settings.get("only_answer_loss", False),
+    }
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(tokenizer: Any, settings: Dict[str, Any]) -> str:
+    """
+    Hashes the tokenizer, the template settings and the contents of the sources.
+
+    Args:
+        tokenizer (Any): The tokenizer.
+        settings (Dict[str, Any]): The template settings.
+
+    Returns:
+        str: The hex digest identifying the tokenized dataset.
+    """
+    vocabulary = hashlib.sha256(json.dumps(sorted(tokenizer.get_vocab().items())).encode()).hexdigest()
+    key = {
+        "version": CACHE_VERSION,
+        "tokenizer": [type(tokenizer).__name__, vocabulary, tokenizer.bos_token_id],
+        "settings": settings,
+        "sources": [file_digest(source["path"]) for source in settings["sources"]],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def read_records(settings: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for source in settings["sources"]:
+        with open(source["path"], "r", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                if index >= source["num_samples"]:
+                    break
+                yield json.loads(line)
+
+
+def encode_dialogue(
+    tokenizer: Any, messages: List[Dict[str, str]], settings: Dict[str, Any]
+) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    Applies the chat template to a dialogue and tokenizes it, message by message. The dialogue is cut after
+    the last bot message that fits in the token limit.
+
+    Args:
+        tokenizer (Any): The tokenizer.
+        messages (List[Dict[str, str]]): The messages, `{"role": ..., "content": ...}`.
+        settings (Dict[str, Any]): The template settings.
+
+    Returns:
+        Optional[Tuple[List[int], List[int]]]: The token ids and the loss mask, or None if not even the first
+        answer fits.
+    """
+    template = settings["prompt_template"]
+    ids = [tokenizer.bos_token_id] if tokenizer.bos_token_id is not None else []
+    mask = [0] * len(ids)
+    fitting = None
+    for message in messages:
+        role = template["role_tag_mapping"].get(message["role"], message["role"])
+        prefix = tokenizer.encode(template["prefix_template"].format(role=role), add_special_tokens=False)
+        body = tokenizer.encode(message["content"] + template["suffix_template"], add_special_tokens=False)
+        learned = message["role"] == "bot" or not settings["only_answer_loss"]
+        ids += prefix + body
+        mask += [0 if settings["only_answer_loss"] else 1] * len(prefix) + [int(learned)] * len(body)
+        if len(ids) > settings["max_tokens_count"]:
+            break
+        if message["role"] == "bot":
+            fitting = len(ids)
+    if fitting is None:
+        return None
+    return ids[:fitting], mask[:fitting]
+
+
+def build_cache(tokenizer: Any, settings: Dict[str, Any], directory: str) -> Dict[str, Any]:
+    """
+    Tokenizes the dialogues of a dataset into flat arrays: the token ids, the loss mask and the offsets of
+    the dialogues. The arrays are written to a temporary directory renamed into place once complete.
+
+    Args:
+        tokenizer (Any): The tokenizer.
+        settings (Dict[str, Any]): The template settings.
+        directory (str): The directory of the cached dataset.
+
+    Returns:
+        Dict[str, Any]: The metadata of the cached dataset.
+    """
+    ids: List[int] = []
+    mask: List[int] = []
+    offsets = [0]
+    dropped = 0
+    for record in read_records(settings):
+        encoded = encode_dialogue(tokenizer, record["messages"], settings)
+        if encoded is None:
+            dropped += 1
+            continue
+        ids += encoded[0]
+        mask += encoded[1]
+        offsets.append(len(ids))
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(dir=parent, prefix=".tokenize-")
+    dtype = np.int32 if len(tokenizer) < 2**31 else np.int64
+    np.save(os.path.join(tmp_directory, "input_ids.npy"), np.asarray(ids, dtype=dtype))
+    np.save(os.path.join(tmp_directory, "loss_mask.npy"), np.asarray(mask, dtype=np.uint8))
+    np.save(os.path.join(tmp_directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    meta = {"settings": settings, "dialogues": len(offsets) - 1, "dropped": dropped, "tokens": len(ids)}
+    with open(os.path.join(tmp_directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        shutil.rmtree(tmp_directory)
+    return meta
+
+
+class PretokenizedDataset:
+    """
+    Tokenized dialogues memory-mapped from the cache, so that training starts without tokenizing and the
+    workers share the pages of the arrays.
+
+    Attributes:
+        directory (str): The directory of the cached dataset.
+        input_ids (np.ndarray): The token ids of all the dialogues, one after the other.
+        loss_mask (np.ndarray): Whether every token is learned.
+        offsets (np.ndarray): The start of every dialogue and the end of the last one.
+        meta (Dict[str, Any]): The metadata of the cached dataset.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.input_ids = np.load(os.path.join(directory, "input_ids.npy"), mmap_mode="r")
+        self.loss_mask = np.load(os.path.join(directory, "loss_mask.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"))
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+    @classmethod
+    def load(cls, tokenizer: Any, settings: Dict[str, Any], cache_dir: str) -> "PretokenizedDataset":
+        """
+        Opens the cached dataset of a tokenizer and template settings, tokenizing it on the first use.
+
+        Args:
+            tokenizer (Any): The tokenizer.
+            settings (Dict[str, Any]): The template settings.
+            cache_dir (str): The directory of the cached datasets.
+
+        Returns:
+            PretokenizedDataset: The dataset.
+        """
+        directory = os.path.join(cache_dir, cache_key(tokenizer, settings))
+        if not os.path.exists(directory):
+            build_cache(tokenizer, settings, directory)
+        return cls(directory)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def __len__(self) -> int:
+        """Returns the number of dialogues."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        """Returns the input ids of a dialogue and its labels, the ignored index where there is no loss."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        input_ids = np.asarray(self.input_ids[start:end], dtype=np.int64)
+        labels = np.where(self.loss_mask[start:end] == 1, input_ids, IGNORE_INDEX)
+        return {"input_ids": input_ids, "labels": labels}
+
+
+def random_batches(lengths: np.ndarray, batch_size: int, seed: int) -> List[List[int]]:
+    indices = list(range(len(lengths)))
+    random.Random(seed).shuffle(indices)
+    return [indices[start : start + batch_size] for start in range(0, len(indices), batch_size)]
+
+
+def bucket_batches(lengths: np.ndarray, batch_size: int, seed: int) -> List[List[int]]:
+    """
+    Groups dialogues of similar lengths into batches: the shuffled dialogues are split into megabatches of
+    `BUCKET_BATCHES` batches, sorted by length within every megabatch, and the batches are shuffled. The
+    order stays random across epochs while the batches need little padding.
+
+    Args:
+        lengths (np.ndarray): The lengths of the dialogues.
+        batch_size (int): Number of dialogues per batch.
+        seed (int): The seed of the order.
+
+    Returns:
+        List[List[int]]: The indices of the dialogues of every batch.
+    """
+    rng = random.Random(seed)
+    indices = list(range(len(lengths)))
+    rng.shuffle(indices)
+    size = batch_size * BUCKET_BATCHES
+    batches = []
+    for start in range(0, len(indices), size):
+        megabatch = sorted(indices[start : start + size], key=lambda index: -lengths[index])
+        batches += [megabatch[offset : offset + batch_size] for offset in range(0, len(megabatch), batch_size)]
+    rng.shuffle(batches)
+    return batches
+
+
+class BucketSampler:
+    """
+    Orders the dialogues of an epoch in the batches of `bucket_batches`, for a data loader of the same batch
+    size. The only batch that may be partial goes last, so that the loader cuts the same batches.
+
+    Attributes:
+        lengths (np.ndarray): The lengths of the dialogues.
+        batch_size (int): Number of dialogues per batch.
+        seed (int): The seed of the order, offset by the epoch.
+        epoch (int): The current epoch, set by the trainer.
+    """
+
+    def __init__(self, lengths: np.ndarray, batch_size: int, seed: int):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[int]:
+        """Yields the indices of the dialogues, batch after batch."""
+        batches = bucket_batches(self.lengths, self.batch_size, self.seed + self.epoch)
+        batches.sort(key=lambda batch: len(batch) < self.batch_size)
+        return (index for batch in batches for index in batch)
+
+    def __len__(self) -> int:
+        """Returns the number of dialogues."""
+        return len(self.lengths)
+
+
+def pack_sequences(lengths: np.ndarray, max_length: int) -> List[List[int]]:
+    """
+    Packs dialogues into sequences of at most `max_length` tokens, first fit in decreasing length order.
+
+    Args:
+        lengths (np.ndarray): The lengths of the dialogues, each at most `max_length`.
+        max_length (int): The length of a packed sequence.
+
+    Returns:
+        List[List[int]]: The indices of the dialogues of every packed sequence.
+    """
+    packs: List[List[int]] = []
+    free: List[int] = []
+    for index in sorted(range(len(lengths)), key=lambda index: -lengths[index]):
+        length = int(lengths[index])
+        for position, space in enumerate(free):
+            if space >= length:
+                packs[position].append(index)
+                free[position] -= length
+                break
+        else:
+            packs.append([index])
+            free.append(max_length - length)
+    return packs
+
+
+def collate(items: List[Dict[str, np.ndarray]], pad_token_id: int) -> Dict[str, np.ndarray]:
+    """
+    Pads a batch of dialogues to its longest one.
+
+    Args:
+        items (List[Dict[str, np.ndarray]]): The dialogues of the batch, items of a `PretokenizedDataset`.
+        pad_token_id (int): The padding token.
+
+    Returns:
+        Dict[str, np.ndarray]: The input ids, labels and attention mask of the batch.
+    """
+    width = max(len(item["input_ids"]) for item in items)
+    batch = {
+        "input_ids": np.full((len(items), width), pad_token_id, dtype=np.int64),
+        "labels": np.full((len(items), width), IGNORE_INDEX, dtype=np.int64),
+        "attention_mask": np.zeros((len(items), width), dtype=np.int64),
+    }
+    for row, item in enumerate(items):
+        length = len(item["input_ids"])
+        batch["input_ids"][row, :length] = item["input_ids"]
+        batch["labels"][row, :length] = item["labels"]
+        batch["attention_mask"][row, :length] = 1
+    return batch
+
+
+def padding_report(lengths: np.ndarray, batch_size: int, max_length: int, seed: int) -> List[Tuple[str, int, int]]:
+    """
+    Counts the token slots of an epoch with every batching strategy.
+
+    Args:
+        lengths (np.ndarray): The lengths of the dialogues.
+        batch_size (int): Number of dialogues per batch.
+        max_length (int): The token limit of the dialogues.
+        seed (int): The seed of the order.
+
+    Returns:
+        List[Tuple[str, int, int]]: The name of every strategy, its token slots and its real tokens.
+    """
+    tokens = int(lengths.sum())
+    report = [("pad to max_tokens_count", len(lengths) * max_length, tokens)]
+    for name, batches in (
+        ("random batches", random_batches(lengths, batch_size, seed)),
+        ("length buckets", bucket_batches(lengths, batch_size, seed)),
+    ):
+        report.append((name, sum(len(batch) * int(max(lengths[batch])) for batch in batches), tokens))
+    packs = pack_sequences(lengths, max_length)
+    report.append(("packed", sum(int(lengths[pack].sum()) for pack in packs), tokens))
+    report.append(("packed, padded to max", len(packs) * max_length, tokens))
+    return report
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Tokenize the training datasets once into a memory-mapped cache.")
+    parser.add_argument("--config", type=str, default="training/configs/sft.json", help="Experiment config.")
+    parser.add_argument("--tokenizer", type=str, default=None, help="Tokenizer, the model of the config if not set.")
+    parser.add_argument("--cache-dir", type=str, default="build/tokenized", help="Directory of the cached datasets.")
+    parser.add_argument("--batch-size", type=int, default=None, help="Batch size, that of the config if not set.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the batch order.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Tokenizes the train and validation datasets of an experiment config into the cache, unless they are
+    already cached for the same tokenizer, template and records, and reports the padding of every batching
+    strategy. `run.py --cache-dir` trains on the cached datasets with the length buckets.
+    """
+    args = parse_arguments()
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer or config["model_settings"]["model_path"])
+    batch_size = args.batch_size or config["trainer_settings"]["per_device_train_batch_size"]
+    for split in ("train_dataset_settings", "val_dataset_settings"):
+        settings = template_settings(config, split)
+        dataset = PretokenizedDataset.load(tokenizer, settings, args.cache_dir)
+        meta = dataset.meta
+        print(f"{split}: {dataset.directory}")
+        print(f"  {meta['dialogues']} dialogues, {meta['dropped']} over the token limit, {meta['tokens']} tokens")
+        print(f"  {'batching (size ' + str(batch_size) + ')':<26} {'slots':>9} {'padding':>8}")
+        for name, slots, tokens in padding_report(dataset.lengths, batch_size, settings["max_tokens_count"], args.seed):
+            print(f"  {name:<26} {slots:>9} {1 - tokens / max(slots, 1):>8.1%}")
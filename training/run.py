@@ -1,9 +1,20 @@
 import argparse
+import functools
+import json
 import os
-import subprocess
 from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
 
+import numpy as np
 import torch
+from pretokenize import BucketSampler, PretokenizedDataset, collate, template_settings
+from step_metrics import StepMetrics, observe_training_steps
+from turbo_alignment import pipelines
+from turbo_alignment.settings import pipelines as pipeline_settings
+
+ATTN_IMPLEMENTATIONS = {"eager", "sdpa", "flash_attention_2"}
+
+# ATTN_IMPLEMENTATIONS: The values of `attn_implementation` supported by transformers.
 
 
 @contextmanager
@@ -35,6 +46,107 @@ def configure_environment():
         os.environ["TOKENIZERS_PARALLELISM"] = "true"
 
 
+def validate_config(config: Dict[str, Any]) -> List[str]:
+    """
+    Checks what an experiment config needs before the model is loaded.
+
+    Args:
+        config (Dict[str, Any]): The experiment config.
+
+    Returns:
+        List[str]: The problems found, empty if the config is runnable.
+    """
+    problems = []
+    for split in ("train_dataset_settings", "val_dataset_settings"):
+        for source in config.get(split, {}).get("sources", []):
+            if not os.path.isfile(source["records_path"]):
+                problems.append(f"{split}: missing records {source['records_path']}")
+    attn_implementation = config["model_settings"].get("model_kwargs", {}).get("attn_implementation")
+    if attn_implementation is not None and attn_implementation not in ATTN_IMPLEMENTATIONS:
+        problems.append(f"model_settings: unknown attn_implementation {attn_implementation}")
+    if attn_implementation == "flash_attention_2" and not torch.cuda.is_available():
+        problems.append("model_settings: flash_attention_2 needs a CUDA device")
+    trainer_settings = config.get("trainer_settings", {})
+    if (trainer_settings.get("fp16") or trainer_settings.get("bf16")) and not torch.cuda.is_available():
+        problems.append("trainer_settings: fp16 and bf16 need a CUDA device")
+    return problems
+
+
+def collate_tensors(items: List[Dict[str, np.ndarray]], pad_token_id: int) -> Dict[str, torch.Tensor]:
+    return {key: torch.from_numpy(value) for key, value in collate(items, pad_token_id).items()}
+
+
+def use_pretokenized(trainer: Any, tokenizer: Any, config: Dict[str, Any], cache_dir: str) -> None:
+    """
+    Makes a trainer read the datasets of an experiment config from the cache of `pretokenize.py`, tokenizing
+    them on the first use, and batch the training dialogues by length, padding every batch to its longest
+    dialogue only.
+
+    Args:
+        trainer (Any): The `transformers.Trainer`.
+        tokenizer (Any): The tokenizer of the trainer, with its special tokens.
+        config (Dict[str, Any]): The experiment config.
+        cache_dir (str): The directory of the cached datasets.
+    """
+    train_dataset = PretokenizedDataset.load(tokenizer, template_settings(config, "train_dataset_settings"), cache_dir)
+    val_dataset = PretokenizedDataset.load(tokenizer, template_settings(config, "val_dataset_settings"), cache_dir)
+    sampler = BucketSampler(train_dataset.lengths, trainer.args.train_batch_size, trainer.args.seed)
+
+    trainer.train_dataset = train_dataset
+    trainer.eval_dataset = val_dataset
+    trainer.data_collator = functools.partial(collate_tensors, pad_token_id=tokenizer.pad_token_id)
+    trainer._get_train_sampler = lambda *args, **kwargs: sampler
+
+
+class InstrumentedSFTStrategy(pipelines.TrainSFTStrategy):
+    """
+    The SFT pipeline of turbo_alignment, with the steps of its trainer measured. With a cache directory, the
+    trainer reads the pretokenized datasets in length-bucketed batches instead of the padded ones of the
+    pipeline.
+
+    Attributes:
+        metrics (StepMetrics): The step metrics.
+        config (Optional[Dict[str, Any]]): The experiment config, needed with a cache directory.
+        cache_dir (Optional[str]): The directory of the cached datasets, the pipeline datasets if not set.
+    """
+
+    def __init__(self, metrics: StepMetrics, config: Optional[Dict[str, Any]] = None, cache_dir: Optional[str] = None):
+        super().__init__()
+        self.metrics = metrics
+        self.config = config
+        self.cache_dir = cache_dir
+
+    def _get_trainer(self, *args: Any, **kwargs: Any) -> Any:
+        trainer = super()._get_trainer(*args, **kwargs)
+        if self.cache_dir and self.config:
+            use_pretokenized(trainer, self.tokenizer, self.config, self.cache_dir)
+        observe_training_steps(trainer, self.metrics)
+        return trainer
+
+
+def train(config_path: str, metrics_path: Optional[str] = None, cache_dir: Optional[str] = None) -> None:
+    """
+    Validates an experiment config and trains in this process, so that the backend settings apply to the
+    training.
+
+    Args:
+        config_path (str): The experiment config.
+        metrics_path (Optional[str]): The JSONL log of the steps, `step_metrics.jsonl` of the log path of the
+            config if not set.
+        cache_dir (Optional[str]): The directory of the datasets tokenized by `pretokenize.py`, trained on in
+            length-bucketed batches. The datasets of the pipeline, padded by its collator, if not set.
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    problems = validate_config(config)
+    if problems:
+        raise SystemExit("Invalid config:\n" + "\n".join(problems))
+    experiment_settings = pipeline_settings.SftTrainExperimentSettings.parse_file(config_path)
+    metrics = StepMetrics(metrics_path or os.path.join(config["log_path"], "step_metrics.jsonl"))
+    with configure_environment():
+        InstrumentedSFTStrategy(metrics, config, cache_dir).run(experiment_settings)
+
+
 def parse_arguments() -> argparse.Namespace:
     """
     Parses command-line arguments.
@@ -44,13 +156,21 @@ def parse_arguments() -> argparse.Namespace:
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", type=str, required=True, help="Path to the configuration file.")
+    parser.add_argument("--metrics-path", type=str, default=None, help="JSONL log of the training steps.")
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Train on the datasets cached by pretokenize.py, bucketed by length.",
+    )
     return parser.parse_args()
 
 
-# Run the original command
 if __name__ == "__main__":
+    """
+    Trains with turbo_alignment in this process, logging the throughput of every step. With `--cache-dir`,
+    e.g. `build/tokenized`, the datasets are read from the cache of `pretokenize.py`. See `bench_attention.py`
+    to compare the attention implementations.
+    """
     args = parse_arguments()
-    torch.backends.cuda.enable_mem_efficient_sdp(False)
-    torch.backends.cuda.enable_flash_sdp(False)
-    launch_code = f"poetry run python -m turbo_alignment train_sft --experiment_settings_path {args.config}"
-    subprocess.run(launch_code, shell=True)  # noqa: S602
+    train(args.config, args.metrics_path, args.cache_dir)
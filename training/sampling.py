@@ -0,0 +1,123 @@
+import itertools
+import json
+import math
+import os
+import random
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+COLUMNS = ["system", "chat"]
+BATCH_SIZE = 1024
+
+# COLUMNS: The columns of the glaive samples read from the source.
+# BATCH_SIZE: Number of rows decoded at once from a local Arrow or Parquet copy.
+
+
+def reservoir_sample(items: Iterable[T], size: int, seed: int) -> List[T]:
+    """
+    Draws a uniform sample of a stream of unknown length in one pass, holding only the sample in memory.
+    Uses Algorithm L, which draws a random number per accepted item rather than per item.
+
+    Args:
+        items (Iterable[T]): The stream.
+        size (int): The sample size, the whole stream is returned if it is shorter.
+        seed (int): The seed, the same seed and stream give the same sample.
+
+    Returns:
+        List[T]: The sampled items, in the order of the stream.
+    """
+    if size <= 0:
+        return []
+    rng = random.Random(seed)
+    reservoir: List[Any] = []
+    weight = math.exp(math.log(rng.random()) / size)
+    next_index = size + int(math.log(rng.random()) / math.log(1 - weight))
+    for index, item in enumerate(items):
+        if index < size:
+            reservoir.append((index, item))
+        elif index == next_index:
+            reservoir[rng.randrange(size)] = (index, item)
+            weight *= math.exp(math.log(rng.random()) / size)
+            next_index += 1 + int(math.log(rng.random()) / math.log(1 - weight))
+    return [item for _, item in sorted(reservoir, key=lambda entry: entry[0])]
+
+
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield {column: record[column] for column in COLUMNS}
+
+
+def iter_arrow(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads a local Parquet or Arrow IPC copy of the source, memory-mapped and decoded batch by batch.
+
+    Args:
+        path (str): The path of the `.parquet` or `.arrow` file.
+
+    Yields:
+        Dict[str, Any]: The samples.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.endswith(".parquet"):
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=BATCH_SIZE, columns=COLUMNS)
+        for batch in batches:
+            yield from batch.to_pylist()
+        return
+    with pa.memory_map(path, "r") as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            source.seek(0)
+            batches = pa.ipc.open_stream(source)
+        for batch in batches:
+            yield from batch.select(COLUMNS).to_pylist()
+
+
+def iter_hub(name: str, split: str) -> Iterator[Dict[str, Any]]:
+    from datasets import load_dataset
+
+    for record in load_dataset(name, split=split, streaming=True):
+        yield {column: record[column] for column in COLUMNS}
+
+
+def iter_source(source: str, split: str = "train") -> Iterator[Dict[str, Any]]:
+    """
+    Streams the samples of a source without materializing it.
+
+    Args:
+        source (str): A local `.jsonl`, `.parquet` or `.arrow` copy, or the name of a Hugging Face dataset.
+        split (str): The split of a Hugging Face dataset.
+
+    Returns:
+        Iterator[Dict[str, Any]]: The samples with their system prompt and chat.
+    """
+    if os.path.exists(source):
+        return iter_jsonl(source) if source.endswith(".jsonl") else iter_arrow(source)
+    return iter_hub(source, split)
+
+
+def load_samples(source: str, size: int, seed: int, split: str = "train", limit: Optional[int] = None) -> List[Any]:
+    """
+    Draws a deterministic sample of a source in one streaming pass, with memory bounded by the sample size.
+
+    Args:
+        source (str): A local copy or the name of a Hugging Face dataset.
+        size (int): The sample size.
+        seed (int): The seed of the sample.
+        split (str): The split of a Hugging Face dataset.
+        limit (Optional[int]): Number of leading samples of the source to sample from, all if not set.
+
+    Returns:
+        List[Any]: The sampled samples, in the order of the source.
+    """
+    items = iter_source(source, split)
+    if limit is not None:
+        items = itertools.islice(items, limit)
+    return reservoir_sample(items, size, seed)
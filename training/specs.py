@@ -0,0 +1,257 @@
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(
+    r"""\s*(?:
+        (?P<punct>[{}\[\]:,])
+        |(?P<quote>["'])
+        |(?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)(?![^\s{}\[\]:,"'])
+        |(?P<word>[^\s{}\[\]:,"']+(?:[ \t]+[^\s{}\[\]:,"']+)*)
+    )""",
+    re.VERBOSE,
+)
+STRING_PATTERNS = {
+    '"': re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL),
+    "'": re.compile(r"(?:[^'\\]|\\.)*'", re.DOTALL),
+}
+CLOSING_PATTERN = re.compile(r"\s*(?:[,:}\]]|$)")
+ESCAPE_PATTERN = re.compile(r"\\(?:u(?P<code>[0-9a-fA-F]{4})|(?P<char>.))", re.DOTALL)
+SEPARATOR_PATTERN = re.compile(r"[\s,]*")
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+# TOKEN_PATTERN: One token of a pseudo-JSON spec after optional whitespace: a punctuation, the opening quote of a
+#   string, a number, or a bare word such as an unquoted key, a literal or unquoted text.
+# STRING_PATTERNS: The body of a string up to the next unescaped quote of the same kind, by opening quote.
+# CLOSING_PATTERN: What may follow the closing quote of a string. A quote followed by anything else, e.g. the
+#   apostrophe of "user's", is part of the string.
+# ESCAPE_PATTERN: A backslash escape in a string. Unknown escapes, e.g. "\'", stand for the escaped character.
+# SEPARATOR_PATTERN: Whitespace and commas between concatenated top-level specs.
+# ESCAPES: The characters of the JSON escapes other than unicode escapes and escaped characters.
+# LITERALS: The JSON and Python literals, which glaive specs mix.
+
+Token = Tuple[str, Any]
+
+
+def unescape(body: str) -> str:
+    """
+    Decodes the escapes of a string body leniently, keeping unknown escapes as the escaped character.
+
+    Args:
+        body (str): The string between its quotes.
+
+    Returns:
+        str: The decoded string.
+    """
+    if "\\" not in body:
+        return body
+
+    def replace(match: re.Match) -> str:
+        if match["code"] is not None:
+            return chr(int(match["code"], 16))
+        return ESCAPES.get(match["char"], match["char"])
+
+    text = ESCAPE_PATTERN.sub(replace, body)
+    if any("\ud800" <= char <= "\udfff" for char in text):
+        text = text.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+    return text
+
+
+def tokenize(text: str) -> Iterator[Token]:
+    """
+    Splits a pseudo-JSON text into tokens in one pass. A string ends at the first unescaped quote of its
+    kind that is followed by a punctuation or the end of the text, so single-quoted strings may contain
+    apostrophes and double-quoted strings may contain unescaped quotes.
+
+    Args:
+        text (str): The text.
+
+    Yields:
+        Token: The kind of every token, "punct", "string" or "value", and its text or value.
+    """
+    position = 0
+    while True:
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None:
+            return
+        position = match.end()
+        kind = match.lastgroup
+        if kind == "punct":
+            yield "punct", match["punct"]
+        elif kind == "quote":
+            start = position
+            pattern = STRING_PATTERNS[match["quote"]]
+            while True:
+                body = pattern.match(text, position)
+                if body is None:
+                    position = len(text)
+                    yield "string", unescape(text[start:])
+                    break
+                position = body.end()
+                if CLOSING_PATTERN.match(text, position):
+                    yield "string", unescape(text[start : position - 1])
+                    break
+        elif kind == "number":
+            number = match["number"]
+            yield "value", float(number) if any(char in number for char in ".eE") else int(number)
+        else:
+            word = match["word"]
+            yield "value", LITERALS.get(word, word)
+
+
+class LenientParser:
+    """
+    Recursive descent parser of the tokens of a pseudo-JSON text that recovers from the mistakes of the
+    glaive specs: bare keys and values, missing or trailing commas, and unclosed brackets at the end.
+    """
+
+    def __init__(self, text: str):
+        self._tokens = tokenize(text)
+        self._token: Optional[Token] = None
+        self._advance()
+
+    def values(self) -> List[Any]:
+        """
+        Parses the concatenated top-level values of the text.
+
+        Returns:
+            List[Any]: The values.
+        """
+        values = []
+        while self._token is not None:
+            if self._token[0] == "punct" and self._token[1] in ",:}]":
+                self._advance()
+                continue
+            values.append(self._value())
+        return values
+
+    def _advance(self) -> None:
+        self._token = next(self._tokens, None)
+
+    def _value(self) -> Any:
+        kind, value = self._token
+        self._advance()
+        if (kind, value) == ("punct", "{"):
+            return self._object()
+        if (kind, value) == ("punct", "["):
+            return self._array()
+        return value
+
+    def _object(self) -> dict:
+        result = {}
+        while self._token is not None and self._token != ("punct", "}"):
+            kind, key = self._token
+            if kind == "punct" and key in ",:]":
+                self._advance()
+                continue
+            key = self._value()
+            result[str(key)] = None
+            if self._token == ("punct", ":"):
+                self._advance()
+                if self._token is not None and not (self._token[0] == "punct" and self._token[1] in ",}]"):
+                    result[str(key)] = self._value()
+        self._advance()
+        return result
+
+    def _array(self) -> list:
+        result = []
+        while self._token is not None and self._token != ("punct", "]"):
+            if self._token[0] == "punct" and self._token[1] in ",:}":
+                self._advance()
+                continue
+            result.append(self._value())
+        self._advance()
+        return result
+
+
+def parse_values(text: str) -> List[Any]:
+    """
+    Parses the concatenated top-level values of a text, with the C decoder if the text is valid JSON and with
+    the lenient parser otherwise.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[Any]: The values.
+
+    Raises:
+        RecursionError: If the values are nested deeper than the recursion limit.
+    """
+    decoder = json.JSONDecoder()
+    values = []
+    position = SEPARATOR_PATTERN.match(text).end()
+    try:
+        while position < len(text):
+            value, position = decoder.raw_decode(text, position)
+            values.append(value)
+            position = SEPARATOR_PATTERN.match(text, position).end()
+    except json.JSONDecodeError:
+        values = LenientParser(text).values()
+    return values
+
+
+def parse_specs(text: str) -> List[Dict[str, Any]]:
+    """
+    Parses the function specs of a glaive system prompt: JSON objects separated by whitespace, possibly in a
+    list. Valid JSON is decoded object by object with the C decoder, anything else with the lenient parser,
+    both in time linear in the text. Values nested too deeply to parse make the text have no specs.
+
+    Args:
+        text (str): The specs.
+
+    Returns:
+        List[Dict[str, Any]]: The specs, without the values that are not objects.
+    """
+    try:
+        values = parse_values(text)
+    except RecursionError:
+        return []
+
+    specs = []
+    for value in values:
+        specs.extend(spec for spec in (value if isinstance(value, list) else [value]) if isinstance(spec, dict))
+    return specs
+
+
+def parse_to_list_of_dicts_general(text: str) -> List[Dict[str, Any]]:
+    """
+    Parses a given text into a list of dictionaries, handling common JSON formatting issues. Superseded by
+    `parse_specs`, which runs in linear time, and kept as its reference in `bench_specs.py` and the tests.
+
+    Args:
+        text (str): The input text to be parsed.
+
+    Returns:
+        List[Dict[str, Any]]: A list of dictionaries parsed from the text.
+    """
+    text = re.sub(r"(?<!\\)'(?!s\b)(?=[^']*(?:'[^']*'[^']*)*$)", '"', text)
+    text = re.sub(r"\\(')", r"\1", text)
+    text = re.sub(
+        r'(?<!\\)(")((?:.(?!(?<!\\)"))*.)(")', lambda m: m.group(1) + m.group(2).replace('"', '\\"') + m.group(3), text
+    )
+
+    if not text.strip().startswith("["):
+        corrected_text = re.sub(r"\}\s*\{", "},{", text)
+        corrected_text = f"[{corrected_text}]"
+    else:
+        corrected_text = text
+
+    try:
+        parsed_dicts = json.loads(corrected_text)
+        if not isinstance(parsed_dicts, list):
+            parsed_dicts = [parsed_dicts]
+    except json.JSONDecodeError as e:
+        print(f"JSON Decode Error: {e}")
+        print(f"Problematic text: {corrected_text}")
+        try:
+            fixed_text = re.sub(r"([{,]\s*)(\w+)(\s*:)", r'\1"\2"\3', corrected_text)
+            parsed_dicts = json.loads(fixed_text)
+            if not isinstance(parsed_dicts, list):
+                parsed_dicts = [parsed_dicts]
+        except json.JSONDecodeError:
+            print("Failed to fix JSON. Returning empty list.")
+            parsed_dicts = []
+
+    return parsed_dicts
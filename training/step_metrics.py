@@ -0,0 +1,128 @@
+import json
+import os
+import resource
+import time
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import TrainerCallback
+
+
+def peak_memory_mb() -> float:
+    """
+    Measures the peak memory of the process: the CUDA memory allocated since the last reset on GPU, the
+    resident set size since the start of the process on CPU.
+
+    Returns:
+        float: The peak memory, in MiB.
+    """
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StepMetrics:
+    """
+    Measures the optimizer steps of a training run and appends one JSON line per step to a log: its wall
+    time, the tokens and samples it processed, their rates and the peak memory.
+
+    Attributes:
+        path (Optional[str]): The JSONL log, nothing is written if not set.
+        tokens (int): Tokens of the current step, padding excluded when there is an attention mask.
+        samples (int): Samples of the current step.
+        started_at (float): Start of the current step.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.tokens = 0
+        self.samples = 0
+        self.started_at = time.perf_counter()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def begin(self) -> None:
+        self.tokens = 0
+        self.samples = 0
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self.started_at = time.perf_counter()
+
+    def observe(self, inputs: Dict[str, Any]) -> None:
+        """
+        Counts the tokens and samples of a micro-batch of the current step.
+
+        Args:
+            inputs (Dict[str, Any]): The micro-batch, with `input_ids` and optionally `attention_mask`.
+        """
+        input_ids = inputs["input_ids"]
+        mask = inputs.get("attention_mask")
+        self.tokens += int(mask.sum()) if mask is not None else input_ids.numel()
+        self.samples += input_ids.shape[0]
+
+    def end(self, step: int) -> Dict[str, Any]:
+        """
+        Closes the current step and logs it.
+
+        Args:
+            step (int): The number of the step.
+
+        Returns:
+            Dict[str, Any]: The metrics of the step.
+        """
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        wall_time = time.perf_counter() - self.started_at
+        record = {
+            "step": step,
+            "wall_time": round(wall_time, 4),
+            "tokens": self.tokens,
+            "samples": self.samples,
+            "tokens_per_second": round(self.tokens / wall_time, 2),
+            "samples_per_second": round(self.samples / wall_time, 3),
+            "peak_memory_mb": round(peak_memory_mb(), 1),
+        }
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+
+class StepMetricsCallback(TrainerCallback):
+    """
+    Trainer callback timing the optimizer steps into `StepMetrics`. The micro-batches are counted by
+    `observe_training_steps`, as callbacks do not see the inputs.
+
+    Attributes:
+        metrics (StepMetrics): The step metrics.
+    """
+
+    def __init__(self, metrics: StepMetrics):
+        self.metrics = metrics
+
+    def on_step_begin(self, args: Any, state: Any, control: Any, **kwargs: Any) -> None:
+        """Starts timing an optimizer step, before its first micro-batch."""
+        self.metrics.begin()
+
+    def on_step_end(self, args: Any, state: Any, control: Any, **kwargs: Any) -> None:
+        """Logs an optimizer step on the main process."""
+        if state.is_world_process_zero:
+            self.metrics.end(state.global_step)
+
+
+def observe_training_steps(trainer: Any, metrics: StepMetrics) -> None:
+    """
+    Instruments a trainer: wraps its training step to count the micro-batches and adds the step callback.
+
+    Args:
+        trainer (Any): The `transformers.Trainer`.
+        metrics (StepMetrics): The step metrics.
+    """
+    training_step = trainer.training_step
+
+    def observed_training_step(model: Any, inputs: Dict[str, Any], *args: Any, **kwargs: Any) -> Any:
+        metrics.observe(inputs)
+        return training_step(model, inputs, *args, **kwargs)
+
+    trainer.training_step = observed_training_step
+    trainer.add_callback(StepMetricsCallback(metrics))
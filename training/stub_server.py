@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+
+def fake_instance(schema: Dict[str, Any], definitions: Dict[str, Any]) -> Any:
+    """
+    Builds a minimal instance of a JSON schema, with every required property and one item per array.
+
+    Args:
+        schema (Dict[str, Any]): The schema.
+        definitions (Dict[str, Any]): The `$defs` the schema refers to.
+
+    Returns:
+        Any: The instance.
+    """
+    if "$ref" in schema:
+        return fake_instance(definitions[schema["$ref"].rsplit("/", 1)[-1]], definitions)
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [option for option in schema[key] if option.get("type") != "null"] or schema[key]
+            return fake_instance(options[0], definitions)
+    kind = schema.get("type")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: fake_instance(properties[name], definitions) for name in schema.get("required", properties)}
+    if kind == "array":
+        return [fake_instance(schema.get("items", {}), definitions)]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    if kind == "null":
+        return None
+    return "заглушка"
+
+
+def fake_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Answers a chat completion request with the user message, or with a minimal instance of the requested
+    JSON schema.
+
+    Args:
+        body (Dict[str, Any]): The request.
+
+    Returns:
+        Dict[str, Any]: The chat completion.
+    """
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        content = json.dumps(fake_instance(schema, schema.get("$defs", {})), ensure_ascii=False)
+    else:
+        content = str(body["messages"][-1].get("content", ""))
+    prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in body["messages"])
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class StubServer:
+    """
+    Local OpenAI-compatible chat completion server, used to run the dataset generation without the API.
+
+    It answers with the user message, or with a minimal instance of the requested JSON schema, after a
+    simulated latency. It enforces its own requests-per-minute quota with 429 responses carrying a
+    `Retry-After` header, and fails a share of the requests with 500 responses.
+
+    Attributes:
+        latency (float): Seconds every request takes.
+        requests_per_minute (int): The quota, 0 for no limit.
+        error_rate (float): Share of the requests failed with a server error.
+        served (int): Number of completions returned.
+        rejected (int): Number of requests rejected by the quota.
+        failed (int): Number of requests failed on purpose.
+    """
+
+    def __init__(self, latency: float = 0.2, requests_per_minute: int = 0, error_rate: float = 0.0):
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.served = 0
+        self.rejected = 0
+        self.failed = 0
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        retry_after = self._admit()
+        if retry_after is not None:
+            self.rejected += 1
+            return self._error(429, "Rate limit reached", {"Retry-After": f"{retry_after:.2f}"})
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.failed += 1
+            return self._error(500, "Simulated server error")
+
+        self.served += 1
+        return web.json_response(fake_completion(body))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"served": self.served, "rejected": self.rejected, "failed": self.failed})
+
+    def _admit(self) -> Optional[float]:
+        if not self.requests_per_minute:
+            return None
+        now = time.monotonic()
+        if now - self._window_start >= 60:
+            self._window_start, self._window_requests = now, 0
+        if self._window_requests >= self.requests_per_minute:
+            return 60 - (now - self._window_start)
+        self._window_requests += 1
+        return None
+
+    @staticmethod
+    def _error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        return web.json_response(
+            {"error": {"message": message, "type": "stub_error", "param": None, "code": None}},
+            status=status,
+            headers=headers,
+        )
+
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    Parses command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments as a Namespace object.
+    """
+    parser = argparse.ArgumentParser(description="Serve a local OpenAI-compatible chat completion stub.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds every request takes.")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the requests answered with 500.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """
+    Serves the stub at `http://<host>:<port>/v1`, to pass as `--base-url` to `create_datasets.py`.
+    """
+    args = parse_arguments()
+    server = StubServer(args.latency, args.rpm, args.error_rate)
+    web.run_app(server.app(), host=args.host, port=args.port)